@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP client for the HydroVu and GitHub APIs.
+
+ApiClient wraps one requests.Session so connections are kept alive and reused between
+calls instead of paying a new TLS handshake on every page. On top of that it:
+ - retries 429 and 5xx responses (and dropped connections) with exponential backoff,
+   honouring a Retry-After header when the server sends one
+ - fetches the OAuth token the first time it is needed, and fetches a new one
+   whenever a 401 comes back, so long runs survive token expiry
+ - keeps per-endpoint counters: calls, errors, retries, bytes received and latency
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ApiClient:
+    """
+    token_fetcher: function returning a fresh access token, or None for endpoints without OAuth
+    limiter: optional RateLimiter (rate_limit.py) wrapped around every request
+    """
+    def __init__(self, default_headers=None, token_fetcher=None, auth_scheme="Bearer",
+                 limiter=None, max_retries=5, backoff_seconds=1.0, max_backoff_seconds=60.0,
+                 timeout=60, pool_size=16):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if default_headers:
+            self.session.headers.update(default_headers)
+
+        self.token_fetcher = token_fetcher
+        self.auth_scheme = auth_scheme
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout = timeout
+
+        self.token = None
+        self.token_lock = threading.Lock()
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    # Fetches a new token unless another thread already replaced the one that failed
+    def refresh_token(self, stale_token=None):
+        with self.token_lock:
+            if self.token is None or self.token == stale_token:
+                self.token = self.token_fetcher()
+            return self.token
+
+    def _auth_headers(self):
+        if self.token_fetcher is None:
+            return {}
+        token = self.token if self.token is not None else self.refresh_token()
+        return {"Authorization" : f"{self.auth_scheme} {token}"}
+
+    def _record(self, endpoint, seconds, ok, retried, response=None):
+        received = len(response.content) if response is not None else 0
+        with self.stats_lock:
+            entry = self.stats.setdefault(endpoint, {"calls" : 0, "errors" : 0, "retries" : 0, "bytes" : 0,
+                                                     "total_seconds" : 0.0, "max_seconds" : 0.0})
+            entry["calls"] += 1
+            entry["bytes"] += received
+            entry["errors"] += 0 if ok else 1
+            entry["retries"] += 1 if retried else 0
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def _backoff(self, attempt, response=None):
+        delay = min(self.backoff_seconds * (2 ** attempt), self.max_backoff_seconds)
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            delay = min(float(response.headers["Retry-After"]), self.max_backoff_seconds)
+        time.sleep(delay)
+
+    # endpoint is the label the latency counters are kept under (defaults to the method and url)
+    # Returns the final response; only connection errors that outlast every retry are raised
+    def request(self, method, url, endpoint=None, **kwargs):
+        endpoint = endpoint or f"{method} {url}"
+        kwargs.setdefault("timeout", self.timeout)
+        extra_headers = kwargs.pop("headers", None) or {}
+        refreshed = False
+        attempt = 0
+        while True:
+            headers = {**self._auth_headers(), **extra_headers}
+            sent_token = self.token
+            start = time.perf_counter()
+            try:
+                if self.limiter is not None:
+                    with self.limiter:
+                        response = self.session.request(method, url, headers=headers, **kwargs)
+                else:
+                    response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(endpoint, time.perf_counter() - start, False, attempt < self.max_retries)
+                if attempt >= self.max_retries:
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+
+            if response.status_code == 401 and self.token_fetcher is not None and not refreshed:
+                self._record(endpoint, time.perf_counter() - start, False, True, response)
+                self.refresh_token(sent_token) # token expired mid-run, get a new one and try again
+                refreshed = True
+                continue
+
+            retry = response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries
+            self._record(endpoint, time.perf_counter() - start, response.ok, retry, response)
+            if not retry:
+                return response
+            self._backoff(attempt, response)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    # One line per endpoint, e.g. for printing at the end of a run
+    def stats_summary(self):
+        lines = []
+        with self.stats_lock:
+            for endpoint, entry in sorted(self.stats.items()):
+                average = entry["total_seconds"] / entry["calls"] if entry["calls"] else 0.0
+                lines.append(f"{endpoint}: {entry['calls']} calls, {entry['errors']} errors, "
+                             f"{entry['retries']} retries, {entry['bytes']} bytes, avg {average:.3f}s, max {entry['max_seconds']:.3f}s")
+        return "\n".join(lines)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, resumable backfill planner for building a new location's history.
+
+build_csv pages through the whole date range on one chain of requests, because each
+page's startTime comes from the previous page's last timestamp. The backfill planner
+instead splits the range into independent time windows, fetches the windows at the
+same time, and stitches the results back together.
+
+Every finished window is spooled to <spool folder>/<location>/ and listed in
+checkpoint.json, so an interrupted backfill picks up at the windows still missing.
+"""
+
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import file_io
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+# Splits [start, end] (epoch seconds) into consecutive windows of window_seconds
+# Neighbouring windows share their boundary second; stitch_windows drops the repeat
+def plan_windows(start, end, window_seconds):
+    windows = []
+    window_start = int(start)
+    while window_start < end:
+        window_end = min(window_start + int(window_seconds), int(end))
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+def window_key(window):
+    return f"{window[0]}-{window[1]}"
+
+
+def load_checkpoint(loc_folder):
+    path = os.path.join(loc_folder, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_checkpoint(loc_folder, checkpoint):
+    file_io.write_json(os.path.join(loc_folder, CHECKPOINT_FILE), checkpoint)
+
+
+# Saves one window's parameter dataframes; the window only counts as done once all of them are on disk
+def _spool_window(loc_folder, window, param_dfs):
+    window_folder = os.path.join(loc_folder, window_key(window))
+    os.makedirs(window_folder, exist_ok=True)
+    for param_name, df in param_dfs.items():
+        df.to_parquet(os.path.join(window_folder, f"{param_name}.parquet"), index=False)
+
+
+# Concatenates spooled windows in time order, trims to [start, end] and drops the rows
+# repeated where one window (or page) ends and the next begins
+def stitch_windows(loc_folder, windows, start, end):
+    frames_by_param = {}
+    for window in windows: # windows are already in time order
+        window_folder = os.path.join(loc_folder, window_key(window))
+        if not os.path.isdir(window_folder):
+            continue
+        for name in sorted(os.listdir(window_folder)):
+            param_name = os.path.splitext(name)[0]
+            frames_by_param.setdefault(param_name, []).append(pd.read_parquet(os.path.join(window_folder, name)))
+
+    stitched = {}
+    for param_name, frames in frames_by_param.items():
+        df = pd.concat(frames, ignore_index=True)
+        df = df[(df["timestamp"] >= start) & (df["timestamp"] <= end)]
+        df = df.sort_values("timestamp", kind="stable").drop_duplicates(subset="timestamp", keep="first")
+        stitched[param_name] = df.reset_index(drop=True)
+    return stitched
+
+
+"""
+Runs (or resumes) a backfill for one location.
+fetch_window(window_start, window_end) must return a dict of param_name -> dataframe
+for that window. If a checkpoint for the location already exists, its original plan
+is reused and only the unfinished windows are fetched. Returns the stitched
+param_name -> dataframe dict once every window is done.
+"""
+def run_backfill(loc, start, end, fetch_window, spool_folder, window_seconds, max_workers=4):
+    loc_folder = os.path.join(spool_folder, loc)
+    os.makedirs(loc_folder, exist_ok=True)
+
+    checkpoint = load_checkpoint(loc_folder)
+    if checkpoint is None:
+        checkpoint = {"start" : int(start), "end" : int(end),
+                      "window_seconds" : int(window_seconds), "done" : []}
+        _save_checkpoint(loc_folder, checkpoint)
+    else:
+        print(f"Resuming {loc} backfill: {len(checkpoint['done'])} windows already done")
+
+    windows = plan_windows(checkpoint["start"], checkpoint["end"], checkpoint["window_seconds"])
+    todo = [w for w in windows if window_key(w) not in checkpoint["done"]]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fetch_window, w[0], w[1]) : w for w in todo}
+        for future in as_completed(futures):
+            window = futures[future]
+            if future.exception() is not None: # keep saving the other windows, this one is retried on resume
+                print(f"{loc} backfill window {window_key(window)} failed: {future.exception()!r}")
+                failed.append(window)
+                continue
+            _spool_window(loc_folder, window, future.result())
+            # only this (main) thread touches the checkpoint, so no lock is needed
+            checkpoint["done"].append(window_key(window))
+            _save_checkpoint(loc_folder, checkpoint)
+            print(f"{loc} backfill: {len(checkpoint['done'])}/{len(windows)} windows done")
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} backfill windows failed for {loc}; run the backfill again to resume")
+
+    return stitch_windows(loc_folder, windows, checkpoint["start"], checkpoint["end"])
+
+
+# Removes a location's spool and checkpoint once the stitched data has been saved
+def clear_checkpoint(spool_folder, loc):
+    shutil.rmtree(os.path.join(spool_folder, loc), ignore_errors=True)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end ingestion benchmark against the local fake HydroVu server (fake_hydrovu.py).
+
+1x is our current data volume: the longest history any location holds in the store main is
+configured with (see config.py), or BASE_DAYS when that store is empty. The fake logs every
+15 minutes like the sondes, so days of history are a fair measure of volume. For each data
+volume scale (1x, 10x, 100x) it:
+    1. starts a fake HydroVu with that much synthetic history, ending UPDATE_HOURS ago
+    2. runs main.build_csv for every location into a temporary folder
+    3. moves the fake's end time to now and runs main.update_csv for every location
+and reports pages/second, rows/second and peak traced memory for each step. tracemalloc slows
+Python down several times, so each step is timed untraced, then run again from the same
+starting point under tracemalloc for the peak memory.
+
+Usage:
+    python bench_ingest.py                        # 1x, 10x and 100x
+    python bench_ingest.py --scales 1 10 --json bench.json
+    python bench_ingest.py --latency 0.05         # add 50 ms to every request
+    python bench_ingest.py --base-days 400        # 1x = 400 days instead of the stored history
+    python bench_ingest.py --no-memory            # timings only, without the traced runs
+Run this before and after every ingestion change and compare the numbers.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import fake_hydrovu
+import local_store
+import watermarks
+from rate_limit import RateLimiter
+from run_report import RunReport
+
+BASE_DAYS = 30     # history per location at 1x when the configured store has none to measure
+UPDATE_HOURS = 6   # new data fetched by the update step
+
+
+# Points main.py at the fake server and a temporary data folder
+def configure_main(main, fake, data_folder, store_format):
+    for name, value in fake.endpoints().items():
+        setattr(main, name, value)
+    main.location_ids.clear()
+    main.location_ids.update(fake.locations)
+    main.parameter_dict.update({pid : p[0] for pid, p in fake_hydrovu.SYNTHETIC_PARAMS.items()})
+    main.unit_dict.update(fake_hydrovu.SYNTHETIC_UNITS)
+    main.BUILD_CSV_FOLDER = data_folder
+    main.CSV_FOLDER = data_folder
+    main.STORE_FOLDER = os.path.join(data_folder, "_store")
+    main.STORE_FORMAT = store_format
+    main.page_cache = None # every page comes from the fake server, as on a first run
+    main.metadata_registry.cache_path = None # nor is the fake's metadata written over the real cache
+    main.hydrovu_client.token = None # the fake issues its own tokens
+    main.hydrovu_client.limiter = RateLimiter(10000, 64) # measure our code, not the production rate limit
+    empty_data_folder(data_folder, fake.locations)
+
+
+# A data folder with an empty folder per location, as before a first build_csv
+def empty_data_folder(data_folder, locations):
+    shutil.rmtree(data_folder, ignore_errors=True)
+    for loc in locations:
+        os.makedirs(os.path.join(data_folder, loc), exist_ok=True)
+
+
+def restore_folder(snapshot, data_folder):
+    shutil.rmtree(data_folder, ignore_errors=True)
+    shutil.copytree(snapshot, data_folder)
+
+
+# Days from the first to the last stored reading of a parameter in main's configured store,
+# or None if it holds no readings
+def stored_span_days(main, loc, param):
+    if main.STORE_FORMAT == "parquet":
+        files = local_store.partition_files(main.STORE_FOLDER, loc, param)
+        if not files:
+            return None
+        first = pd.read_parquet(files[0], columns=["timestamp"])["timestamp"].min()
+        last = local_store.last_timestamp(main.STORE_FOLDER, loc, param)
+    else:
+        path = os.path.join(main.CSV_FOLDER, loc, f"{param}.csv")
+        first_rows = pd.read_csv(path, nrows=1, usecols=["timestamp"])["timestamp"]
+        first = first_rows.iloc[0] if not first_rows.empty else None
+        last = watermarks.tail_timestamp(path)
+    if first is None or pd.isna(first) or last is None:
+        return None
+    return (last - int(first)) / 86400
+
+
+# The longest history any location parameter holds in the store main is configured with (whole
+# days), i.e. our current data volume; None if there is nothing stored there
+def stored_history_days(main):
+    root = main.STORE_FOLDER if main.STORE_FORMAT == "parquet" else main.CSV_FOLDER
+    if not root or not os.path.isdir(root):
+        return None
+    spans = [stored_span_days(main, loc, param) for loc in sorted(os.listdir(root))
+             if os.path.isdir(os.path.join(root, loc)) and not loc.startswith("_")
+             for param in main.stored_params(loc)]
+    spans = [span for span in spans if span is not None]
+    return math.ceil(max(spans)) if spans else None
+
+
+# Times step() untraced and returns wall time, pages, rows and main's per-stage timings. With
+# trace_memory, reset() then puts the data back where step() started from and step() runs again
+# under tracemalloc for the peak memory, which would otherwise slow the timed run down
+def measure(main, fake, step, reset, trace_memory=True):
+    main.run_report = RunReport()
+    pages_before = fake.counters["data_pages"]
+    rows_before = fake.counters["readings"]
+    start = time.perf_counter()
+    step()
+    seconds = time.perf_counter() - start
+    pages = fake.counters["data_pages"] - pages_before
+    rows = fake.counters["readings"] - rows_before
+    stages = main.run_report.as_dict()["stages"]
+
+    peak = None
+    if trace_memory:
+        reset()
+        tracemalloc.start()
+        step()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"seconds" : round(seconds, 3), "pages" : pages, "rows" : rows,
+            "pages_per_second" : round(pages / seconds, 1) if seconds else None,
+            "rows_per_second" : round(rows / seconds, 1) if seconds else None,
+            "peak_memory_mb" : round(peak / 2**20, 1) if peak is not None else None,
+            "stages" : stages}
+
+
+def run_scale(main, scale, base_days, latency, error_rate, store_format, trace_memory=True):
+    days = base_days * scale
+    now = int(time.time())
+    fake = fake_hydrovu.FakeHydroVu(history_days=days, end_time=now - UPDATE_HOURS * 3600,
+                                    latency=latency, error_rate=error_rate)
+    fake.start()
+    data_folder = tempfile.mkdtemp(prefix="bench_ingest_")
+    snapshot = data_folder + "_built" # the data as build_csv left it, for update_csv's traced run
+    try:
+        configure_main(main, fake, data_folder, store_format)
+        build = measure(main, fake, lambda: [main.build_csv(loc, days + 1) for loc in fake.locations],
+                        lambda: empty_data_folder(data_folder, fake.locations), trace_memory)
+        fake.end_time = now // fake.interval * fake.interval # new readings show up
+        if trace_memory:
+            shutil.copytree(data_folder, snapshot)
+        update = measure(main, fake, lambda: [main.update_csv(loc) for loc in fake.locations],
+                         lambda: restore_folder(snapshot, data_folder), trace_memory)
+    finally:
+        fake.stop()
+        shutil.rmtree(data_folder, ignore_errors=True)
+        shutil.rmtree(snapshot, ignore_errors=True)
+    return {"scale" : f"{scale}x", "days" : days, "locations" : len(fake.locations),
+            "build_csv" : build, "update_csv" : update}
+
+
+def print_report(results):
+    print(f"{'scale':>6} {'days':>6} {'step':>10} {'seconds':>9} {'pages':>7} {'pages/s':>9} {'rows':>10} {'rows/s':>11} {'peak MB':>8}")
+    for result in results:
+        for step in ("build_csv", "update_csv"):
+            r = result[step]
+            peak = r['peak_memory_mb'] if r['peak_memory_mb'] is not None else "-" # --no-memory
+            print(f"{result['scale']:>6} {result['days']:>6} {step:>10} {r['seconds']:>9} {r['pages']:>7} {r['pages_per_second']:>9} "
+                  f"{r['rows']:>10} {r['rows_per_second']:>11} {peak:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark build_csv/update_csv against a fake HydroVu")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of data calls that fail")
+    parser.add_argument("--store-format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--base-days", type=int,
+                        help="days of history per location at 1x (default: the longest history in the configured store)")
+    parser.add_argument("--config", help="settings file whose store 1x is measured from (see config.py)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced runs that measure peak memory")
+    parser.add_argument("--json", help="also write the results to this json file")
+    args = parser.parse_args()
+
+    import main # imported here so its module-level setup runs after argument parsing
+
+    main.configure(args.config)
+    base_days = args.base_days or stored_history_days(main)
+    if base_days is None:
+        print(f"No stored data to measure, 1x is BASE_DAYS ({BASE_DAYS} days)")
+        base_days = BASE_DAYS
+    else:
+        print(f"1x is {base_days} days of history per location")
+    results = [run_scale(main, scale, base_days, args.latency, args.error_rate, args.store_format,
+                         not args.no_memory) for scale in args.scales]
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
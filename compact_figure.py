@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Compact figure pages: binary typed-array data and one shared JS shell.
+
+A page from fig.write_html spells out every timestamp as a date string, every value as
+decimal text, and repeats the same plotly template (about 10 kB) and script boilerplate.
+compact_page() writes the same figure with:
+ - x and y as base64 typed arrays ({"dtype" : ..., "bdata" : ...}) instead of text: dates as int32
+   second steps (epoch milliseconds of the local time convert_dates showed, on a date axis) and
+   readings as int32 scaled by their number of decimals, so both round-trip exactly
+ - no template; the shared shell (SHELL_PATH) adds it in the browser
+ - no boilerplate beyond two script tags and a call to renderFigure()
+shell_js() is the shared shell. It turns the typed arrays back into Float64Arrays for
+plotly.js, and is published once for the whole tree (see main.publish_shell).
+Spec keys on top of plotly's own typed arrays: value = offset + (delta ? running sum : raw) * scale / divisor
+"""
+
+import base64
+import json
+import posixpath
+from datetime import datetime
+
+import numpy as np
+
+SHELL_PATH = "assets/js/figure_shell.js"
+
+# Typed-array codes plotly uses
+TYPED_ARRAYS = {"f8" : "Float64Array", "f4" : "Float32Array", "i4" : "Int32Array", "u4" : "Uint32Array",
+                "i2" : "Int16Array", "u2" : "Uint16Array", "i1" : "Int8Array", "u1" : "Uint8Array",
+                "u1c" : "Uint8ClampedArray"}
+NUMPY_TYPES = {"f8" : "<f8", "f4" : "<f4", "i4" : "<i4", "u4" : "<u4", "i2" : "<i2", "u2" : "<u2",
+               "i1" : "i1", "u1" : "u1", "u1c" : "u1"}
+INT32_LIMIT = 2**31 - 1
+MAX_DECIMALS = 6
+
+
+def encode_array(values, dtype="f8", **scaling):
+    values = np.ascontiguousarray(values, dtype=NUMPY_TYPES[dtype])
+    return {"dtype" : dtype, "bdata" : base64.b64encode(values.tobytes()).decode("ascii"), **scaling}
+
+
+def decode_array(spec):
+    return np.frombuffer(base64.b64decode(spec["bdata"]), dtype=NUMPY_TYPES[spec["dtype"]])
+
+
+# Readings are stored with a few decimals, so value * 10**decimals is a whole number that fits
+# an int32 (4 bytes instead of 8); the shell divides it back, which gives the same double.
+# Falls back to float64 for anything that doesn't fit (NaN, too many decimals, huge values)
+def encode_values(values):
+    values = np.asarray(values, dtype=np.float64)
+    if values.size and np.isfinite(values).all():
+        for decimals in range(MAX_DECIMALS + 1):
+            divisor = 10 ** decimals
+            scaled = np.round(values * divisor)
+            if np.abs(scaled).max() > INT32_LIMIT:
+                break
+            if np.array_equal(scaled / divisor, values):
+                return encode_array(scaled, "i4", divisor=divisor)
+    return encode_array(values)
+
+
+# Epoch milliseconds of whole seconds, stored as int32 second steps from the first one
+# (readings are minutes apart, so the steps are small and repeat, which gzip shrinks further)
+def encode_times(milliseconds):
+    milliseconds = np.asarray(milliseconds, dtype=np.float64)
+    if milliseconds.size and np.isfinite(milliseconds).all() and not (milliseconds % 1000).any():
+        seconds = (milliseconds // 1000).astype(np.int64)
+        steps = np.diff(seconds, prepend=seconds[0])
+        if np.abs(steps).max() <= INT32_LIMIT:
+            return encode_array(steps, "i4", offset=float(milliseconds[0]), scale=1000, delta=True)
+    return encode_array(milliseconds)
+
+
+# Naive (local) datetimes -> epoch milliseconds as plotly reads them, so the axis shows the same local times
+def local_milliseconds(values):
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[ms]").astype(np.int64).astype(np.float64)
+    stamps = [value if isinstance(value, datetime) else datetime.fromisoformat(str(value)) for value in values]
+    return np.array(stamps, dtype="datetime64[ms]").astype(np.int64).astype(np.float64)
+
+
+# x/y column -> compact typed array, plus whether it held dates
+def _compact_column(values):
+    if isinstance(values, dict) and "bdata" in values: # already a typed array from plotly
+        if "shape" in values:
+            return values, False
+        values = decode_array(values)
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64) or values.dtype == object or values.dtype.kind in "US":
+        return encode_times(local_milliseconds(values)), True
+    return encode_values(values), False
+
+
+# The figure's json with typed-array data and without the template
+def compact_figure_json(fig):
+    figure = fig.to_plotly_json()
+    layout = figure.get("layout", {})
+    layout.pop("template", None)
+    for trace in figure["data"]:
+        for axis in ("x", "y"):
+            if axis not in trace:
+                continue
+            trace[axis], is_date = _compact_column(trace[axis])
+            if is_date:
+                axis_name = trace.get(f"{axis}axis", axis).replace(axis, f"{axis}axis", 1)
+                layout.setdefault(axis_name, {})["type"] = "date"
+    figure["layout"] = layout
+    return figure
+
+
+def plotlyjs_url():
+    from plotly.offline import get_plotlyjs_version
+    return f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+
+# A full html page for fig at figure_path (a repo path, used to find the shell relative to the page)
+def compact_page(fig, figure_path, title=""):
+    shell_src = posixpath.relpath(SHELL_PATH, posixpath.dirname(figure_path) or ".")
+    figure_json = json.dumps(compact_figure_json(fig), separators=(",", ":"), default=str)
+    figure_json = figure_json.replace("</", "<\\/") # keeps the json from closing the script tag
+    return ("<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\" />"
+            f"<title>{title}</title>\n"
+            f"<script src=\"{plotlyjs_url()}\"></script>\n"
+            f"<script src=\"{shell_src}\"></script></head>\n"
+            "<body style=\"margin:0\"><div id=\"plot\" style=\"height:100vh; width:100%;\"></div>\n"
+            f"<script type=\"application/json\" id=\"figure\">{figure_json}</script>\n"
+            "<script>renderFigure(\"plot\", \"figure\");</script>\n</body>\n</html>\n")
+
+
+# The shared shell: the default plotly template, typed-array decoding and renderFigure()
+def shell_js():
+    import plotly.io as pio
+    template = json.dumps(pio.templates[pio.templates.default].to_plotly_json(), separators=(",", ":"))
+    return ("// Shared loader for the compact figure pages (written by compact_figure.py)\n"
+            f"var FIGURE_TEMPLATE = {template};\n"
+            f"var TYPED_ARRAYS = {json.dumps(TYPED_ARRAYS)};\n"
+            "function decodeTyped(spec) {\n"
+            "  var raw = atob(spec.bdata);\n"
+            "  var bytes = new Uint8Array(raw.length);\n"
+            "  for (var i = 0; i < raw.length; i++) { bytes[i] = raw.charCodeAt(i); }\n"
+            "  var values = new window[TYPED_ARRAYS[spec.dtype]](bytes.buffer);\n"
+            "  if (spec.offset === undefined && spec.scale === undefined && spec.divisor === undefined && !spec.delta) {\n"
+            "    return values;\n"
+            "  }\n"
+            "  var out = new Float64Array(values.length);\n"
+            "  var offset = spec.offset || 0, scale = spec.scale || 1, divisor = spec.divisor || 1, total = 0;\n"
+            "  for (var j = 0; j < values.length; j++) {\n"
+            "    total = spec.delta ? total + values[j] : values[j];\n"
+            "    out[j] = offset + total * scale / divisor;\n"
+            "  }\n"
+            "  return out;\n"
+            "}\n"
+            "function decodeAll(node) {\n"
+            "  if (Array.isArray(node)) { return node.map(decodeAll); }\n"
+            "  if (node && typeof node === 'object') {\n"
+            "    if (typeof node.bdata === 'string' && TYPED_ARRAYS[node.dtype]) { return decodeTyped(node); }\n"
+            "    for (var key in node) { node[key] = decodeAll(node[key]); }\n"
+            "  }\n"
+            "  return node;\n"
+            "}\n"
+            "function renderFigure(divId, dataId) {\n"
+            "  var figure = decodeAll(JSON.parse(document.getElementById(dataId).textContent));\n"
+            "  figure.layout = figure.layout || {};\n"
+            "  if (!figure.layout.template) { figure.layout.template = FIGURE_TEMPLATE; }\n"
+            "  Plotly.newPlot(divId, figure.data, figure.layout, {responsive: true});\n"
+            "}\n")
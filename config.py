@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Settings file for main.py, so paths and secrets don't have to be edited into the code.
+
+The file is json with main.py's setting names as keys, for example:
+    {
+     "CSV_FOLDER" : "D:/hydrovu/csvs",
+     "STORE_FORMAT" : "parquet",
+     "LOCAL_CLIENT_ID" : "...",
+     "LOCAL_CLIENT_SECRET" : "..."
+    }
+Any setting left out keeps the default written in main.py. The file is found with
+--config, or the HYDROVU_CONFIG environment variable, or hydrovu_config.json next to main.py.
+"""
+
+import json
+import os
+
+CONFIG_ENV_VAR = "HYDROVU_CONFIG"
+DEFAULT_CONFIG_FILE = "hydrovu_config.json"
+
+
+# The config file to use: the given path, the environment variable, or the default file if it exists
+def find_config(path=None, folder=None):
+    if path:
+        return path
+    if os.environ.get(CONFIG_ENV_VAR):
+        return os.environ[CONFIG_ENV_VAR]
+    default_path = os.path.join(folder or os.getcwd(), DEFAULT_CONFIG_FILE)
+    return default_path if os.path.exists(default_path) else None
+
+
+def load_config(path):
+    with open(path, encoding="utf-8") as f:
+        settings = json.load(f)
+    if not isinstance(settings, dict):
+        raise ValueError(f"{path} should hold a json object of setting names and values")
+    return settings
+
+
+# Overwrites the module-level settings in namespace (e.g. globals() of main.py)
+# Only existing upper-case names can be set, so a typo fails instead of being ignored
+def apply_config(namespace, settings):
+    unknown = [name for name in settings if not name.isupper() or name not in namespace]
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    namespace.update(settings)
+    return sorted(settings)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse timestamp index for the parameter csvs, so a time window is read without the rest of the file.
+
+Every parameter csv is sorted by timestamp with no repeats (see main.append_param_df), so the
+byte offset and timestamp of every INDEX_EVERY-th row are enough to find where a window starts
+and ends. read_window() reads only the bytes between those two offsets, which costs about the
+size of the window (plus up to two blocks of INDEX_EVERY rows) however long the archive gets.
+
+The index of <folder>/<param>.csv lives in <folder>/_index/<param>.json:
+    {"size" : bytes indexed, "rows" : rows indexed, "entries" : [[timestamp, byte offset], ...]}
+Appends only add rows past "size", so each read first indexes just the new tail. A csv that
+got shorter, or whose last indexed row is no longer where the index says, is indexed again
+from the start; main.py also drops the index whenever it rewrites a csv.
+"""
+
+import json
+import os
+from bisect import bisect_right
+from io import BytesIO
+
+import pandas as pd
+
+import file_io
+
+INDEX_FOLDER = "_index"
+INDEX_EVERY = 1024
+
+
+def index_path(filename):
+    folder, name = os.path.split(filename)
+    return os.path.join(folder, INDEX_FOLDER, os.path.splitext(name)[0] + ".json")
+
+
+def load_index(filename):
+    path = index_path(filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_index(filename, index):
+    file_io.write_json(index_path(filename), index, indent=None)
+
+
+# Call after rewriting a csv (appending needs nothing, the index catches up on the next read)
+def drop_index(filename):
+    path = index_path(filename)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# Timestamp at the start of a csv line, or None for a header row
+def _line_timestamp(line):
+    try:
+        return int(float(line.split(b",", 1)[0]))
+    except ValueError:
+        return None
+
+
+# True if the file still holds the indexed rows: it is no shorter, and the last entry's row is still in place
+def _still_valid(f, index, size):
+    if index["size"] > size:
+        return False
+    if not index["entries"]:
+        return True
+    timestamp, offset = index["entries"][-1]
+    f.seek(offset)
+    return _line_timestamp(f.readline()) == timestamp
+
+
+# Adds an entry for every INDEX_EVERY-th row past the indexed part of the file
+# A last line without its newline is still being written, and is left for the next read
+def _extend(f, index):
+    f.seek(index["size"])
+    pos = index["size"]
+    for line in f:
+        if not line.endswith(b"\n"):
+            break
+        timestamp = _line_timestamp(line)
+        if timestamp is not None:
+            if index["rows"] % INDEX_EVERY == 0:
+                index["entries"].append([timestamp, pos])
+            index["rows"] += 1
+        pos += len(line)
+    index["size"] = pos
+
+
+# The csv's index, brought up to date with the file (and saved if it changed)
+def update_index(filename):
+    index = load_index(filename)
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        if index is None or not _still_valid(f, index, size):
+            index = {"size" : 0, "rows" : 0, "entries" : []}
+        if index["size"] == size:
+            return index
+        indexed_size = index["size"]
+        _extend(f, index)
+    if index["size"] != indexed_size:
+        _save_index(filename, index)
+    return index
+
+
+# The rows of a csv with start <= timestamp <= end (epoch seconds, either one may be None),
+# with the csv's own columns
+def read_window(filename, start=None, end=None):
+    index = update_index(filename)
+    stamps = [timestamp for timestamp, offset in index["entries"]]
+    with open(filename, "rb") as f:
+        header = f.readline()
+        if not stamps:
+            return pd.read_csv(BytesIO(header))
+        # from the block holding start to the block after the one holding end
+        first = max(bisect_right(stamps, start) - 1, 0) if start is not None else 0
+        last = bisect_right(stamps, end) if end is not None else len(stamps)
+        begin = index["entries"][first][1]
+        stop = index["entries"][last][1] if last < len(stamps) else index["size"]
+        f.seek(begin)
+        chunk = f.read(stop - begin)
+    df = pd.read_csv(BytesIO(header + chunk))
+    timestamps = pd.to_numeric(df["timestamp"], errors="coerce")
+    keep = timestamps.notna()
+    if start is not None:
+        keep &= timestamps >= start
+    if end is not None:
+        keep &= timestamps <= end
+    return df[keep].reset_index(drop=True)
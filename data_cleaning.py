@@ -5,61 +5,52 @@ Created on Wed Apr 22 14:04:05 2026
 @author: GIS
 """
 
-import glob
 import os
-import pandas as pd
+import qc_rules # Declarative QC rules, evaluated in one pass per location
 
-location_ids = {
-    "Lower Langford Creek AquaTroll" : 4840973161857024,
-    "Radcliffe Outflow AquaTroll" : 5276098860482560,
-    "Millington AquaTroll" : 5687072567394304,
-    "SE Creek AquaTroll" : 6000235094540288,
-    "Shipyard Landing Dock AquaTroll" : 6228783747956736,
-    "Upper East Langford Dock AquaTroll" : 6235146771365888,
-    "Morgan Creek AquaTroll" : 6265987319005184    
-}
+# Paths and rules come from main.py's settings, which a settings file can change (see config.py).
+# main.clean_locations sets them before cleaning; run as a script, this file goes through it too
+CSV_FOLDER = None
+STORE_FOLDER = None # parquet store (see local_store.py)
 
-# timestamps allow us to connect data rows across csvs
-# depth_outlier_timestamps grabs all of the timestamps where depth is not logical
-def depth_outlier_timestamps(filename, df):
-    df['value'] = pd.to_numeric(df['value'], errors='coerce')
-    outlier_times = df[(df['value'] < 0)]['timestamp'].tolist() 
-    print(outlier_times)
-    return outlier_times
+# Each location is read once and every rule in QC_RULES that applies to it is checked in the same pass.
+# main.clean_locations sets this from main.py's QC_RULES setting, where a settings file (see config.py)
+# gives the sites' thresholds; see qc_rules.py for the rule types.
+QC_RULES = qc_rules.DEFAULT_RULES
 
-#cycles through all the csvs from input location
+# True only cleans rows appended since the last run (plus a short look-back for the rate rules)
+# False re-checks every row, e.g. after changing QC_RULES
+INCREMENTAL = True
+
+# Flags go to <location folder>/_qc_flags.csv; the csvs themselves are left as they are.
+# main.py leaves flagged readings out of the plots.
 def clean_csv(loc):
-    #call each csv from folder
-    folder_path = f"C:\\Users\\GIS\\MichaelHudak projects\\test_data_cleaning\\{loc}"
-    all_files = glob.glob(os.path.join(folder_path, "*.csv"))
-    for filename in all_files:
-        df = pd.read_csv(filename, header=0)
-        print(f"Original size: {df.shape}")
+    folder_path = os.path.join(CSV_FOLDER, loc)
+    if not os.path.isdir(folder_path):
+        print(f"{loc} csvs do not exist")
+        return
+    rules = qc_rules.rules_for(QC_RULES, loc)
+    if INCREMENTAL:
+        return qc_rules.qc_location_incremental(folder_path, rules)
+    return qc_rules.qc_location(folder_path, rules)
+
+# The same for a location in the parquet store; flags go to <STORE_FOLDER>/<location>/_qc_flags.csv
+def clean_store(loc):
+    if not os.path.isdir(os.path.join(STORE_FOLDER, loc)):
+        print(f"{loc} has no data in the store")
+        return
+    rules = qc_rules.rules_for(QC_RULES, loc)
+    if INCREMENTAL:
+        return qc_rules.qc_store_incremental(STORE_FOLDER, loc, rules)
+    return qc_rules.qc_store(STORE_FOLDER, loc, rules)
+
+# Cleans every location with main.py's settings and settings file, like "python main.py clean"
+def clean_all(config_path=None):
+    import main # imported here because main.py imports this module for its clean command
+    main.configure(config_path)
+    main.clean_locations(list(main.location_ids))
 
-        #identify datetimes to throw out & remove from all csvs from the location
-        if filename == f"C:\\Users\\GIS\\MichaelHudak projects\\test_data_cleaning\\{loc}\\Depth.csv": 
-            outlier_times = depth_outlier_timestamps(filename, df)
-        print(f"New size: {df.shape}")
-        
-        #remove outlier times from all csvs
-    for filename in all_files:
-        df = pd.read_csv(filename, header=0)
-        df = df[~df['timestamp'].isin(outlier_times)]
-        
-        #remove duplicates
-        df.drop_duplicates(inplace=True)
-        #update csv with cleaned data
-        df.to_csv(f'{filename}', index=False)
-        
-        # Delete the file if cleaning left it empty
-        if df.empty:
-            os.remove(filename) # if this deletes Depth.csv, the program run will crash
-            print(f"Deleted empty file after cleaning: {filename}")
-        
-    return
-            
-#start with copies of each csv named _clean and then override each time it's cleaned     
 
-for loc in location_ids:
-    clean_csv(loc)
-    
+# Only runs as a script, so main.py's clean command can import this module for its rules and settings
+if __name__ == "__main__":
+    clean_all()
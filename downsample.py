@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Plot-aware downsampling, applied between the data and the plotly figure.
+
+A plot is only a couple thousand pixels wide, so embedding every raw reading just
+makes the html bigger. Two methods are available, both of which keep spikes:
+ - "minmax": splits the time range into equal buckets and keeps the lowest and
+   highest reading in each bucket (plus the first and last reading)
+ - "lttb": largest-triangle-three-buckets, keeps the point in each bucket that
+   forms the largest triangle with its neighbours, which preserves the visual shape
+"""
+
+import numpy as np
+
+
+# Indices of the min and max reading in each of n_buckets equal-width time buckets
+def minmax_indices(x, y, n_buckets):
+    n = len(x)
+    span = x[-1] - x[0]
+    if span <= 0:
+        return np.array([0, n - 1]) if n > 1 else np.arange(n)
+    buckets = np.minimum(((x - x[0]) * n_buckets // span).astype(np.int64), n_buckets - 1)
+
+    # x is sorted, so each bucket is one contiguous run of rows
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], n]
+    keep = [0, n - 1]
+    for start, end in zip(starts, ends):
+        chunk = y[start:end]
+        keep.append(start + int(np.argmin(chunk)))
+        keep.append(start + int(np.argmax(chunk)))
+    return np.unique(keep)
+
+
+# Indices chosen by largest-triangle-three-buckets for n_out output points
+def lttb_indices(x, y, n_out):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64) # the first and last point are always kept
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # the next bucket's average is the third corner of the triangle
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        keep[i + 1] = a
+    return keep
+
+
+"""
+Downsamples a dataframe of readings to about target_points rows for plotting.
+Rows with a missing value are dropped first; frames already small enough come back unchanged.
+method is "minmax" or "lttb"; a method of None turns downsampling off.
+"""
+def downsample_df(df, target_points, method="minmax", x_col="timestamp", y_col="value"):
+    if method is None or len(df) <= target_points:
+        return df
+    df = df[df[y_col].notna()].sort_values(x_col, kind="stable")
+    if len(df) <= target_points:
+        return df
+    x = df[x_col].to_numpy(dtype=np.float64)
+    y = df[y_col].to_numpy(dtype=np.float64)
+    if method == "minmax":
+        keep = minmax_indices(x, y, max(target_points // 2, 1)) # two points per bucket
+    elif method == "lttb":
+        keep = lttb_indices(x, y, target_points)
+    else:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    return df.iloc[keep]
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the HydroVu public API, for testing and benchmarking without credentials.
+
+Implements the endpoints main.py uses:
+    POST /public-api/oauth/token                   client-credentials token
+    GET  /public-api/v1/locations/list             locations, paged with the X-ISI-Start-Page / X-ISI-Next-Page headers
+    GET  /public-api/v1/locations/{id}/data        readings from startTime (inclusive), page_size readings per parameter
+    GET  /public-api/v1/sispec/friendlynames       parameter and unit names for the ids
+
+Readings are synthetic and computed on request from the timestamp alone (no data is held
+in memory), so the history can be made as long as needed. Like HydroVu, a page starts at
+the first reading at or after startTime, so the last reading of one page is repeated as
+the first reading of the next, and a startTime past the last reading returns 404.
+
+latency adds a delay to every request; error_rate answers that fraction of data calls
+with a 503 (or 429) so retries can be exercised; token_lifetime makes tokens expire
+after that many requests so the 401 refresh path can be exercised.
+
+Run it on its own with: python fake_hydrovu.py --port 8099
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import metadata
+
+# parameterId -> (name, unitId, baseline, daily swing)
+SYNTHETIC_PARAMS = {
+    "1" : ("Temperature", "1", 18.0, 4.0),
+    "2" : ("Actual Conductivity", "2", 9000.0, 1500.0),
+    "3" : ("Specific Conductivity", "2", 11000.0, 1500.0),
+    "4" : ("Salinity", "3", 6.5, 1.0),
+    "5" : ("Depth", "4", 1.2, 0.4),
+    "6" : ("pH", "5", 7.6, 0.3),
+    "7" : ("DO", "6", 7.5, 2.0),
+    "8" : ("Turbidity", "7", 12.0, 6.0),
+}
+SYNTHETIC_UNITS = {"1" : "C", "2" : "µS/cm", "3" : "psu", "4" : "m", "5" : "pH", "6" : "mg/L", "7" : "NTU"}
+
+DEFAULT_LOCATIONS = dict(metadata.KNOWN_LOCATIONS)
+
+
+# Deterministic readings for a location/parameter at the given timestamps (a daily cycle plus noise)
+def synthetic_values(location_id, parameter_id, timestamps):
+    name, unit_id, baseline, swing = SYNTHETIC_PARAMS[parameter_id]
+    phase = (location_id % 97) / 97.0 * 2 * np.pi
+    daily = np.sin(2 * np.pi * (timestamps % 86400) / 86400 + phase)
+    noise = np.sin(timestamps * 12.9898 + int(parameter_id) * 78.233) * 0.05 * swing # cheap repeatable noise
+    return np.round(baseline + swing * daily + noise, 4)
+
+
+class FakeHydroVu:
+    def __init__(self, locations=None, history_days=30, end_time=None, interval=900, page_size=120,
+                 latency=0.0, error_rate=0.0, token_lifetime=None, locations_page_size=10, seed=0):
+        self.locations = dict(locations or DEFAULT_LOCATIONS)
+        self.end_time = int(end_time if end_time is not None else time.time()) // interval * interval
+        self.start_time = self.end_time - int(history_days * 86400)
+        self.interval = interval
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.locations_page_size = locations_page_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = {} # token -> requests left (None = never expires)
+        self.counters = {"token" : 0, "locations" : 0, "data_pages" : 0, "readings" : 0,
+                         "errors_injected" : 0, "not_found" : 0, "unauthorized" : 0}
+        self.server = None
+        self.thread = None
+
+    # ---- server lifecycle ----
+    def start(self, host="127.0.0.1", port=0):
+        fake = self
+        class Handler(_Handler):
+            api = fake
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/public-api"
+
+    # The endpoint constants main.py expects, pointing at this server
+    def endpoints(self):
+        return {"LOCAL_OAUTH_ENDPOINT" : f"{self.base_url}/oauth/token",
+                "LOCAL_LOCATIONS_ENDPOINT" : f"{self.base_url}/v1/locations/list",
+                "LOCAL_DATA_ENDPOINT" : f"{self.base_url}/v1/locations/",
+                "LOCAL_NAMES_ENDPOINT" : f"{self.base_url}/v1/sispec/friendlynames"}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    # ---- request handling ----
+    def issue_token(self):
+        self.count("token")
+        with self.lock:
+            token = f"fake-token-{self.counters['token']}"
+            self.tokens[token] = self.token_lifetime
+        return {"access_token" : token, "token_type" : "bearer", "expires_in" : 3600}
+
+    def check_token(self, header):
+        token = (header or "").replace("Bearer ", "", 1)
+        with self.lock:
+            if token not in self.tokens:
+                return False
+            left = self.tokens[token]
+            if left is None:
+                return True
+            if left <= 0:
+                return False
+            self.tokens[token] = left - 1
+            return True
+
+    def inject_error(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.count("errors_injected")
+            return 429 if self.random.random() < 0.25 else 503
+        return None
+
+    def locations_page(self, page_token):
+        self.count("locations")
+        items = [{"id" : loc_id, "name" : name, "description" : "synthetic AquaTroll",
+                  "gps" : {"latitude" : 39.2, "longitude" : -76.1}}
+                 for name, loc_id in sorted(self.locations.items(), key=lambda item: item[1])]
+        start = int(page_token) if page_token else 0
+        end = start + self.locations_page_size
+        next_page = str(end) if end < len(items) else None
+        return items[start:end], next_page
+
+    # One page of readings for every parameter, starting at the first reading at or after start_time
+    def data_page(self, location_id, start_time, end_time=None):
+        first = max(self.start_time, -(-int(start_time) // self.interval) * self.interval) # round up to the grid
+        last = self.end_time if end_time is None else min(self.end_time, int(end_time))
+        if first > last:
+            self.count("not_found")
+            return None
+        timestamps = np.arange(first, min(first + self.page_size * self.interval, last + 1), self.interval,
+                               dtype=np.int64)
+        parameters = []
+        for parameter_id, (name, unit_id, baseline, swing) in SYNTHETIC_PARAMS.items():
+            values = synthetic_values(location_id, parameter_id, timestamps)
+            parameters.append({"parameterId" : parameter_id, "unitId" : unit_id,
+                               "readings" : [{"timestamp" : int(t), "value" : float(v)}
+                                             for t, v in zip(timestamps, values)]})
+        self.count("data_pages")
+        self.count("readings", len(timestamps) * len(parameters))
+        return {"locationId" : location_id, "parameters" : parameters}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    api = None # set to the FakeHydroVu instance by FakeHydroVu.start
+    protocol_version = "HTTP/1.1" # keep-alive, like the real API
+    disable_nagle_algorithm = True # small responses would otherwise wait on delayed ACKs
+
+    def log_message(self, format, *args): # keep benchmark output clean
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if self.api.latency:
+            time.sleep(self.api.latency)
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if urlparse(self.path).path.endswith("/oauth/token"):
+            return self._send(200, self.api.issue_token())
+        return self._send(404, {"error" : "not found"})
+
+    def do_GET(self):
+        if self.api.latency:
+            time.sleep(self.api.latency)
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = {key : values[0] for key, values in parse_qs(url.query).items()}
+
+        if not self.api.check_token(self.headers.get("Authorization")):
+            self.api.count("unauthorized")
+            return self._send(401, {"error" : "invalid_token"})
+
+        if parts[-2:] == ["locations", "list"]:
+            items, next_page = self.api.locations_page(self.headers.get("X-ISI-Start-Page"))
+            return self._send(200, items, {"X-ISI-Next-Page" : next_page} if next_page else None)
+
+        if parts[-2:] == ["sispec", "friendlynames"]:
+            return self._send(200, {"parameters" : {pid : p[0] for pid, p in SYNTHETIC_PARAMS.items()},
+                                    "units" : dict(SYNTHETIC_UNITS)})
+
+        if len(parts) >= 2 and parts[-1] == "data" and parts[-3] == "locations":
+            error = self.api.inject_error()
+            if error is not None:
+                return self._send(error, {"error" : "injected"}, {"Retry-After" : "0"})
+            location_id = int(parts[-2])
+            if location_id not in self.api.locations.values():
+                return self._send(404, {"error" : "unknown location"})
+            page = self.api.data_page(location_id, int(query.get("startTime", 0)), query.get("endTime"))
+            if page is None:
+                return self._send(404, {"error" : "no data"})
+            return self._send(200, page)
+
+        return self._send(404, {"error" : "not found"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake HydroVu API")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--days", type=float, default=30, help="days of synthetic history")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of data calls answered with 503/429")
+    args = parser.parse_args()
+
+    fake = FakeHydroVu(history_days=args.days, latency=args.latency, error_rate=args.error_rate)
+    print(f"Fake HydroVu running at {fake.start(port=args.port)}")
+    for key, value in fake.endpoints().items():
+        print(f"{key} = \"{value}\"")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+File helpers shared by the modules that keep their state on disk.
+
+replacing(path) hands out a temporary path next to path, and moves the finished file over
+path only once the block completes, so a crash or a concurrent reader never sees a
+half-written manifest, checkpoint, cache entry or partition (os.replace is atomic on the
+same filesystem). write_json() covers the common case of a json file.
+
+last_line() reads a file's last line from the end, without reading the rest of the file.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+
+# Yields a temporary path to write to; it replaces path when the block ends without an error
+@contextmanager
+def replacing(path):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    # unique per process and thread, so parallel writers of the same file don't share a temporary
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_json(path, data, indent=1):
+    with replacing(path) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+
+
+# Byte offset and contents (without the line ending) of the last non-empty line of a file,
+# or (None, None) if the file is empty
+def last_line(path, block_size=4096):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        # step backwards until the block holds a full last line
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            if tail.rstrip(b"\r\n").count(b"\n") >= 1:
+                break
+    body = tail.rstrip(b"\r\n")
+    if not body:
+        return None, None
+    line_start = body.rfind(b"\n") + 1
+    return pos + line_start, body[line_start:].rstrip(b"\r")
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Batched publishing of rendered plots to GitHub as a single commit.
+
+The contents API (git_api_call in main.py) needs a GET for the file sha and a PUT per
+file, and every PUT is its own commit. GitDataPublisher instead collects all of the
+rendered html first, then uses the Git Data API:
+    1. creates the blobs concurrently
+    2. builds one tree on top of the current branch tree
+    3. creates one commit and moves the branch to it
+
+LocalGitPublisher has the same add()/publish() interface but commits into a local
+(bare or normal) git repository, so the publishing step can be tried out without GitHub.
+FolderPublisher just writes the files into a folder, for looking at figures before publishing.
+"""
+
+import base64
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+class GitDataPublisher:
+    """
+    client: an ApiClient (api_client.py) that already sends the GitHub token headers
+    api_url: base url of the GitHub REST API; point it at a fake server for testing
+    """
+    def __init__(self, client, owner, repo, branch="main", api_url="https://api.github.com", max_workers=8):
+        self.client = client
+        self.repo_url = f"{api_url}/repos/{owner}/{repo}"
+        self.branch = branch
+        self.max_workers = max_workers
+        self.files = {} # repo path -> bytes
+
+    # Queues a file for the next commit; adding the same path again replaces it
+    def add(self, path, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.files[path] = content
+
+    def _call(self, method, path, endpoint, json_body=None):
+        response = self.client.request(method, f"{self.repo_url}{path}", endpoint=endpoint, json=json_body)
+        response.raise_for_status()
+        return response.json()
+
+    def _create_blob(self, content):
+        body = {"content" : base64.b64encode(content).decode("utf-8"), "encoding" : "base64"}
+        return self._call("POST", "/git/blobs", "github git blobs", body)["sha"]
+
+    # Commits every queued file at once; returns the new commit sha (None if nothing was queued)
+    def publish(self, message="Updating the plots"):
+        if not self.files:
+            return None
+        paths = sorted(self.files)
+
+        parent_sha = self._call("GET", f"/git/ref/heads/{self.branch}", "github git ref")["object"]["sha"]
+        base_tree = self._call("GET", f"/git/commits/{parent_sha}", "github git commit")["tree"]["sha"]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            blob_shas = list(pool.map(self._create_blob, [self.files[p] for p in paths]))
+
+        tree_entries = [{"path" : p, "mode" : "100644", "type" : "blob", "sha" : sha}
+                        for p, sha in zip(paths, blob_shas)]
+        tree_sha = self._call("POST", "/git/trees", "github git tree",
+                              {"base_tree" : base_tree, "tree" : tree_entries})["sha"]
+        commit_sha = self._call("POST", "/git/commits", "github git commit",
+                                {"message" : message, "tree" : tree_sha, "parents" : [parent_sha]})["sha"]
+        self._call("PATCH", f"/git/refs/heads/{self.branch}", "github git ref", {"sha" : commit_sha})
+
+        print(f"Published {len(paths)} files in commit {commit_sha}")
+        self.files = {}
+        return commit_sha
+
+
+class LocalGitPublisher:
+    # Stand-in for GitDataPublisher that commits to a local repository with git plumbing commands
+    def __init__(self, repo_path, branch="main", author_name="data_update", author_email="data_update@localhost"):
+        self.repo_path = repo_path
+        self.branch = branch
+        self.identity = {"GIT_AUTHOR_NAME" : author_name, "GIT_AUTHOR_EMAIL" : author_email,
+                         "GIT_COMMITTER_NAME" : author_name, "GIT_COMMITTER_EMAIL" : author_email}
+        self.files = {}
+
+    def add(self, path, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.files[path] = content
+
+    def _git(self, args, env=None, input_bytes=None):
+        result = subprocess.run(["git", "-C", self.repo_path] + args, input=input_bytes,
+                                capture_output=True, env=env, check=True)
+        return result.stdout.decode("utf-8").strip()
+
+    def publish(self, message="Updating the plots"):
+        if not self.files:
+            return None
+        ref = f"refs/heads/{self.branch}"
+        try:
+            parent_sha = self._git(["rev-parse", "--verify", "--quiet", ref])
+        except subprocess.CalledProcessError: # empty repository, first commit
+            parent_sha = None
+
+        # a throwaway index keeps this from touching any working tree
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp, "index"))
+            if parent_sha:
+                self._git(["read-tree", parent_sha], env=env)
+            for path in sorted(self.files):
+                blob_sha = self._git(["hash-object", "-w", "--stdin"], input_bytes=self.files[path])
+                self._git(["update-index", "--add", "--cacheinfo", f"100644,{blob_sha},{path}"], env=env)
+            tree_sha = self._git(["write-tree"], env=env)
+
+        parent_args = ["-p", parent_sha] if parent_sha else []
+        commit_sha = self._git(["commit-tree", tree_sha, "-m", message] + parent_args,
+                               env=dict(os.environ, **self.identity))
+        self._git(["update-ref", ref, commit_sha])
+
+        print(f"Published {len(self.files)} files in commit {commit_sha}")
+        self.files = {}
+        return commit_sha
+
+
+class FolderPublisher:
+    # Same add()/publish() interface, writing each file under folder instead of committing it
+    def __init__(self, folder):
+        self.folder = folder
+        self.files = {}
+
+    def add(self, path, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.files[path] = content
+
+    def publish(self, message=None):
+        for path, content in self.files.items():
+            full_path = os.path.join(self.folder, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                f.write(content)
+        print(f"Wrote {len(self.files)} files to {self.folder}")
+        written = sorted(self.files)
+        self.files = {}
+        return written
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar local store for HydroVu readings (replaces one text CSV per location and parameter)
+
+Layout on disk, partitioned by location, parameter and month:
+    <root>/<location>/<parameter>/<YYYY-MM>.parquet
+    <root>/<location>/_meta.json
+
+Each parquet file holds only two typed columns: timestamp (int64 epoch seconds, UTC)
+and value (float64), sorted by timestamp with no repeated timestamps. The parameter name, unit name and locationId are stored once
+in the folder names and _meta.json instead of being repeated on every row.
+"""
+
+import glob
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import pandas as pd # needs pyarrow installed for parquet support
+
+import file_io
+import rollups
+import schema
+
+STORE_COLUMNS = ["timestamp", "value"]
+META_FILE = "_meta.json"
+
+
+# Month partition key (UTC) for a single epoch time, e.g. 1770663600 -> "2026-02"
+def month_key(epoch):
+    return datetime.fromtimestamp(int(epoch), tz=timezone.utc).strftime("%Y-%m")
+
+
+# Vectorized month keys for a whole column of epoch times
+def month_keys(timestamps):
+    return pd.to_datetime(timestamps, unit="s", utc=True).dt.strftime("%Y-%m")
+
+
+def param_folder(root, loc, param):
+    return os.path.join(root, loc, param)
+
+
+# Casts a HydroVu reading frame down to the two stored columns with fixed dtypes
+def to_store_frame(df):
+    frame = pd.DataFrame({
+        "timestamp" : pd.to_numeric(df["timestamp"], errors="coerce"),
+        "value" : pd.to_numeric(df["value"], errors="coerce").astype("float64"),
+        })
+    frame = frame.dropna(subset=["timestamp"]) # stray header rows from old csvs come through as NaN
+    frame["timestamp"] = frame["timestamp"].astype("int64")
+    return frame.reset_index(drop=True)
+
+
+# Writes to a temporary file first so a crash never leaves a half-written partition behind
+def _write_parquet(df, path):
+    with file_io.replacing(path) as tmp_path:
+        df.to_parquet(tmp_path, index=False)
+
+
+def read_meta(root, loc):
+    path = os.path.join(root, loc, META_FILE)
+    if not os.path.exists(path):
+        return {"locationId" : None, "units" : {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_meta(root, loc, meta):
+    file_io.write_json(os.path.join(root, loc, META_FILE), meta)
+
+
+# Appends one parameter's readings (timestamp, value, param_name, unit_name columns) to the store.
+# Only the month partitions touched by the new rows are read and rewritten.
+def append_to_store(root, loc, df, location_id=None):
+    if df.empty:
+        return
+    param = df["param_name"].iloc[0]
+    unit = df["unit_name"].iloc[0]
+    frame = to_store_frame(df)
+    folder = param_folder(root, loc, param)
+    os.makedirs(folder, exist_ok=True)
+
+    for month, part in frame.groupby(month_keys(frame["timestamp"]), sort=True):
+        path = os.path.join(folder, f"{month}.parquet")
+        if os.path.exists(path):
+            part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+        # every partition stays sorted with unique timestamps; a reading already stored wins over a repeat
+        part = part.sort_values("timestamp", kind="stable").drop_duplicates(subset="timestamp", keep="first")
+        part = part.reset_index(drop=True)
+        _write_parquet(part, path)
+
+    meta = read_meta(root, loc)
+    meta["units"][param] = unit
+    if location_id is not None:
+        meta["locationId"] = int(location_id)
+    _write_meta(root, loc, meta)
+
+
+# Deletes a parameter's partitions, so the readings written next replace them instead of merging
+# into them (a reading already stored wins over a repeat, see append_to_store)
+def remove_param(root, loc, param):
+    folder = param_folder(root, loc, param)
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+
+
+# Lists the parameters that have data in the store for a location
+def list_params(root, loc):
+    loc_folder = os.path.join(root, loc)
+    if not os.path.isdir(loc_folder):
+        return []
+    return sorted(name for name in os.listdir(loc_folder)
+                  if os.path.isdir(os.path.join(loc_folder, name)) and not name.startswith("_")) # e.g. _rollups
+
+
+# Month partition files for a parameter, pruned to the [start, end] window when given
+def partition_files(root, loc, param, start=None, end=None):
+    files = sorted(glob.glob(os.path.join(param_folder(root, loc, param), "*.parquet")))
+    first = month_key(start) if start is not None else None
+    last = month_key(end) if end is not None else None
+    kept = []
+    for path in files:
+        month = os.path.splitext(os.path.basename(path))[0]
+        if first is not None and month < first:
+            continue
+        if last is not None and month > last:
+            continue
+        kept.append(path)
+    return kept
+
+
+# Reads one parameter for a location. columns projects the stored columns,
+# start/end (epoch seconds, inclusive) prune month partitions and filter rows
+def read_param(root, loc, param, start=None, end=None, columns=None):
+    columns = list(columns) if columns is not None else STORE_COLUMNS
+    filters = []
+    if start is not None:
+        filters.append(("timestamp", ">=", int(start)))
+    if end is not None:
+        filters.append(("timestamp", "<=", int(end)))
+
+    parts = [pd.read_parquet(path, columns=columns, filters=filters or None)
+             for path in partition_files(root, loc, param, start, end)]
+    if not parts:
+        return pd.DataFrame({col : pd.Series(dtype="int64" if col == "timestamp" else "float64") for col in columns})
+    df = pd.concat(parts, ignore_index=True)
+    return df[columns]
+
+
+# Most recent stored timestamp for a parameter; only the newest month partition is opened
+def last_timestamp(root, loc, param):
+    files = partition_files(root, loc, param)
+    if not files:
+        return None
+    ts = pd.read_parquet(files[-1], columns=["timestamp"])["timestamp"]
+    return int(ts.max()) if not ts.empty else None
+
+
+# Returns a list of dataframes shaped like the old csvs (timestamp, value, param_name, unit_name, locationId)
+# so the plotting code can read from the store without changes (labels are categorical, see schema.py)
+def dfs_from_store(root, loc, params=None, start=None, end=None):
+    meta = read_meta(root, loc)
+    df_list = []
+    for param in (params if params is not None else list_params(root, loc)):
+        df = read_param(root, loc, param, start, end)
+        if df.empty:
+            continue
+        df["param_name"] = schema.label_column(param, len(df))
+        df["unit_name"] = schema.label_column(meta["units"].get(param), len(df))
+        df["locationId"] = schema.label_column(meta["locationId"], len(df))
+        df_list.append(df)
+    return df_list
+
+
+# One-time conversion of a location's existing csv folder into the store. The QC flags come along,
+# and each parameter's rollups are built from everything it now holds
+def csvs_to_store(csv_folder, root, loc, location_id=None):
+    import qc_rules # imported here because qc_rules reads the store through this module
+    flags = qc_rules.read_flags(os.path.join(csv_folder, loc))
+    if flags is not None:
+        qc_rules.write_flags(os.path.join(root, loc), flags)
+    for filename in glob.glob(os.path.join(csv_folder, loc, "*.csv")):
+        if os.path.basename(filename).startswith("_"): # sidecar files such as _qc_flags.csv
+            continue
+        df = pd.read_csv(filename, header=0)
+        df = df.loc[:, ~df.columns.str.contains('^Unnamed')] # drop stray index columns
+        df = df[df['timestamp'] != 'timestamp'] # strip duplicate header rows
+        if df.empty or "param_name" not in df.columns:
+            print(f"Skipping {filename}, nothing to convert")
+            continue
+        append_to_store(root, loc, df, location_id)
+        param = df["param_name"].iloc[0]
+        stored = read_param(root, loc, param).assign(param_name=param)
+        rollups.write_rollups(os.path.join(root, loc), param, qc_rules.mask_flagged(stored, flags))
+        print(f"Converted: {filename} ({len(df)} rows)")
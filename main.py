@@ -9,21 +9,39 @@ HydroVu API documentation: https://www.hydrovu.com/public-api/docs/index.html
 
 
 import pandas as pd # Dataframes, reads CSVs into dataframes
-import matplotlib.pyplot as plt # Available for quick plotting
-import requests # Connects with HydroVu and GitHub for data calls and uploads
+# plotly (interactive graphs sent to GitHub) and matplotlib (quick plotting) are only imported by the
+# functions that draw (see load_plotly), so commands like a cron-driven update start without them
 from datetime import datetime, timedelta # Converts epoch time from raw data, sets start date when building CSVs
-import plotly.express as px # Interactive graph display that gets sent to GitHub
-import plotly.io as pio
 import os # Enables viewing external files
-import glob # Enables grabbing all files in a folder
-#import sys 
+import sys 
+import argparse # Command line subcommands (update, backfill, clean, plot, publish)
 import time # Tracks code runtime and prints at the end of run
 import base64 # Encoding necessary to upload html to GitHub
 from io import BytesIO, StringIO # Enables treating a string like a file object for GitHub upload
+import local_store # Columnar (parquet) storage, partitioned by location, parameter and month
+import watermarks # Per-location manifest of the last stored timestamp for each parameter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor # Runs location updates side by side, draws figures on every core
+from rate_limit import RateLimiter # Keeps concurrent HydroVu calls under a global request rate
+import backfill # Splits long builds into windows fetched in parallel, with resumable checkpoints
+from api_client import ApiClient # Pooled HTTP sessions with retries, token refresh and latency counters
+import page_decoder # Decodes HydroVu pages into one dataframe per parameter in a single pass
+import schema # Compact column types for reading dataframes (categorical labels, float32 plot values)
+import csv_index # Sparse timestamp -> byte offset index, so a time window of a csv is read on its own
+from downsample import downsample_df # Thins readings down to what a plot can actually show
+from github_publisher import GitDataPublisher, FolderPublisher # Publishes all plots to GitHub in one commit, or to a folder
+from plot_manifest import PlotManifest # Skips figures whose data (or html) has not changed
+import compact_figure # Figure pages with binary (typed-array) data and one shared JS shell
+import rollups # Hourly/daily count, min, mean and max per parameter, kept up to date as data is appended
+import weather # Weather station csvs: cached typed loading, plots and the as-of join onto readings
+import qc_rules # QC flags written by data_cleaning.py, used to leave flagged readings out of plots
+from run_report import RunReport # Per-stage timings and counters, written to a json run report
+from page_cache import PageCache # Gzipped raw HydroVu pages, for resuming failed runs and offline replay
+import metadata # Location ids and parameter/unit names from HydroVu, cached with a TTL
+import poll_schedule # Per-site poll times for watch mode, learned from each AquaTroll's logging cadence
+import config # Optional json settings file that overrides the paths and secrets below
 
 start_time = time.time()
 #sys.setrecursionlimit(10000) # Increase the limit to 10000
-pio.renderers.default = 'browser' #determines how plot displays
 
 
 
@@ -32,7 +50,7 @@ pio.renderers.default = 'browser' #determines how plot displays
 # In[81]:
 
 
-# These must be defined before running the code
+# These must be defined before running the code, here or in a settings file (see config.py)
 LOCAL_CLIENT_ID = "" # found in HydroVu website (Washington College -> Users -> Manage API Access Credentials)
 LOCAL_CLIENT_SECRET = "" # found in HydroVu website
 # git token must be generated in GitHub
@@ -42,21 +60,97 @@ LOCAL_GIT_TOKEN = ""
 LOCAL_LOCATIONS_ENDPOINT = "https://hydrovu.com/public-api/v1/locations/list"
 LOCAL_OAUTH_ENDPOINT     = "https://hydrovu.com/public-api/oauth/token"
 LOCAL_DATA_ENDPOINT      = "https://hydrovu.com/public-api/v1/locations/"
+LOCAL_NAMES_ENDPOINT     = "https://hydrovu.com/public-api/v1/sispec/friendlynames"
+
+# HydroVu's locations and parameter/unit names are kept here and fetched again once older than
+# METADATA_TTL_HOURS (see metadata.py); an unknown parameter id in a page also fetches them again
+METADATA_CACHE_PATH = "C:\\Users\\GIS\\MichaelHudak projects\\hydrovu_metadata.json"
+METADATA_TTL_HOURS  = 24
+# False follows the sites in metadata.KNOWN_LOCATIONS; True follows every location on the HydroVu account
+TRACK_ALL_LOCATIONS = False
+
+# Local folders where the location data is kept
+BUILD_CSV_FOLDER = "C:\\Users\\GIS\\MichaelHudak projects\\HydroVu_Location_Params" # build_csv output
+CSV_FOLDER       = "C:\\Users\\GIS\\MichaelHudak projects\\test_data_cleaning" # updated/cleaned csvs
+STORE_FOLDER     = "C:\\Users\\GIS\\MichaelHudak projects\\HydroVu_Store" # parquet store (see local_store.py)
+
+# "csv" keeps one text csv per location and parameter
+# "parquet" uses the partitioned columnar store; run csvs_to_store() once per location before switching
+STORE_FORMAT = "csv"
+
+# Concurrent ingestion settings, shared by every thread calling HydroVu
+MAX_REQUESTS_PER_SECOND = 4 # global limit across all locations
+MAX_CONCURRENT_REQUESTS = 4 # requests in flight at the same time
+MAX_LOCATION_WORKERS    = 7 # locations updated in parallel (one per site)
+
+# Every raw HydroVu page is kept gzipped here (see page_cache.py): a failed run resumes without fetching
+# the same pages again, and "python main.py replay" rebuilds the data from it offline; None turns it off
+PAGE_CACHE_FOLDER   = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "_page_cache")
+PAGE_CACHE_MAX_MB   = 2048 # the oldest pages are removed past this size; None = no size limit
+PAGE_CACHE_MAX_DAYS = None # pages cached longer ago than this are removed; None = kept
+
+# Parallel backfill settings (see backfill_csv)
+BACKFILL_FOLDER      = "C:\\Users\\GIS\\MichaelHudak projects\\HydroVu_Backfill" # checkpoints and spooled windows
+BACKFILL_WINDOW_DAYS = 10 # size of each independently fetched window
+BACKFILL_WORKERS     = 4  # windows fetched at the same time
+
+# QC rules run by the clean command (see qc_rules.py for the rule types). Only the negative depth mask is
+# on by default; a settings file gives the sites' range, rate and flatline thresholds as a json list
+QC_RULES = qc_rules.DEFAULT_RULES
+
+# Plot downsampling: each plotted line keeps about PLOT_TARGET_POINTS readings
+# "minmax" keeps the min and max of each time bucket, "lttb" keeps the visual shape; None plots every reading
+PLOT_DOWNSAMPLE_METHOD = "minmax"
+PLOT_TARGET_POINTS     = 4000
+
+# "html" writes plotly's standalone pages; "compact" writes the data as base64 typed arrays and loads
+# it through one shared script (compact_figure.SHELL_PATH), for much smaller, faster pages
+PLOT_PAGE_FORMAT = "html"
+
+# A plotted line reads at most about this many rows: longer spans are drawn from the hourly,
+# then the daily rollups (see rollups.py), so plotting years of data costs about the same as one
+ROLLUP_MAX_ROWS = 20000
+
+# Plots show the last PLOT_WINDOW_DAYS days; None plots everything stored
+# Only the rows inside the window are read (see query)
+PLOT_WINDOW_DAYS = None
+
+# Type of the plotted values held in memory: "float32" halves the all-location tables and keeps about
+# 7 significant digits (what a plot can show); "float64" keeps every stored digit in the hover text
+PLOT_VALUE_DTYPE = "float32"
+
+# Processes that draw and serialize figures at the same time; None uses one per core, 1 draws them one by one
+RENDER_WORKERS = None
+
+# Weather station files (see weather.py); parsed files are cached as parquet in WEATHER_CACHE_FOLDER
+WEATHER_FILES          = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "*_weather_*.csv")
+WEATHER_CACHE_FOLDER   = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "_cache")
+WEATHER_STATION        = "CES" # station joined onto the water quality readings
+WEATHER_JOIN_TOLERANCE = 15 * 60 # seconds; readings with no weather this close get NaN
+
+# Records the data and html hashes behind every published figure (see plot_manifest.py)
+PLOT_MANIFEST_PATH = "C:\\Users\\GIS\\MichaelHudak projects\\plot_manifest.json"
+
+# Timings and counters for every stage of a run (see run_report.py)
+RUN_REPORT_PATH = "C:\\Users\\GIS\\MichaelHudak projects\\run_report.json"
+PROFILE_STAGE   = None # set to one stage name (e.g. "decode") to run that stage under cProfile
+
+# Where "python main.py plot" writes html for checking figures locally, without publishing them
+PLOT_OUTPUT_FOLDER = "C:\\Users\\GIS\\MichaelHudak projects\\plot_preview"
+
+# "python main.py watch" keeps running and polls each site when its next reading should be on HydroVu
+# (see poll_schedule.py); what it has learned about each site is kept in WATCH_STATE_PATH
+WATCH_STATE_PATH       = "C:\\Users\\GIS\\MichaelHudak projects\\watch_state.json"
+WATCH_MIN_INTERVAL     = 60       # seconds; no site is polled more often than this
+WATCH_MAX_INTERVAL     = 6 * 3600 # seconds; sites that have gone quiet back off to one poll this far apart
+WATCH_PUBLISH_INTERVAL = 5 * 60   # seconds; new data is published at most this often, in one commit
 
 
 # In[7]:
 
 # Location IDs dict enables easy transition between site codes and readable site names
-location_ids = {
-    "Lower Langford Creek AquaTroll" : 4840973161857024,
-    "Radcliffe Outflow AquaTroll" : 5276098860482560,
-    "Millington AquaTroll" : 5687072567394304,
-    "SE Creek AquaTroll" : 6000235094540288,
-    "Shipyard Landing Dock AquaTroll" : 6228783747956736,
-    "Upper East Langford Dock AquaTroll" : 6235146771365888,
-    "Morgan Creek AquaTroll" : 6265987319005184
-    
-}
+# The ids are checked against HydroVu's locations list by sync_locations() before fetching
+location_ids = dict(metadata.KNOWN_LOCATIONS)
 
 ALL_PARAMS = ["Actual Conductivity", "Specific Conductivity", "Salinity", "Resistivity",
               "Density", "Total Dissolved Solids", "Chl-a Fluorescence", "Chl-a Concentration",
@@ -92,15 +186,25 @@ UNITS_BY_PARAM = {
 
 # In[8]:
 
-# Establish parameter and unit dicts to join friendly names with HydroVu codes
-# HydroVu uses numeric codes for parameters and units, 
-# so these dictionaries help convert codes into meaningful names
-parameter_df = pd.read_csv("C:/Users/GIS/MichaelHudak projects/WIL monitor locations - parameter IDs.csv", header=0)
-parameter_dict = {row["key_col"]:row["value_col"] for i, row in parameter_df.iterrows()}
+# HydroVu uses numeric codes for parameters and units; their names come from the metadata registry.
+# These lookup tables are only read if HydroVu can't be reached and nothing is cached yet
+PARAMETER_IDS_CSV = "C:/Users/GIS/MichaelHudak projects/WIL monitor locations - parameter IDs.csv"
+UNIT_IDS_CSV      = "C:/Users/GIS/MichaelHudak projects/WIL monitor locations - unit IDs.csv"
 
+# A missing lookup csv gives an empty dict instead of stopping the run,
+# so the module can be used (e.g. by bench_ingest.py) on machines without these files
+def load_lookup_csv(path):
+    if not os.path.exists(path):
+        print(f"Lookup table not found: {path}")
+        return {}
+    lookup_df = pd.read_csv(path, header=0, dtype={"key_col" : str}) # HydroVu sends the ids as strings
+    return dict(zip(lookup_df["key_col"], lookup_df["value_col"]))
 
-unit_df = pd.read_csv("C:/Users/GIS/MichaelHudak projects/WIL monitor locations - unit IDs.csv")
-unit_dict = {row["key_col"]:row["value_col"] for i, row in unit_df.iterrows()}
+# The registry's fallback when HydroVu can't be reached and there is no cached metadata
+def lookup_csv_metadata():
+    return {"locations" : metadata.KNOWN_LOCATIONS,
+            "parameters" : load_lookup_csv(PARAMETER_IDS_CSV),
+            "units" : load_lookup_csv(UNIT_IDS_CSV)}
 
 
 
@@ -117,34 +221,110 @@ def update_access_token():
         "client_secret" : LOCAL_CLIENT_SECRET
         }
     
-    response = requests.post(url=LOCAL_OAUTH_ENDPOINT, data=headers_for_auth)
+    with run_report.stage("token fetch"):
+        response = oauth_client.post(LOCAL_OAUTH_ENDPOINT, endpoint="hydrovu oauth", data=headers_for_auth)
     response.raise_for_status()
     
     tokens = response.json()
     return(tokens["access_token"])
 
+# Everything the metadata registry keeps, fetched from HydroVu (every page of the locations list)
+def fetch_metadata():
+    with run_report.stage("metadata fetch"):
+        names = get_friendly_names()
+        return {"locations" : {loc["name"] : loc["id"] for loc in get_locations()},
+                "parameters" : names["parameters"], "units" : names["units"]}
+
+
+# Builds the run report, rate limiter and API clients from the current settings.
+# Runs once at import with the defaults above, and again in configure() once a settings file is applied.
+# Nothing goes over the network here
+def init_clients():
+    global run_report, hydrovu_limiter, oauth_client, hydrovu_client, github_client, page_cache
+    global metadata_registry, parameter_dict, unit_dict
+    # Collects stage timings and counters; written to RUN_REPORT_PATH at the end of a run
+    run_report = RunReport(profile_stage=PROFILE_STAGE)
+
+    # One limiter for the whole program, so parallel location updates still respect the API's rate
+    hydrovu_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND, MAX_CONCURRENT_REQUESTS)
+
+    oauth_client = ApiClient(limiter=hydrovu_limiter)
+
+    # All HydroVu data calls go through this client. The access token is fetched on the first call
+    # (not at import) and fetched again automatically if HydroVu answers 401 partway through a run
+    hydrovu_client = ApiClient(default_headers={"User-Agent" : LOCAL_CLIENT_ID},
+                               token_fetcher=update_access_token, limiter=hydrovu_limiter)
+
+    # The local_git_token may need manual updates in GitHub
+    git_headers = {
+        "Authorization" : f"token {LOCAL_GIT_TOKEN}",
+        "Accept": "application/vnd.github+json",
+        "User-Agent": "data_update"
+    }
 
-#access_token = update_access_token()
+    # Shared session for the GitHub contents API, so every upload reuses the same connection
+    github_client = ApiClient(default_headers=git_headers)
 
-#Sets up authentication header using access token
-headers_for_data = {
-    "Authorization" : f"Bearer {update_access_token()}",
-    "User-Agent" : LOCAL_CLIENT_ID
-    }
+    # Location ids and parameter/unit names, read from METADATA_CACHE_PATH or HydroVu on first use.
+    # parameter_dict and unit_dict are its id -> name lookups, used when decoding pages
+    metadata_registry = metadata.MetadataRegistry(fetch_metadata, METADATA_CACHE_PATH, METADATA_TTL_HOURS * 3600,
+                                                  fallback=lookup_csv_metadata)
+    parameter_dict = metadata_registry.parameters
+    unit_dict = metadata_registry.units
 
+    page_cache = None
+    if PAGE_CACHE_FOLDER:
+        page_cache = PageCache(PAGE_CACHE_FOLDER,
+                               max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024 if PAGE_CACHE_MAX_MB is not None else None,
+                               max_age_days=PAGE_CACHE_MAX_DAYS)
 
-# In[15]:
+init_clients()
+
+# Applies a settings file (see config.py) over the defaults above and rebuilds the clients with it
+def configure(config_path=None):
+    path = config.find_config(config_path, os.path.dirname(os.path.abspath(__file__)))
+    if path is not None:
+        names = config.apply_config(globals(), config.load_config(path))
+        print(f"Settings from {path}: {', '.join(names)}")
+    init_clients()
 
 
-# Only run this to update the dictionary of locations
-# This only gets first ten locations; use the web interface api instead
+# In[15]:
 
+
+# Every location on the account. HydroVu sends them a page at a time; the X-ISI-Next-Page header
+# holds the token for the next page and is missing on the last one
 def get_locations():
-    response = requests.get(url=LOCAL_LOCATIONS_ENDPOINT, headers=headers_for_data)
+    locations = []
+    next_page = None
+    while True:
+        headers = {"X-ISI-Start-Page" : next_page} if next_page else None
+        response = hydrovu_client.get(LOCAL_LOCATIONS_ENDPOINT, endpoint="hydrovu locations", headers=headers)
+        response.raise_for_status()
+        locations.extend(response.json())
+        next_page = response.headers.get("X-ISI-Next-Page")
+        if not next_page:
+            return locations
+
+# Parameter and unit names by id: {"parameters" : {id : name}, "units" : {id : name}}
+def get_friendly_names():
+    response = hydrovu_client.get(LOCAL_NAMES_ENDPOINT, endpoint="hydrovu names")
     response.raise_for_status()
-    
-    locations = response.json()
-    return locations
+    return response.json()
+
+# Brings location_ids in line with HydroVu's locations list (from the metadata cache when it is fresh):
+# every location on the account with TRACK_ALL_LOCATIONS, otherwise the current ids of the known sites
+def sync_locations():
+    account = metadata_registry.location_ids()
+    if TRACK_ALL_LOCATIONS:
+        location_ids.clear()
+        location_ids.update(account)
+        return
+    for name in location_ids:
+        if name in account:
+            location_ids[name] = account[name]
+        else:
+            print(f"{name} is not in HydroVu's locations list, keeping id {location_ids[name]}")
 
 
 # In[17]:
@@ -166,139 +346,103 @@ def get_dates(days_ago):
 # Makes a single API call for a given location with parameters(page, date)
 def make_one_call(desired_location, header_parameters):
     # Constructs a unique url using the LOCAL_DATA_ENDPOINT variable and desired_location input
-    response = requests.get(url=f"{LOCAL_DATA_ENDPOINT}{location_ids[desired_location]}/data",
-                            headers=headers_for_data, params=header_parameters)
+    # hydrovu_client already retried 429/5xx responses and refreshed the token on a 401
+    response = hydrovu_client.get(f"{LOCAL_DATA_ENDPOINT}{location_ids[desired_location]}/data",
+                                  endpoint="hydrovu data", params=header_parameters)
     
-    # Instead of raising an error, the function returns just a "null" value,
-    # which the dependent functions can handle
+    # HydroVu answers 404 when there is no data after startTime. That returns just a "null" value,
+    # which the dependent functions treat as the end of the data
     if response.ok:
-        print(f"{desired_location} hydrovu call worked")
-        print()
-        print(response.json())
-        print()
         return response
+    elif response.status_code == 404:
+        print(f"No more hydrovu data for {desired_location}")
+        return "null"
     else:
+        # Any other failure is raised instead of quietly ending pagination and dropping data
         print(f"The hydrovu call for {desired_location} did not work")
-        return "null"
+        response.raise_for_status()
     
     #data contains timestamp/value pairs for each parameterId, and each parameter has a unitId
 
 
 # In[19]:
 """
-The following functions are all very interconnected: loop_by_date(), extract_param_data(),
-process_responses(), and merge_dfs(). First, loop_by_date() iterates through all of the data in
-our specified date range. loop_by_date() stores all of the API call results in the response_list. 
-So, the response_list is a list of complex dictionary items that contain timestamp and value pairs
-for each parameter, but each dictionary is organized by timestamp and contains accessory information.
-Then, extract_param_data() sorts through the complex response_list and organizes a new dictionary, results,
-into parameter dataframes by page. (Remember, each page is only about 120 datapoints, which spans about
-2 days. Response will be a list of dictionaries, where there is a dictionary for each data page, and
-each dictionary consists of parameter_id code keys matched with organized, 1-parameter dataframe values.)
-process_responses() runs the previous two functions in a logically-sound way. Finally, merge_dfs takes the 
-list of page-separated parameter dictionaries and merges them into full parameter dataframes. That is, 
-the final output includes the combined_dfs dictionary, which for the given location over our specified
-time frame, consists of all paramaters with each parameter in its own singular dataframe.
+loop_by_date() iterates through all of the data in our specified date range. Each HydroVu call only
+returns a page of about 120 datapoints (about 2 days), so it keeps calling with the last timestamp
+of the previous page as the next startTime. Each page's JSON is parsed exactly once and kept in
+the page_list, a list of dictionaries that contain timestamp and value pairs for each parameter.
+Every fetched page is also written to the page cache, and a page that was full when it was cached
+is read from there instead of HydroVu (see cached_page), so a run that failed is resumed cheaply.
+decode_responses() then copies the readings of every page into one buffer per parameter
+(see page_decoder.py) and returns a dictionary of parameterId keys matched with a single dataframe
+per parameter, covering the whole time frame for that location.
 """
 
 # Establishes logic to make continuous HydroVu API calls by looping through data date-wise
 # HydroVu only returns about 120 data points with each request, so we need to loop multiple 
-def loop_by_date(desired_location, now_date, start_date):
+# end_time (optional) also sends HydroVu an endTime, so a call stays inside a backfill window
+def loop_by_date(desired_location, now_date, start_date, end_time=None):
     now_date = int(now_date) # ensures dates are the same type, in this case int because of epoch time
     start_date = int(start_date)
-    response_list = []
+    page_list = []
     checked_dates = [] # Anti infinite loop control
-    while start_date < now_date: # start_date must be some epoch date in the past
-        #print("start_date: ", datetime.fromtimestamp(start_date))
-        header_parameters = {
-            "startTime" : start_date, 
-        }
-        r = make_one_call(desired_location, header_parameters)
-        if r == "null": # if the make_one_call() does not return any data, stop looping
-            if not response_list:
-                print(f"{desired_location} returned a null value while empty")
-            break
-        response_list.append(r)
-        checked_dates.append(start_date)
-        
-        response_data = r.json()
-        end_date = response_data["parameters"][0]["readings"][-1]["timestamp"]
-        
-        start_date = end_date
-        if start_date in checked_dates: # if the next loop would check a date that we've already checked
-            break
-
-    return response_list
-
-# In[20]:
-
-
-# response.json as input and returns a dictionary of all the parameters in the response.json
-# outputs parameter dict with paramterID (pid) key and dataframe value
-def extract_param_data(loc_data):
-    loc_id = loc_data["locationId"]
-    results = {}
-    
-    for param in loc_data["parameters"]: # Loops through all parameters
-        pid = param["parameterId"]
-        
-        # Creates a dataframe based on the timestamp-value pairs for each parameter
-        df = pd.DataFrame(param["readings"]) 
-        
-        df["param_name"] = parameter_dict[pid]
-        df["unit_name"] = unit_dict[param["unitId"]]
-        df["locationId"] = loc_id
-        
-        results[pid] = df
-        
-    return results
-
-
-# In[21]:
-
-
-# input is a list of all API call responses for a location (so we can get multiple pages of data)
-# output is a list of all paramter dataframes, separated by API call page 
-# list of dicts, where each dict is all the parameters from an individual API call page
-def process_responses(response_list):
-    dict_list = []
-    for r in response_list:
-        response_data = r.json()
-        data_per_response = extract_param_data(response_data)
-        dict_list.append(data_per_response)
-    return dict_list
-
+    with run_report.stage("pagination", desired_location):
+        while start_date < now_date: # start_date must be some epoch date in the past
+            #print("start_date: ", datetime.fromtimestamp(start_date))
+            header_parameters = {
+                "startTime" : start_date, 
+            }
+            if end_time is not None:
+                header_parameters["endTime"] = int(end_time)
+            response_data = cached_page(desired_location, start_date, end_time)
+            if response_data is not None:
+                run_report.count("pages from cache", 1, desired_location)
+            else:
+                r = make_one_call(desired_location, header_parameters)
+                if r == "null": # if the make_one_call() does not return any data, stop looping
+                    if not page_list:
+                        print(f"{desired_location} returned a null value while empty")
+                    break
+                response_data = r.json() # the only time a page is parsed
+                if page_cache is not None:
+                    page_cache.put(location_ids[desired_location], start_date, r.content, end_time)
+            page_list.append(response_data)
+            checked_dates.append(start_date)
+            
+            end_date = response_data["parameters"][0]["readings"][-1]["timestamp"]
+            
+            start_date = end_date
+            if start_date in checked_dates: # if the next loop would check a date that we've already checked
+                break
 
+    run_report.count("pages fetched", len(page_list), desired_location)
+    return page_list
 
+# A cached page whose next page is cached too: it was full when fetched, so it can't have gained
+# readings since. The newest page of a location is always fetched again. None if there is no such page
+def cached_page(loc, start_time, end_time=None):
+    if page_cache is None:
+        return None
+    page = page_cache.get(location_ids[loc], start_time, end_time)
+    if page is None or not page["parameters"] or not page["parameters"][0]["readings"]:
+        return None
+    next_start = page["parameters"][0]["readings"][-1]["timestamp"]
+    if next_start == start_time or not page_cache.has(location_ids[loc], next_start, end_time):
+        return None
+    return page
 
-# In[23]:
+# In[20]:
 
 
-# Takes the list of separated dictionaries as input
-# Creates a key list based on all of the keys in the first dictionary
-# Concatenates dataframes based on matching key values
-# Returns the list of keys and the dictionary of dfs; use the key list to access the combined_dfs
-def merge_dfs(dict_list):
-    key_list = []
-    for d in dict_list: # Runs through all dictionaries and grabs their keys
-        dict_keys = d.keys() # Creates a list object with keys
-        for key in dict_keys:
-            key_list.append(key) # Breaks up the dict_keys list into individual keys
-   
-    key_list = set(key_list) # Gets only unique values in the list
-    
-    combined_dfs = {}
-    
-    for key in key_list: # Loops through each key and concats dicts key-wise
-        dfs_to_concat = []
-        for d in dict_list:
-            if key in d:
-                dfs_to_concat.append(d[key])
-        
-        if dfs_to_concat:
-            combined_dfs[key] = pd.concat(dfs_to_concat, ignore_index=True)
-        
-    return list(key_list), combined_dfs
+# Takes the list of page dictionaries from loop_by_date and returns a dictionary with a
+# parameterId key and one dataframe value per parameter (empty if there were no pages)
+# loc only labels the run report
+# (parameter and unit names are looked up in the metadata registry, which loads itself on first use)
+def decode_responses(page_list, loc=None):
+    with run_report.stage("decode", loc):
+        loc_dfs = page_decoder.decode_pages(page_list, parameter_dict, unit_dict)
+    run_report.count("rows decoded", sum(len(df) for df in loc_dfs.values()), loc)
+    return loc_dfs
 
 
 # In[24]:
@@ -307,59 +451,207 @@ def merge_dfs(dict_list):
 # Run this to build a csv for a location that does not have a csv yet
 def build_csv(loc, how_many_days_ago): # how many days in the past should we grab data for
     date_now, date_past = get_dates(how_many_days_ago) # gets actual date values
-    responses = loop_by_date(loc, date_now, date_past)
-    response_dict_list = process_responses(responses) # Returns a blank list, [], if the site has no data w/in date range
-    if response_dict_list != []: # if the response_dict_list is not empty
-        keys, loc_dfs = merge_dfs(response_dict_list)
-        #print(loc_dfs)
+    pages = loop_by_date(loc, date_now, date_past)
+    loc_dfs = decode_responses(pages, loc) # Returns a blank dict, {}, if the site has no data w/in date range
+    if loc_dfs: # if the loc_dfs dict is not empty
         for df in loc_dfs.values(): # Converts each df to csv based on unique path link
-            df.to_csv(f"C:\\Users\\GIS\\MichaelHudak projects\\HydroVu_Location_Params\\{loc}\\{df['param_name'].iloc[0]}.csv", index=False)
+            append_param_df(loc, df, os.path.join(BUILD_CSV_FOLDER, loc), mode='w')
     else:
         print(f"No data in timeframe for {loc}")
         
 
+# Fetches one backfill window for a location and returns a param_name -> dataframe dict
+# Readings past the window end are dropped; the next window covers them
+def fetch_window(loc, window_start, window_end):
+    pages = loop_by_date(loc, window_end, window_start, end_time=window_end)
+    loc_dfs = decode_responses(pages, loc)
+    window_dfs = {}
+    for df in loc_dfs.values():
+        df = df[df['timestamp'] <= window_end]
+        if not df.empty:
+            window_dfs[df['param_name'].iloc[0]] = df
+    return window_dfs
+
+# Parallel version of build_csv for onboarding a new location
+# The date range is split into BACKFILL_WINDOW_DAYS windows that are fetched at the same time.
+# If the run is interrupted, calling backfill_csv again for the location resumes from its checkpoint
+def backfill_csv(loc, how_many_days_ago, window_days=None):
+    window_days = window_days or BACKFILL_WINDOW_DAYS
+    date_now, date_past = get_dates(how_many_days_ago)
+    loc_dfs = backfill.run_backfill(loc, date_past, date_now,
+                                    lambda start, end: fetch_window(loc, start, end),
+                                    BACKFILL_FOLDER, window_days * 24 * 60 * 60,
+                                    max_workers=BACKFILL_WORKERS)
+    if not loc_dfs:
+        print(f"No data in timeframe for {loc}")
+    for df in loc_dfs.values():
+        append_param_df(loc, df, os.path.join(BUILD_CSV_FOLDER, loc), mode='w')
+    backfill.clear_checkpoint(BACKFILL_FOLDER, loc) # data is saved, the spooled windows are no longer needed
+
+
+# Rebuilds a location's data from the page cache alone, like build_csv but without calling HydroVu,
+# e.g. to reprocess everything after a change to decoding or storage. The replayed parameters' readings,
+# watermarks and rollups replace the stored ones. Evicted pages can't be replayed, so a location with
+# stored readings the cache no longer holds is left alone unless force is True (which drops those
+# readings). Returns whether the location was replayed
+def replay_location(loc, force=False):
+    if page_cache is None:
+        raise SystemExit("PAGE_CACHE_FOLDER is not set, there is nothing to replay")
+    pages = page_cache.location_pages(location_ids[loc]) # read one at a time while decoding
+    loc_dfs = decode_responses(pages, loc)
+    if not loc_dfs:
+        print(f"No cached pages for {loc}")
+        return False
+    folder_path = os.path.join(BUILD_CSV_FOLDER, loc)
+    missing = uncached_readings(loc, folder_path, loc_dfs)
+    if missing and not force:
+        print(f"Not replaying {loc}: {sum(missing.values())} stored readings of {', '.join(sorted(missing))} "
+              "are no longer in the page cache (use --force to replay anyway and drop them)")
+        return False
+    for df in loc_dfs.values():
+        append_param_df(loc, df, folder_path, mode='w')
+    # the replayed readings are QC cleaned from the start on the next clean
+    qc_rules.reset_state(os.path.join(STORE_FOLDER, loc) if STORE_FORMAT == "parquet" else folder_path)
+    return True
+
+# Per parameter, how many of a location's stored readings (in folder_path for csvs) are missing from
+# the readings decoded from the page cache, leaving out parameters with none missing
+def uncached_readings(loc, folder_path, loc_dfs):
+    cached = {df['param_name'].iloc[0] : df['timestamp'] for df in loc_dfs.values()}
+    if STORE_FORMAT == "parquet":
+        stored = {param : local_store.read_param(STORE_FOLDER, loc, param, columns=["timestamp"])["timestamp"]
+                  for param in local_store.list_params(STORE_FOLDER, loc)}
+    else:
+        stored = {os.path.splitext(os.path.basename(f))[0] : pd.read_csv(f, usecols=["timestamp"])["timestamp"]
+                  for f in qc_rules.param_csvs(folder_path)}
+    missing = {}
+    for param, stamps in stored.items():
+        count = int((~stamps.isin(cached[param])).sum()) if param in cached else len(stamps)
+        if count:
+            missing[param] = count
+    return missing
+
+
 # In[]:
+
+# Most recent timestamp across all of a location's parameters in the parquet store
+# Uses the watermark manifest, and only opens the newest month partition of a parameter missing from it
+# None if the location has nothing stored
+def store_most_recent_date(loc):
+    folder_path = os.path.join(STORE_FOLDER, loc)
+    marks = watermarks.load_watermarks(folder_path)
+    for param in local_store.list_params(STORE_FOLDER, loc):
+        if marks.get(param) is None:
+            last_date = local_store.last_timestamp(STORE_FOLDER, loc, param)
+            if last_date is not None:
+                marks[param] = last_date
+    if not marks:
+        return None
+    return max(marks.values())
+
+# Writes one parameter dataframe to storage and moves that parameter's watermark forward in the same step
+# Appended rows (mode='a') at or before the stored watermark are dropped, because the first page
+# of an update starts at the last stored timestamp. Together with the de-duplication in
+# decode_responses this keeps every stored parameter sorted by timestamp with no repeats
+def append_param_df(loc, df, folder_path, mode='a'):
+    param_name = df['param_name'].iloc[0]
+    if mode == 'a':
+        if STORE_FORMAT == "parquet":
+            last_date = watermarks.load_watermarks(os.path.join(STORE_FOLDER, loc)).get(param_name)
+            if last_date is None:
+                last_date = local_store.last_timestamp(STORE_FOLDER, loc, param_name)
+        else:
+            last_date = watermarks.param_watermark(folder_path, param_name)
+        if last_date is not None:
+            df = df[df['timestamp'] > last_date]
+        if df.empty:
+            return
+    with run_report.stage("storage write", loc):
+        if STORE_FORMAT == "parquet":
+            if mode == 'w': # the readings replace the stored ones instead of merging into them
+                local_store.remove_param(STORE_FOLDER, loc, param_name)
+            local_store.append_to_store(STORE_FOLDER, loc, df, location_ids[loc])
+            folder_path = os.path.join(STORE_FOLDER, loc)
+        else:
+            os.makedirs(folder_path, exist_ok=True) # a new site's first build, backfill or replay
+            csv_path = os.path.join(folder_path, f"{param_name}.csv")
+            if mode == 'a':
+                # a parameter the site starts logging gets a new csv, which needs its header
+                new_file = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+                df.to_csv(csv_path, mode='a', index=False, header=new_file)
+            else:
+                df.to_csv(csv_path, index=False)
+                csv_index.drop_index(csv_path)
+        if mode == 'w': # a rewritten parameter's watermark can move backwards
+            watermarks.clear_watermark(folder_path, param_name)
+        watermarks.record_watermark(folder_path, param_name, df['timestamp'].max())
+    with run_report.stage("rollups", loc):
+        # only the appended rows are aggregated; build_csv/backfill_csv (mode='w') start the rollups over
+        if mode == 'a':
+            # csvs (or a store) from before rollups existed get them built from every stored reading
+            rollups.update_rollups(folder_path, param_name, rollup_input(folder_path, df),
+                                   stored=lambda: rollup_input(folder_path, stored_readings(loc, param_name)))
+        else:
+            rollups.write_rollups(folder_path, param_name, rollup_input(folder_path, df))
+    run_report.count("rows written", len(df), loc)
     
 # Updates an existing set of csvs for a location that already has csvs
 def update_csv(loc):
     # Establishes a unique folder_path for the location folder
-    folder_path = f"C:\\Users\\GIS\\MichaelHudak projects\\test_data_cleaning\\{loc}"
-    # grab all files in that folder that end with .csv
-    all_files = glob.glob(os.path.join(folder_path, "*.csv")) 
-    final_date_list = []
-    for filename in all_files:
-        df = pd.read_csv(filename, header=0)
-        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]  # drop stray index columns
-        
-        if df.empty:  # skip empty files
-            print(f"Skipping empty file: {filename}")
-            continue
-        
-        last_date = df['timestamp'].iloc[-1]
-        final_date_list.append(last_date) # List of most recent dates for each parameter
-        
-    most_recent_date = max(final_date_list) # The most recent data across all parameters
-    responses = loop_by_date(loc, datetime.now().timestamp(), most_recent_date) 
-    response_dict_list = process_responses(responses)
-    keys, loc_dfs = merge_dfs(response_dict_list)
+    folder_path = os.path.join(CSV_FOLDER, loc)
+    if STORE_FORMAT == "parquet":
+        most_recent_date = store_most_recent_date(loc)
+    else:
+        # manifest lookup, with a last-line read for any csv that isn't in the manifest yet
+        most_recent_date = watermarks.most_recent_date(folder_path)
+    if most_recent_date is None: # an update continues from the stored data, so a new site needs a build first
+        print(f"No stored data for {loc}, skipping it (start it with: python main.py backfill \"{loc}\" <days>)")
+        return {}
+    pages = loop_by_date(loc, datetime.now().timestamp(), most_recent_date) 
+    loc_dfs = decode_responses(pages, loc)
     #print(loc, loc_dfs)
     
     if bool(loc_dfs) == True:
         # Appends (mode='a') new data to the existing csv
         for df in loc_dfs.values():
             try:
-                df.to_csv(f"{folder_path}\\{df['param_name'].iloc[0]}.csv", mode='a', index=False, header=False)
+                append_param_df(loc, df, folder_path, mode='a')
             except IndexError:
                 print(f"Code did not work for {loc} at file path {folder_path}")
     else:
         print(f"{loc} returned empty dataframes.")
+    return loc_dfs
                 
 
+# Runs update_csv for several locations at once. Each location still pages through HydroVu in order
+# and writes only to its own folder, so the stored data is the same as running them one after another.
+# Returns a dict of location -> exception for any location that failed, so one bad site doesn't stop the rest
+def update_all_locations(locs, concurrent=True, max_workers=None):
+    max_workers = max_workers or MAX_LOCATION_WORKERS
+    failures = {}
+    if not concurrent:
+        for loc in locs:
+            try:
+                update_csv(loc)
+            except Exception as error:
+                print(f"Update failed for {loc}: {error!r}")
+                failures[loc] = error
+        return failures
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {loc : pool.submit(update_csv, loc) for loc in locs}
+    for loc, future in futures.items():
+        if future.exception() is not None:
+            print(f"Update failed for {loc}: {future.exception()!r}")
+            failures[loc] = future.exception()
+    return failures
+
+
 # In[]:
 # Meant to restructure cssvs with proper column headers, if they get messed up through cleaning or updating
 def rebuild_csvs(loc):
-    folder_path = f"C:\\Users\\GIS\\MichaelHudak projects\\test_data_cleaning\\{loc}"
-    all_files = glob.glob(os.path.join(folder_path, "*.csv"))
+    folder_path = os.path.join(CSV_FOLDER, loc)
+    all_files = qc_rules.param_csvs(folder_path) # every csv except sidecars like _qc_flags.csv
     expected_columns = ['timestamp', 'value', 'param_name', 'unit_name', 'locationId']
     
     for filename in all_files:
@@ -379,8 +671,13 @@ def rebuild_csvs(loc):
         # Keep only the expected columns in the right order
         df = df[expected_columns]
         
-        df.drop_duplicates(inplace=True)
+        # New data is de-duplicated as it is appended, so this only matters for csvs written before that.
+        # Sorted by timestamp and keyed on timestamp alone, matching what ingestion keeps
+        df['timestamp'] = pd.to_numeric(df['timestamp'])
+        df = df.sort_values('timestamp', kind='stable').drop_duplicates(subset='timestamp', keep='first')
         df.to_csv(filename, index=False)
+        csv_index.drop_index(filename)
+        rollups.write_rollups(folder_path, os.path.splitext(os.path.basename(filename))[0], rollup_input(folder_path, df))
         print(f"Rebuilt: {filename} ({len(df)} rows)")
 
 
@@ -390,18 +687,24 @@ Takes a location name as input and creates a folder_path link for that location.
 Uses a try/except pairing so that the code doesn't crash if a location folder does not exist yet.
 Grabs all the .csv files from the folder path, coverts each one to a dataframe, and returns 
 a list of all the dataframes.
+With start and/or end (epoch seconds, inclusive) only the rows in that window are read, through csv_index.
 """
-def dfs_from_csvs(loc):
+def dfs_from_csvs(loc, params=None, start=None, end=None):
     # Creates a path to the location folder, which is flexible to the location input
-    folder_path = f"C:\\Users\\GIS\\MichaelHudak projects\\test_data_cleaning\\{loc}"
+    folder_path = os.path.join(CSV_FOLDER, loc)
     expected_columns = {'timestamp', 'value', 'param_name', 'unit_name', 'locationId'}
     
     # If this function is run for a location without a folder, the function will jump to the except statement
     try: 
-        all_files = glob.glob(os.path.join(folder_path, "*.csv")) # Grabs all .csv files in the folder_path
+        all_files = qc_rules.param_csvs(folder_path) # Grabs all parameter .csv files in the folder_path
+        if params is not None: # only the named parameters
+            all_files = [f for f in all_files if os.path.splitext(os.path.basename(f))[0] in params]
         df_list = []
         for filename in all_files:
-            df = pd.read_csv(filename, header=0)
+            if start is None and end is None:
+                df = pd.read_csv(filename, header=0)
+            else:
+                df = csv_index.read_window(filename, start, end)
             df = df.loc[:, ~df.columns.str.contains('^Unnamed')]  # drop stray index columns
             
             df = df[df['timestamp'] != 'timestamp']  # strip duplicate header rows
@@ -412,15 +715,165 @@ def dfs_from_csvs(loc):
                 continue
             
             if not df.empty:
-                df_list.append(df) # stores all converted dfs in a list
+                df_list.append(schema.compact_frame(df)) # stores all converted dfs in a list
         return df_list
     except: 
         print(f"{loc} csvs do not exist")
 
+# Reads a location's data from whichever storage format is in use
+# Returns the same list of per-parameter dataframes as dfs_from_csvs
+# A start/end window is read through the month partitions and parquet row-group statistics,
+# or through the csv index, so only the rows in (or near) the window are read
+def dfs_from_storage(loc, params=None, start=None, end=None):
+    if STORE_FORMAT == "parquet":
+        return local_store.dfs_from_store(STORE_FOLDER, loc, params, start, end)
+    return dfs_from_csvs(loc, params, start, end)
+
+# The folder holding a location's data, watermarks, QC flags and rollups
+def location_folder(loc):
+    return os.path.join(STORE_FOLDER if STORE_FORMAT == "parquet" else CSV_FOLDER, loc)
+
+# Names of the parameters stored for a location
+def stored_params(loc):
+    if STORE_FORMAT == "parquet":
+        return local_store.list_params(STORE_FOLDER, loc)
+    return sorted(os.path.splitext(os.path.basename(f))[0] for f in qc_rules.param_csvs(os.path.join(CSV_FOLDER, loc)))
+
+"""
+Loads every location once into a single long-format table (one row per reading) with
+categorical param_name, unit_name and locationId columns (see schema.py). All of the per-parameter
+dataframes are concatenated in one step, so building it grows linearly with the data.
+Use table.groupby('param_name', observed=True) to get each parameter's rows across all locations.
+"""
+def load_long_table(locs, params=None):
+    return query(locs, params)
+
+"""
+Readings of the given locations (a name or a list) and parameters (None = all) with
+start <= timestamp <= end (epoch seconds; None leaves that side open), as one long table
+like load_long_table's, with the QC-flagged readings left out.
+Only the rows in the window are read, so the last 30 days cost the same however long the archive is:
+    query(location_ids, ["Temperature"], time.time() - 30 * 86400)
+"""
+def query(locations, params=None, start=None, end=None):
+    if isinstance(locations, str):
+        locations = [locations]
+    frames = []
+    for loc in locations:
+        frames.extend(load_location(loc, params, start, end))
+    return long_table_from(frames)
+
+# A location's per-parameter dataframes with the QC-flagged readings left out
+def load_location(loc, params=None, start=None, end=None):
+    with run_report.stage("storage read", loc):
+        df_list = dfs_from_storage(loc, params, start, end) # None if the location has no csvs
+        if df_list:
+            # readings flagged by the QC rules (data_cleaning.py) are left out
+            flags = qc_rules.read_flags(location_folder(loc))
+            df_list = [qc_rules.drop_flagged(df, flags) for df in df_list if not df.empty]
+    run_report.count("rows read", sum(len(df) for df in df_list or []), loc)
+    return df_list or []
+
+# value_dtype is PLOT_VALUE_DTYPE for tables that are only plotted
+def long_table_from(frames, value_dtype=schema.STORED_VALUE_DTYPE):
+    return schema.concat_frames(frames, value_dtype)
+
+# The weather table for every station file, parsed once and then read from the cache
+def load_weather_table():
+    with run_report.stage("weather read"):
+        weather_df = weather.load_weather(WEATHER_FILES, WEATHER_CACHE_FOLDER)
+    run_report.count("weather rows read", len(weather_df))
+    return weather_df
+
+# The long table of readings with air temperature, pressure and precipitation from the nearest
+# WEATHER_STATION reading (within WEATHER_JOIN_TOLERANCE) attached, e.g. for storm-response analysis
+def readings_with_weather(locs, params=None, columns=None, tolerance=None):
+    table = load_long_table(locs, params)
+    with run_report.stage("weather join"):
+        return weather.join_weather(table, load_weather_table(), columns,
+                                    tolerance if tolerance is not None else WEATHER_JOIN_TOLERANCE,
+                                    station=WEATHER_STATION)
+
+# Rollup plot rows (each bucket's min and max) for a parameter whose span is too long to plot raw,
+# or None when the raw readings are few enough (or there is no rollup yet)
+def rollup_plot_rows(loc, param, start=None, end=None):
+    folder_path = location_folder(loc)
+    daily = rollups.read_rollup(folder_path, param, "day", start, end)
+    if daily is None or daily.empty:
+        return None
+    span_start = start if start is not None else daily['bucket'].iloc[0]
+    span_end = end if end is not None else daily['bucket'].iloc[-1] + rollups.RESOLUTIONS["day"]
+    resolution = rollups.choose_resolution(daily['count'].sum(), span_end - span_start, ROLLUP_MAX_ROWS)
+    if resolution == "raw":
+        return None
+    rollup = daily if resolution == "day" else rollups.read_rollup(folder_path, param, resolution, start, end)
+    df = rollups.plot_rows(rollup, resolution)
+    df['param_name'] = param
+    df['unit_name'] = UNITS_BY_PARAM.get(param)
+    df['locationId'] = location_ids[loc]
+    run_report.count(f"{resolution} rollup rows read", len(rollup), loc)
+    return df
+
+# A location's per-parameter dataframes for plotting: raw readings (QC flags dropped) for short
+# spans, the hourly or daily rollups for long ones, whichever is the coarsest that suits the span.
+# Values are held as PLOT_VALUE_DTYPE. Only the last PLOT_WINDOW_DAYS are read, when set
+def plot_frames(loc, params=None):
+    start = plot_window_start()
+    frames = []
+    raw_params = []
+    for param in stored_params(loc):
+        if params is not None and param not in params:
+            continue
+        df = rollup_plot_rows(loc, param, start)
+        if df is None:
+            raw_params.append(param)
+        else:
+            frames.append(df)
+    if raw_params:
+        frames.extend(load_location(loc, raw_params, start))
+    return [schema.compact_frame(df, PLOT_VALUE_DTYPE) for df in frames]
+
+# Epoch seconds where the plotted window starts, or None to plot everything
+def plot_window_start():
+    if PLOT_WINDOW_DAYS is None:
+        return None
+    return int(time.time() - PLOT_WINDOW_DAYS * 86400)
+
+# Readings as the rollups aggregate them: values QC has flagged are blanked, so a plot drawn from the
+# rollups leaves them out the same way the raw readings do (load_location), and their buckets are kept
+def rollup_input(folder_path, df):
+    return qc_rules.mask_flagged(df, qc_rules.read_flags(folder_path))
+
+# Rebuilds a location's rollups from its stored readings, leaving out the QC-flagged ones
+# (clean_locations keeps them in step with the flags; this is for anything else that rewrote the data)
+def rebuild_rollups(loc):
+    folder_path = location_folder(loc)
+    for df in dfs_from_storage(loc) or []:
+        if not df.empty:
+            rollups.write_rollups(folder_path, df['param_name'].iloc[0], rollup_input(folder_path, df))
+
+# Every stored reading of one parameter of a location
+def stored_readings(loc, param):
+    frames = dfs_from_storage(loc, [param]) or []
+    return frames[0] if frames else schema.empty_frame()
+
+# Recomputes the rollup buckets holding newly flagged readings (flags_df: timestamp, param_name),
+# from the stored readings of the whole days involved
+def refresh_flagged_rollups(loc, flags_df):
+    folder_path = location_folder(loc)
+    day = rollups.RESOLUTIONS["day"]
+    for param, timestamps in flags_df.groupby('param_name')['timestamp']:
+        start = int(timestamps.min()) // day * day
+        end = int(timestamps.max()) // day * day + day - 1
+        frames = dfs_from_storage(loc, [param], start, end) or []
+        if frames:
+            rollups.refresh_buckets(folder_path, param, timestamps, rollup_input(folder_path, frames[0]))
+
 # ## 4. Make the plots (pyplot & plotly)
 
 # In[39]:
 
+# import matplotlib.pyplot as plt
 # def make_graph(df, title, unit):
 #     plt.scatter(df.timestamp, df.value, color='black', marker='o')
     
@@ -438,7 +891,15 @@ plotly_graph is not called in the typical script run, HOWEVER
 if you want to experiment with graph appearance, use this for convenience
 """    
 
+# plotly takes about a second to import, so it is loaded the first time a figure is drawn
+def load_plotly():
+    import plotly.express as px
+    import plotly.io as pio
+    pio.renderers.default = 'browser' #determines how plot displays
+    return px
+
 def plotly_graph(df, loc, param, unit):
+    px = load_plotly()
     fig = px.scatter(x=df['timestamp'], y=df["value"],
                  labels={'x': "Time",
                          'y': f"{loc} {param} ({unit})"})
@@ -461,6 +922,12 @@ def location_id_to_name(df):
 
 def all_site_plotly_graph(dfs, param):
     #big_df = pd.concat([sec_df, morg_df])
+    px = load_plotly()
+    # Downsample each location's line separately so every site keeps its own spikes
+    if not dfs.empty:
+        dfs = pd.concat([downsample_df(loc_df, PLOT_TARGET_POINTS, PLOT_DOWNSAMPLE_METHOD)
+                         for loc_id, loc_df in dfs.groupby('locationId', sort=False, observed=True)], ignore_index=True)
+    dfs['value'] = schema.exact_float64(dfs['value'])
     plot_times = convert_dates(dfs['timestamp'])
     big_df = location_id_to_name(dfs)
     unit_label = UNITS_BY_PARAM[param]
@@ -489,14 +956,18 @@ def all_site_plotly_graph(dfs, param):
 # Path Parameter constants
 OWNER = "WC-CES-Watershed-Innovation-Lab"
 REPO  = "WaterQualityData"
+BRANCH = "main" # the Pages workflow deploys from this branch
 
+# github_client is built in init_clients() with the other API clients
 
-# The local_git_token may need manual updates in GitHub
-git_headers = {
-    "Authorization" : f"token {LOCAL_GIT_TOKEN}",
-    "Accept": "application/vnd.github+json",
-    "User-Agent": "data_update"
-}
+# Collects rendered plots and pushes them all as one commit through the Git Data API
+def make_publisher():
+    return GitDataPublisher(github_client, OWNER, REPO, branch=BRANCH)
+
+# Changing the downsampling settings changes every figure, so they are part of the manifest's input hash
+def make_plot_manifest():
+    return PlotManifest(PLOT_MANIFEST_PATH,
+                        render_settings=f"{PLOT_DOWNSAMPLE_METHOD}:{PLOT_TARGET_POINTS}:{PLOT_PAGE_FORMAT}")
 
 
 # In[65]:
@@ -504,9 +975,7 @@ git_headers = {
 
 # Checks if file exists and returns necessary information
 def file_exists(url):
-    global git_headers
-    
-    meta = requests.get(url, headers=git_headers)
+    meta = github_client.get(url, endpoint="github contents GET")
     if meta.status_code == 200:
         return meta.json()["sha"] # sha is important for GitHub access
     else:
@@ -517,8 +986,6 @@ def file_exists(url):
 
 # Make the request to GitHub to alter graph files
 def git_api_call(url, content):
-    global git_headers
-
     sha = file_exists(url) # Checks if file exists before proceeding
     
     git_body_params = {
@@ -530,7 +997,8 @@ def git_api_call(url, content):
         git_body_params["sha"] = sha
     
     # This should NOT be indented
-    response = requests.put(url, headers=git_headers, json=git_body_params)
+    with run_report.stage("github upload"):
+        response = github_client.put(url, endpoint="github contents PUT", json=git_body_params)
     response.raise_for_status()
     print(response.json())
     # else:
@@ -548,101 +1016,472 @@ def convert_dates(time_array):
     return new_dates
     
 
+# The html page for a figure, in the PLOT_PAGE_FORMAT style
+def figure_html(fig, figure_path, title=""):
+    if PLOT_PAGE_FORMAT == "compact":
+        return compact_figure.compact_page(fig, figure_path, title)
+    buf = StringIO()
+    fig.write_html(buf, include_plotlyjs='cdn', div_id="plot") # fixed div id so the same data gives the same html
+    return buf.getvalue()
+
+# Compact pages all load the same shell script, which is published with them (only when it changed)
+def publish_shell(publisher, manifest=None):
+    if PLOT_PAGE_FORMAT != "compact":
+        return
+    shell = compact_figure.shell_js()
+    if manifest is not None and not manifest.needs_upload(compact_figure.SHELL_PATH, None, shell):
+        return
+    publisher.add(compact_figure.SHELL_PATH, shell)
+
+
 # In[71]:
 
 
-def plotly_bytes(df, loc, param, unit):
+# One location's figure for a parameter, drawn and published like the batched ones (see render_to)
+# With a publisher (see make_publisher), the html is queued for one batched commit
+# instead of being uploaded on its own through git_api_call
+# With a manifest (see make_plot_manifest), html identical to the published page is not uploaded again
+def plotly_bytes(df, loc, param, unit, publisher=None, manifest=None):
+    job = figure_job("location", f"docs/{loc}/{param}.html", df, param, loc, unit)
+    if wanted(job, manifest):
+        render_to([job], publisher, manifest)
+
+# The docs page figure for one location and parameter
+def location_figure(df, loc, param, unit):
     #dates = convert_dates(df['timestamp'])
     #convert_times() function needs to be defined. Set x equal to dates
-    x_times = convert_dates(df['timestamp'])
+    px = load_plotly()
+    plot_df = downsample_df(df, PLOT_TARGET_POINTS, PLOT_DOWNSAMPLE_METHOD)
+    x_times = convert_dates(plot_df['timestamp'])
     
-    fig = px.scatter(x=x_times, y=df["value"],
+    fig = px.scatter(x=x_times, y=schema.exact_float64(plot_df["value"]),
                  labels={'x': "Time",
                          'y': f"{loc} {param} {unit}"})
-    #shows interactive plot in browser
-    #fig.show()
-    buf = StringIO()
-    fig.write_html(buf, include_plotlyjs='cdn')
-
-        
-    html_text = buf.getvalue()
+    return fig
 
-    content_base64 = base64.b64encode(html_text.encode("utf-8")).decode("utf-8") 
+# A weather parameter's figure, downsampled per station the same as the water quality lines
+def weather_param_figure(param_df, param):
+    plot_df = pd.concat([downsample_df(station_df, PLOT_TARGET_POINTS, PLOT_DOWNSAMPLE_METHOD)
+                         for station, station_df in param_df.groupby('station', sort=False, observed=True)],
+                        ignore_index=True)
+    return weather.weather_figure(plot_df, param)
 
-    url = f"https://api.github.com/repos/{OWNER}/{REPO}/contents/docs/{loc}/{param}.html"
 
-    git_api_call(url, content_base64)
 
-# Similar to plotly_bytes above but does not require specified loc or unit
-def all_locs_plotly_bytes(fig, plot_param):
-    
-    buf = StringIO()
-    fig.write_html(buf, include_plotlyjs='cdn')
+# In[]:
 
-        
-    html_text = buf.getvalue()
+"""
+Figures are rendered in two steps. The *_jobs functions below load the data and list the
+figures that need drawing (with a manifest, figures whose data did not change are left out).
+render_to() then draws and serializes them on a pool of RENDER_WORKERS processes, since that
+work is CPU-bound, and hands the html to the publisher (make_publisher, or a FolderPublisher
+for local checks) in the order the jobs were listed, so every run produces the same commit.
+"""
 
-    content_base64 = base64.b64encode(html_text.encode("utf-8")).decode("utf-8")
+# One figure to draw. Only plain data, so it can be sent to a worker process
+def figure_job(kind, figure_path, df, param, loc=None, unit=None):
+    return {"kind" : kind, "figure_path" : figure_path, "df" : df, "param" : param, "loc" : loc, "unit" : unit}
+
+# The data the manifest hashes for a job (weather stations stand in for locations)
+def manifest_frame(job):
+    if job["kind"] == "weather":
+        return job["df"].rename(columns={'station' : 'locationId'})
+    return job["df"]
+
+def wanted(job, manifest):
+    if manifest is not None and not manifest.needs_render(job["figure_path"], manifest_frame(job)):
+        print(f"No new data for {job['figure_path']}, skipping")
+        return False
+    return True
+
+# Every parameter across all locations (the "All Locations" pages)
+# params limits the figures to those parameters (None = all of them)
+def all_location_jobs(locs, manifest=None, params=None):
+    # One table with every location's readings (or rollups, for long spans), split into
+    # per-parameter slices by a single groupby
+    long_table = long_table_from([df for loc in locs for df in plot_frames(loc, params)], PLOT_VALUE_DTYPE)
+    run_report.count("plot table bytes", schema.memory_bytes(long_table))
+    param_groups = dict(tuple(long_table.groupby('param_name', observed=True, sort=False)))
+
+    jobs = []
+    for param in ALL_PARAMS:
+        if param not in param_groups: # no location has this parameter
+            continue
+        job = figure_job("all", f"All Locations/{param}.html", param_groups[param], param)
+        if wanted(job, manifest):
+            jobs.append(job)
+    return jobs
+
+# The docs folder pages, one plot per location and parameter
+def each_location_jobs(locs, manifest=None, params=None):
+    jobs = []
+    for loc in locs:
+        for df in plot_frames(loc, params): # empty if no csv exists
+            param_name = df['param_name'].iloc[0]
+            unit_name = df['unit_name'].iloc[0]
+            job = figure_job("location", f"docs/{loc}/{param_name}.html", df, param_name, loc, unit_name)
+            if wanted(job, manifest):
+                jobs.append(job)
+    return jobs
+
+# The Weather Data pages (weather_plots/<column>.html), one line per station like weather_plotly.R drew them
+def weather_jobs(manifest=None):
+    long_df = weather.weather_long(load_weather_table())
+    jobs = []
+    for param, param_df in long_df.groupby('param', sort=False):
+        job = figure_job("weather", f"weather_plots/{param}.html", param_df, param)
+        if wanted(job, manifest):
+            jobs.append(job)
+    return jobs
+
+# Draws one job's figure and returns its html and what it cost: seconds spent plotting and serializing,
+# and rows plotted. This runs in a worker process, whose own run_report never reaches the main one,
+# so render_figures adds these to the report
+def draw_figure(job):
+    start = time.perf_counter()
+    if job["kind"] == "all":
+        fig, param = all_site_plotly_graph(job["df"], job["param"])
+        title = f"{param} by Location"
+    elif job["kind"] == "location":
+        fig = location_figure(job["df"], job["loc"], job["param"], job["unit"])
+        title = f"{job['loc']} {job['param']}"
+    else:
+        fig = weather_param_figure(job["df"], job["param"])
+        title = weather.WEATHER_DISPLAY_NAMES.get(job["param"], job["param"])
+    plotted = time.perf_counter()
+    html_text = figure_html(fig, job["figure_path"], title)
+    stats = {"plotting" : plotted - start, "html serialization" : time.perf_counter() - plotted,
+             "rows plotted" : sum(len(trace.x) for trace in fig.data if trace.x is not None)}
+    return html_text, stats
+
+# Settings a worker needs to draw the same figures as this process, which may have read a settings file
+def render_settings():
+    settings = {name : globals()[name] for name in ("PLOT_DOWNSAMPLE_METHOD", "PLOT_TARGET_POINTS",
+                                                    "PLOT_PAGE_FORMAT", "UNITS_BY_PARAM")}
+    settings["location_ids"] = dict(location_ids)
+    return settings
+
+def init_render_worker(settings):
+    globals().update(settings)
+
+# The html of every job, in job order
+def render_figures(jobs, workers=None):
+    workers = min(workers or RENDER_WORKERS or os.cpu_count() or 1, len(jobs))
+    with run_report.stage("figure rendering"):
+        if workers <= 1:
+            results = [draw_figure(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                                     initargs=(render_settings(),)) as pool:
+                results = list(pool.map(draw_figure, jobs)) # map returns results in job order
+    for job, (html_text, stats) in zip(jobs, results):
+        run_report.add_time("plotting", stats["plotting"], job["loc"])
+        run_report.add_time("html serialization", stats["html serialization"], job["loc"])
+        run_report.count("rows plotted", stats["rows plotted"], job["loc"])
+        run_report.count("html bytes", len(html_text), job["loc"])
+    return [html_text for html_text, stats in results]
+
+# Renders the jobs and passes the html that differs from what is published to the publisher
+# (without a publisher, each file is uploaded on its own through git_api_call)
+def render_to(jobs, publisher, manifest=None):
+    for job, html_text in zip(jobs, render_figures(jobs)):
+        figure_path = job["figure_path"]
+        if manifest is not None and not manifest.needs_upload(figure_path, manifest_frame(job), html_text):
+            continue
+        if publisher is not None:
+            publisher.add(figure_path, html_text)
+            continue
+        content_base64 = base64.b64encode(html_text.encode("utf-8")).decode("utf-8")
+        git_api_call(f"https://api.github.com/repos/{OWNER}/{REPO}/contents/{figure_path}", content_base64)
+
+# Every figure asked for, rendered together so the pool stays busy
+def plot_jobs(locs, per_location=False, weather_plots=False, manifest=None):
+    jobs = all_location_jobs(locs, manifest)
+    if per_location:
+        jobs += each_location_jobs(locs, manifest)
+    if weather_plots:
+        jobs += weather_jobs(manifest)
+    return jobs
+
+# Renders the changed plots and pushes them all to GitHub in a single commit
+def publish_plots(locs, per_location=False, weather_plots=False):
+    publisher = make_publisher()
+    plot_manifest = make_plot_manifest() # figures without new data are neither rendered nor uploaded
+    render_to(plot_jobs(locs, per_location, weather_plots, plot_manifest), publisher, plot_manifest)
+    publish_shell(publisher, plot_manifest)
+    with run_report.stage("github upload"):
+        publisher.publish("Updating the plots")
+    plot_manifest.save() # only after the publish went through
 
-    url = f"https://api.github.com/repos/{OWNER}/{REPO}/contents/All Locations/{plot_param}.html"
 
-    git_api_call(url, content_base64)
+# In[]:
 
 
+# Runs the QC rules in QC_RULES (through data_cleaning.py) over the locations' csvs (or their data in the parquet store);
+# only the rows appended since the last clean are checked unless full is True
+def clean_locations(locs, full=False):
+    import data_cleaning # the clean functions live there; they get their settings from here
+    data_cleaning.CSV_FOLDER = CSV_FOLDER
+    data_cleaning.STORE_FOLDER = STORE_FOLDER
+    data_cleaning.QC_RULES = QC_RULES
+    data_cleaning.INCREMENTAL = not full
+    for loc in locs:
+        if STORE_FORMAT == "parquet":
+            new_flags = data_cleaning.clean_store(loc)
+        else:
+            new_flags = data_cleaning.clean_csv(loc)
+        # the rollups were built before these readings were flagged
+        with run_report.stage("rollups", loc):
+            if full:
+                rebuild_rollups(loc)
+            elif new_flags is not None and not new_flags.empty:
+                refresh_flagged_rollups(loc, new_flags)
+
+# Publishes the figures that new data can have changed: the all-location plots of the changed parameters,
+# and with per_location the changed locations' own plots. changed is {location : set of parameter names}
+# The plot manifest records what is on GitHub, so a publisher given here (a folder) renders every
+# changed figure and leaves the manifest alone, like the plot command
+def publish_changes(changed, per_location=False, publisher=None):
+    plot_manifest = make_plot_manifest() if publisher is None else None
+    publisher = publisher or make_publisher()
+    params = set().union(*changed.values())
+    jobs = all_location_jobs(location_ids, plot_manifest, params)
+    if per_location:
+        jobs += each_location_jobs(list(changed), plot_manifest, params)
+    render_to(jobs, publisher, plot_manifest)
+    publish_shell(publisher, plot_manifest)
+    with run_report.stage("github upload"):
+        publisher.publish(f"New data from {', '.join(sorted(changed))}")
+    if plot_manifest is not None:
+        plot_manifest.save()
+
+# Timestamps of a location's last stored day of readings (one parameter is enough, the sonde logs
+# them all at once), for a new watch schedule to learn the logging cadence from
+def stored_timestamps(loc):
+    params = stored_params(loc)
+    if not params:
+        return []
+    if STORE_FORMAT == "parquet":
+        last_date = store_most_recent_date(loc)
+    else:
+        last_date = watermarks.most_recent_date(location_folder(loc))
+    if last_date is None:
+        return []
+    frames = load_location(loc, params[:1], start=last_date - 86400)
+    return frames[0]['timestamp'] if frames else []
+
+# One watch poll of a location: new pages decoded and appended (update_csv); returns the reading
+# timestamps it got back and the parameters they belong to
+def poll_location(loc):
+    loc_dfs = update_csv(loc)
+    if not loc_dfs:
+        return pd.Series(dtype=schema.TIMESTAMP_DTYPE), set()
+    params = {df['param_name'].iloc[0] for df in loc_dfs.values()}
+    return pd.concat([df['timestamp'] for df in loc_dfs.values()], ignore_index=True), params
+
+# Keeps every location up to date until stopped (Ctrl+C). Each location is polled on its own
+# schedule (see poll_schedule.py); a round of polls with new data goes through the incremental QC
+# clean and marks those locations' figures for publishing, which happens at most every
+# WATCH_PUBLISH_INTERVAL seconds. output writes the html to that folder instead of GitHub.
+# rounds stops after that many rounds of polls (None = never)
+def watch(locs, per_location=False, output=None, rounds=None):
+    schedules = poll_schedule.load_schedules(WATCH_STATE_PATH)
+    for loc in locs:
+        if loc not in schedules:
+            schedules[loc] = poll_schedule.SiteSchedule()
+            schedules[loc].seed(stored_timestamps(loc))
+    pending = {} # location -> parameters with data that isn't published yet
+    unclean = [] # locations whose QC clean failed, cleaned again after the next round of polls
+    last_publish = 0.0
+    done = 0
+    try:
+        while True:
+            now = time.time()
+            due = [loc for loc in locs if schedules[loc].due(now)]
+            if due:
+                with ThreadPoolExecutor(max_workers=MAX_LOCATION_WORKERS) as pool:
+                    futures = {loc : pool.submit(poll_location, loc) for loc in due}
+                new_data = []
+                for loc, future in futures.items():
+                    if future.exception() is not None:
+                        print(f"Watch poll failed for {loc}: {future.exception()!r}")
+                        schedules[loc].failed(time.time(), WATCH_MIN_INTERVAL, WATCH_MAX_INTERVAL)
+                        run_report.count("watch poll failures", 1, loc)
+                        continue
+                    timestamps, params = future.result()
+                    new_rows = schedules[loc].record(time.time(), timestamps, WATCH_MIN_INTERVAL, WATCH_MAX_INTERVAL)
+                    run_report.count("watch polls", 1, loc)
+                    if new_rows:
+                        run_report.count("watch new readings", new_rows, loc)
+                        new_data.append(loc)
+                        pending.setdefault(loc, set()).update(params)
+                unclean += [loc for loc in new_data if loc not in unclean]
+                if unclean:
+                    with run_report.stage("qc clean"):
+                        for loc in list(unclean):
+                            try:
+                                clean_locations([loc])
+                            except Exception as error: # its data stays pending, like a failed publish
+                                print(f"QC clean failed for {loc}: {error!r}")
+                                run_report.count("watch clean failures", 1, loc)
+                                continue
+                            unclean.remove(loc)
+                poll_schedule.save_schedules(WATCH_STATE_PATH, schedules)
+                done += 1
+
+            if pending and time.time() - last_publish >= WATCH_PUBLISH_INTERVAL:
+                last_publish = time.time()
+                try:
+                    publish_changes(pending, per_location, FolderPublisher(output) if output else None)
+                except Exception as error: # e.g. GitHub unreachable: kept pending for the next publish
+                    print(f"Publishing failed: {error!r}")
+                    run_report.count("watch publish failures")
+                    continue
+                print(f"Published new data from {', '.join(sorted(pending))}")
+                pending = {}
+                if page_cache is not None:
+                    run_report.count("cached pages evicted", page_cache.evict())
+                run_report.write(RUN_REPORT_PATH)
+
+            if rounds is not None and done >= rounds:
+                break
+            wake = min(schedules[loc].next_poll for loc in locs)
+            if pending:
+                wake = min(wake, last_publish + WATCH_PUBLISH_INTERVAL)
+            time.sleep(max(1.0, wake - time.time()))
+    except KeyboardInterrupt:
+        print("Watch stopped")
+    finally:
+        poll_schedule.save_schedules(WATCH_STATE_PATH, schedules)
+    if pending:
+        print(f"Not published yet (the next publish picks them up): {', '.join(sorted(pending))}")
 
-# In[]:
 
 """
-Must uncomment for loop codes for full functionality.
- - change the number in the build_csv loop decide how many days in the past to start the csv
- - only run build_csv for a new location, or if an old location's csv gets deleted
- - run rebuild_csvs if the column headers get misformatted
- - the update_csv loop must be run before the plotly_bytes loop can have any effect
-"""    
-
-# new_location = ""
-# build_csv(new_location, 500)
-
-# for loc in location_ids:
-#     rebuild_csvs(loc)
-
-
-## ADDS RECENT DATA TO THE CSV FILES
-for loc in location_ids:
-    update_csv(loc)
-
-### THIS updates the docs folder in GitHub, which can be used if we want plots for each location
-# for loc in location_ids:
-#     dfs_to_convert = dfs_from_csvs(loc) # NoneType if no csv exists
-#     if dfs_to_convert:
-#         for df in dfs_to_convert:
-#             param_name = df['param_name'].iloc[0]
-#             unit_name = df['unit_name'].iloc[0]
-#             plotly_bytes(df, loc, param_name, unit_name)
-
-### RUN ALL BELOW CODE TO UPDATE GRAPHS ON GITHUB            
-all_loc_dfs = {}    
-for loc in location_ids:
-    list_name = f"{loc}_df_list"
-    all_loc_dfs[list_name] = dfs_from_csvs(loc) # creates key:value pair with location name key and list of dataframes
-
-# Establish the all-loc dfs per parameter
-all_loc_param_dfs = {}
-for param in ALL_PARAMS: # this is for sure an inefficient sorting algorithm
-    param_df = pd.DataFrame() # creates a dataframe to store data across all locations for the given param
-    for loc in all_loc_dfs: #steps through each location and grabs all of its dataframes
-        df_list = all_loc_dfs[loc]
-        
-        # This double for-loop is inefficient, but I tried a different way that didn't work
-        for df in df_list: 
-            if not df.empty and df['param_name'].iloc[0] == param: # pulls out param-specific df and concatenates to all-location df for that param
-                param_df = pd.concat([param_df, df])
-    plot_fig, plot_param = all_site_plotly_graph(param_df, param)
-    all_locs_plotly_bytes(plot_fig, plot_param)
-    all_loc_param_dfs[param] = param_df
-
+Command line use (python main.py --help lists every option):
+    python main.py update                       ADDS RECENT DATA to every location (what the scheduled run needs)
+    python main.py backfill "<location>" 500    builds a new location's data, in parallel windows that can resume
+    python main.py replay                       rebuilds every location's data from the page cache, offline
+    python main.py clean                        flags readings with the QC rules in QC_RULES
+    python main.py plot                         writes the plots to PLOT_OUTPUT_FOLDER without publishing
+    python main.py publish                      UPDATES GRAPHS ON GITHUB, only for data that changed
+    python main.py                              update, then publish (what running the whole script used to do)
+    python main.py watch                        KEEPS RUNNING: updates, cleans and publishes each site as new data arrives
+Settings (folders, secrets, ...) come from a json settings file, see config.py.
+Only the plot, publish and watch commands import plotly, and nothing is fetched until a command needs it.
+Other one-off jobs are plain functions:
+ - rebuild_csvs(loc) if the column headers get misformatted
+ - local_store.csvs_to_store(CSV_FOLDER, STORE_FOLDER, loc, location_ids[loc]) once per location
+   before setting STORE_FORMAT = "parquet"
+"""
 
-print("--- %s seconds ---" % (time.time() - start_time))
+def make_parser():
+    parser = argparse.ArgumentParser(description="HydroVu water quality data: update, clean, plot and publish")
+    parser.add_argument("--config", help="json settings file (default: $HYDROVU_CONFIG or hydrovu_config.json)")
+    parser.add_argument("--report", help="where to write the run report (default: RUN_REPORT_PATH)")
+    commands = parser.add_subparsers(dest="command")
+
+    update_parser = commands.add_parser("update", help="append new HydroVu data for each location")
+    update_parser.add_argument("--locations", nargs="+", help="location names (default: all)")
+    update_parser.add_argument("--sequential", action="store_true", help="one location at a time")
+
+    backfill_parser = commands.add_parser("backfill", help="build a location's data from scratch")
+    backfill_parser.add_argument("location")
+    backfill_parser.add_argument("days", type=int, help="how many days in the past to start")
+    backfill_parser.add_argument("--sequential", action="store_true",
+                                 help="page through the whole range in one go (build_csv) instead of parallel windows")
+
+    replay_parser = commands.add_parser("replay", help="rebuild locations' data from the page cache, without HydroVu")
+    replay_parser.add_argument("--locations", nargs="+", help="location names (default: all)")
+    replay_parser.add_argument("--force", action="store_true",
+                               help="replay even where stored readings are no longer cached (they are dropped)")
+
+    clean_parser = commands.add_parser("clean", help="flag readings with the QC rules in QC_RULES")
+    clean_parser.add_argument("--locations", nargs="+", help="location names (default: all)")
+    clean_parser.add_argument("--full", action="store_true", help="re-check every row, e.g. after changing the rules")
+
+    plot_parser = commands.add_parser("plot", help="write the plots to a local folder without publishing")
+    plot_parser.add_argument("--output", help="folder for the html (default: PLOT_OUTPUT_FOLDER)")
+    plot_parser.add_argument("--per-location", action="store_true", help="also plot each location's parameters")
+    plot_parser.add_argument("--weather", action="store_true", help="also plot the weather station data")
+
+    publish_parser = commands.add_parser("publish", help="render changed plots and push them to GitHub")
+    publish_parser.add_argument("--per-location", action="store_true", help="also publish each location's parameters")
+    publish_parser.add_argument("--weather", action="store_true", help="also publish the weather station plots")
+
+    watch_parser = commands.add_parser("watch", help="keep polling HydroVu and publish new data within minutes")
+    watch_parser.add_argument("--locations", nargs="+", help="location names (default: all)")
+    watch_parser.add_argument("--per-location", action="store_true", help="also publish each location's parameters")
+    watch_parser.add_argument("--output", help="write the html to this folder instead of publishing to GitHub")
+    return parser
+
+def check_locations(names):
+    unknown = [name for name in names or [] if name not in location_ids]
+    if unknown:
+        raise SystemExit(f"Unknown locations: {', '.join(unknown)}")
+    return names or list(location_ids)
+
+# Returns the process exit code: 1 if any location failed to update
+def cli(argv=None):
+    args = make_parser().parse_args(argv)
+    configure(args.config)
+    exit_code = 0
+
+    if args.command in ("update", "backfill", "watch", None):
+        sync_locations()
+
+    if args.command in ("update", None):
+        locs = check_locations(getattr(args, "locations", None))
+        failures = update_all_locations(locs, concurrent=not getattr(args, "sequential", False))
+        exit_code = 1 if failures else 0
+
+    elif args.command == "backfill":
+        check_locations([args.location])
+        if args.sequential:
+            build_csv(args.location, args.days)
+        else:
+            backfill_csv(args.location, args.days)
+
+    elif args.command == "replay":
+        for loc in check_locations(args.locations):
+            replay_location(loc, force=args.force)
+
+    elif args.command == "clean":
+        clean_locations(check_locations(args.locations), full=args.full)
+
+    elif args.command == "plot":
+        output = args.output or PLOT_OUTPUT_FOLDER
+        publisher = FolderPublisher(output)
+        render_to(plot_jobs(location_ids, args.per_location, args.weather), publisher)
+        publish_shell(publisher)
+        publisher.publish()
+
+    elif args.command == "watch":
+        watch(check_locations(args.locations), per_location=args.per_location, output=args.output)
+
+    if args.command in ("publish", None):
+        publish_plots(location_ids, per_location=getattr(args, "per_location", False),
+                      weather_plots=getattr(args, "weather", False))
+
+    if page_cache is not None and args.command in ("update", "backfill", None):
+        run_report.count("cached pages evicted", page_cache.evict())
+
+    print("--- %s seconds ---" % (time.time() - start_time))
+    print(hydrovu_client.stats_summary())
+    print(github_client.stats_summary())
+
+    # API calls, retries and bytes per endpoint go into the run report next to the stage timings
+    for client in (oauth_client, hydrovu_client, github_client):
+        run_report.add_api_stats(client)
+    run_report.write(args.report or RUN_REPORT_PATH)
+    print(run_report.summary())
+    return exit_code
+
+
+# Only runs when main.py is run as a script, so the functions above can be imported
+# (for example by bench_ingest.py) without starting an update and publish
+if __name__ == "__main__":
+    sys.exit(cli())
 
 
 #print(convert_dates([1770663600]))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of HydroVu metadata: location ids by name, and parameter and unit names by id.
+
+MetadataRegistry gets everything from HydroVu in one refresh (every page of
+/locations/list and the /sispec/friendlynames definitions, through a fetch function
+main.py supplies) and keeps it in memory. The result is also written to a json cache file,
+so a later run within ttl_seconds starts from the file without calling HydroVu or parsing
+any lookup table. If HydroVu can't be reached, a stale cache (or the fallback, e.g. the old
+lookup csvs) is used instead.
+
+registry.parameters and registry.units are dicts, so they can be passed wherever the
+lookup dicts were (page_decoder.decode_pages). Looking up an id they don't hold refreshes
+the registry once, so a parameter added in HydroVu is picked up in the same run rather than
+failing with a KeyError. Refreshes for missing ids are at most one per refresh_cooldown
+seconds; an id HydroVu itself doesn't know still raises KeyError.
+"""
+
+import json
+import os
+import threading
+import time
+
+import file_io
+
+# The sites this project follows (main.py and the QC clean in data_cleaning.py);
+# their ids are checked against HydroVu's locations list when the registry refreshes
+KNOWN_LOCATIONS = {
+    "Lower Langford Creek AquaTroll" : 4840973161857024,
+    "Radcliffe Outflow AquaTroll" : 5276098860482560,
+    "Millington AquaTroll" : 5687072567394304,
+    "SE Creek AquaTroll" : 6000235094540288,
+    "Shipyard Landing Dock AquaTroll" : 6228783747956736,
+    "Upper East Langford Dock AquaTroll" : 6235146771365888,
+    "Morgan Creek AquaTroll" : 6265987319005184,
+}
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+REFRESH_COOLDOWN_SECONDS = 5 * 60
+
+
+# id -> name dict that asks the registry for ids it doesn't hold
+class LookupMap(dict):
+    def __init__(self, registry, kind):
+        super().__init__()
+        self.registry = registry
+        self.kind = kind
+
+    def __missing__(self, key):
+        return self.registry.resolve(self.kind, key)
+
+
+class MetadataRegistry:
+    """
+    fetch: function returning {"locations" : {name : id}, "parameters" : {id : name}, "units" : {id : name}}
+    cache_path: json file the metadata is kept in between runs (None = memory only)
+    ttl_seconds: how old the cache file may be before HydroVu is asked again
+    fallback: function returning the same shape as fetch, used when HydroVu can't be reached and
+              there is no cache
+    """
+    def __init__(self, fetch, cache_path=None, ttl_seconds=DEFAULT_TTL_SECONDS, fallback=None,
+                 refresh_cooldown=REFRESH_COOLDOWN_SECONDS):
+        self.fetch = fetch
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.fallback = fallback
+        self.refresh_cooldown = refresh_cooldown
+        self.lock = threading.RLock()
+        self.locations = {}
+        self.parameters = LookupMap(self, "parameters")
+        self.units = LookupMap(self, "units")
+        self.fetched_at = None # when the metadata in memory came from HydroVu (epoch seconds)
+        self.last_refresh = None # when this process last asked HydroVu
+        self.loaded = False
+
+    def _apply(self, data):
+        self.locations.update({name : int(loc_id) for name, loc_id in data.get("locations", {}).items()})
+        self.parameters.update({str(key) : name for key, name in data.get("parameters", {}).items()})
+        self.units.update({str(key) : name for key, name in data.get("units", {}).items()})
+
+    def _read_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        with open(self.cache_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_cache(self):
+        if not self.cache_path:
+            return
+        file_io.write_json(self.cache_path, {"fetched_at" : self.fetched_at, "locations" : self.locations,
+                                             "parameters" : dict(self.parameters), "units" : dict(self.units)})
+
+    # Asks HydroVu for everything again and saves it to the cache file
+    def refresh(self):
+        with self.lock:
+            self.last_refresh = time.time()
+            data = self.fetch()
+            self.fetched_at = time.time()
+            self._apply(data)
+            self._write_cache()
+            self.loaded = True
+
+    # Fills the registry once: from the cache file while it is fresh, otherwise from HydroVu
+    # (falling back to a stale cache, then the fallback, if HydroVu can't be reached)
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            cached = self._read_cache()
+            if cached is not None and time.time() - cached.get("fetched_at", 0) < self.ttl_seconds:
+                self.fetched_at = cached["fetched_at"]
+                self._apply(cached)
+                self.loaded = True
+                return
+            try:
+                self.refresh()
+            except Exception as error:
+                if cached is None and self.fallback is None:
+                    raise
+                print(f"Could not refresh the HydroVu metadata ({error}), using the "
+                      f"{'cached copy' if cached is not None else 'fallback lookups'}")
+                self._apply(cached if cached is not None else self.fallback())
+                self.fetched_at = cached.get("fetched_at") if cached is not None else None
+                self.loaded = True
+
+    # Name for an id missing from parameters or units, after refreshing if that hasn't just been done
+    def resolve(self, kind, key):
+        lookup = getattr(self, kind)
+        with self.lock:
+            self.load()
+            if key not in lookup and (self.last_refresh is None
+                                      or time.time() - self.last_refresh >= self.refresh_cooldown):
+                print(f"Unknown {kind[:-1]} id {key}, refreshing the HydroVu metadata")
+                self.refresh()
+            if key in lookup:
+                return dict.__getitem__(lookup, key)
+        raise KeyError(f"HydroVu has no {kind[:-1]} with id {key}")
+
+    def location_ids(self):
+        self.load()
+        return dict(self.locations)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of raw HydroVu data pages, gzipped, keyed by location and startTime.
+
+Every page main.loop_by_date fetches is written to
+    <folder>/<locationId>/<startTime>.json.gz            (or <startTime>-<endTime>.json.gz for a backfill window)
+exactly as HydroVu sent it. Two things use it:
+ - resuming: a page is taken from the cache instead of HydroVu when the page after it is
+   cached too, i.e. when the page was full the last time it was fetched. Readings in the past
+   don't change, so only the newest page of a location (which may still be filling up) is
+   fetched again. A run that failed after fetching picks up where it stopped.
+ - replay: location_pages() yields every cached page of a location in startTime order, so the
+   store can be rebuilt from the cache (main.replay_location) without calling HydroVu.
+
+evict() removes pages cached longer ago than max_age_days, then the oldest pages until the
+cache is under max_bytes. Evicted pages are simply fetched again when needed, but replay can
+only rebuild what is still cached.
+"""
+
+import gzip
+import json
+import os
+import re
+import time
+
+import file_io
+
+PAGE_NAME = re.compile(r"^(\d+)(?:-(\d+))?\.json\.gz$")
+
+
+class PageCache:
+    def __init__(self, folder, max_bytes=None, max_age_days=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+
+    def path(self, location_id, start_time, end_time=None):
+        name = f"{int(start_time)}" if end_time is None else f"{int(start_time)}-{int(end_time)}"
+        return os.path.join(self.folder, str(location_id), f"{name}.json.gz")
+
+    def has(self, location_id, start_time, end_time=None):
+        return os.path.exists(self.path(location_id, start_time, end_time))
+
+    # The parsed page, or None if it isn't cached (or the file can't be read)
+    def get(self, location_id, start_time, end_time=None):
+        path = self.path(location_id, start_time, end_time)
+        try:
+            with gzip.open(path, "rb") as f:
+                return json.loads(f.read())
+        except (OSError, EOFError, ValueError):
+            return None
+
+    # Stores the raw response body of a page
+    def put(self, location_id, start_time, content, end_time=None):
+        with file_io.replacing(self.path(location_id, start_time, end_time)) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                f.write(gzip.compress(content, compresslevel=6))
+
+    # Every cached page of a location, parsed, in startTime order; pages overlap where they were
+    # fetched by different runs, which page_decoder's de-duplication takes care of
+    def location_pages(self, location_id):
+        folder = os.path.join(self.folder, str(location_id))
+        if not os.path.isdir(folder):
+            return
+        keys = []
+        for name in os.listdir(folder):
+            match = PAGE_NAME.match(name)
+            if match:
+                keys.append((int(match.group(1)), int(match.group(2) or 0), name))
+        for start_time, end_time, name in sorted(keys):
+            page = self.get(location_id, start_time, end_time or None)
+            if page is not None:
+                yield page
+
+    # Removes expired pages, then the oldest ones past max_bytes; returns how many were removed
+    def evict(self):
+        if not os.path.isdir(self.folder):
+            return 0
+        files = []
+        for location in os.scandir(self.folder):
+            if location.is_dir():
+                files.extend((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                             for entry in os.scandir(location.path) if PAGE_NAME.match(entry.name))
+        files.sort() # oldest first
+        first = 0 # files[:first] are removed
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            while first < len(files) and files[first][0] < cutoff:
+                first += 1
+        if self.max_bytes is not None:
+            total = sum(size for mtime, size, path in files[first:])
+            while first < len(files) and total > self.max_bytes:
+                total -= files[first][1]
+                first += 1
+        for mtime, size, path in files[:first]:
+            os.remove(path)
+        return first
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass decoder for HydroVu data pages.
+
+Each page (the parsed JSON of one /data call) holds a list of parameters, and each
+parameter holds about 120 timestamp/value readings. Instead of building a small
+DataFrame for every parameter on every page and concatenating them all at the end,
+the readings are copied straight into growable NumPy buffers (one per parameter),
+and each parameter is turned into a DataFrame exactly once.
+"""
+
+import numpy as np
+import pandas as pd
+
+import schema
+
+
+class ParamBuffer:
+    # Growable timestamp/value arrays for one parameter; capacity doubles when full
+    def __init__(self, unit_id, capacity=1024):
+        self.unit_id = unit_id
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    def _grow(self, needed):
+        capacity = len(self.timestamps)
+        while capacity < needed:
+            capacity *= 2
+        self.timestamps = np.resize(self.timestamps, capacity)
+        self.values = np.resize(self.values, capacity)
+
+    def append_readings(self, readings):
+        n = len(readings)
+        if n == 0:
+            return
+        if self.size + n > len(self.timestamps):
+            self._grow(self.size + n)
+        end = self.size + n
+        self.timestamps[self.size:end] = [r["timestamp"] for r in readings]
+        # missing values come through as None, which float64 stores as NaN
+        self.values[self.size:end] = np.array([r["value"] for r in readings], dtype=np.float64)
+        self.size = end
+
+    # Timestamps and values in time order with repeated timestamps removed.
+    # Pages arrive in time order and only repeat the reading at a page boundary, so this is
+    # normally one linear pass; a stable sort is only done if the readings are out of order
+    def sorted_unique(self):
+        timestamps = self.timestamps[:self.size]
+        values = self.values[:self.size]
+        if self.size > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+        keep = np.r_[True, timestamps[1:] != timestamps[:-1]] if self.size > 1 else np.ones(self.size, dtype=bool)
+        return timestamps[keep], values[keep]
+
+
+# Copies every page's readings into per-parameter buffers
+# pages is a list of parsed HydroVu /data JSON dicts, in the order they were fetched
+def buffer_pages(pages):
+    buffers = {}
+    location_id = None
+    for page in pages:
+        location_id = page["locationId"]
+        for param in page["parameters"]:
+            pid = param["parameterId"]
+            if pid not in buffers:
+                buffers[pid] = ParamBuffer(param["unitId"])
+            buffers[pid].append_readings(param["readings"])
+    return location_id, buffers
+
+
+# Decodes a list of pages into one dataframe per parameterId, with the same columns the csvs use:
+# timestamp, value, param_name, unit_name, locationId (in the compact types of schema.py)
+# Each dataframe is sorted by timestamp with no repeated timestamps (the page-boundary duplicates are dropped)
+def decode_pages(pages, parameter_dict, unit_dict):
+    location_id, buffers = buffer_pages(pages)
+    param_dfs = {}
+    for pid, buf in buffers.items():
+        if buf.size == 0:
+            continue
+        timestamps, values = buf.sorted_unique()
+        param_dfs[pid] = pd.DataFrame({
+            "timestamp" : timestamps,
+            "value" : values,
+            "param_name" : schema.label_column(parameter_dict[pid], len(timestamps)),
+            "unit_name" : schema.label_column(unit_dict[buf.unit_id], len(timestamps)),
+            "locationId" : schema.label_column(location_id, len(timestamps)),
+            })
+    return param_dfs
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest for incremental plot regeneration.
+
+For every published figure the manifest (a json file) keeps:
+ - input: a content hash of the readings behind the figure, plus the render settings
+ - output: a sha256 of the html that was last published
+The plotting loop skips rendering a figure whose input hash has not changed, and the
+upload step skips html that is byte-for-byte what is already published. The manifest
+file is only written after a successful publish, so a failed upload is retried next run.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import file_io
+
+
+# Content hash of a figure's readings (timestamp, value and, for all-location figures, locationId)
+def data_fingerprint(df):
+    digest = hashlib.sha256()
+    if not df.empty:
+        digest.update(np.ascontiguousarray(df["timestamp"].to_numpy(dtype=np.int64)).tobytes())
+        digest.update(np.ascontiguousarray(df["value"].to_numpy(dtype=np.float64)).tobytes())
+        if "locationId" in df.columns:
+            digest.update(df["locationId"].astype(str).str.cat(sep=",").encode("utf-8"))
+    return f"{len(df)}:{digest.hexdigest()}"
+
+
+def html_hash(html_text):
+    if isinstance(html_text, str):
+        html_text = html_text.encode("utf-8")
+    return hashlib.sha256(html_text).hexdigest()
+
+
+class PlotManifest:
+    """
+    path: where the manifest json lives
+    render_settings: anything that changes the html for the same data (e.g. downsampling settings);
+                     changing it forces every figure to be rendered again
+    """
+    def __init__(self, path, render_settings=""):
+        self.path = path
+        self.render_settings = str(render_settings)
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self.pending = {}
+
+    # df is None for files that don't come from readings, such as the shared figure script
+    def input_key(self, df):
+        return f"{self.render_settings}|{data_fingerprint(df) if df is not None else ''}"
+
+    # True if the readings (or render settings) behind a figure changed since it was last published
+    def needs_render(self, figure_path, df):
+        entry = self.entries.get(figure_path)
+        return entry is None or entry["input"] != self.input_key(df)
+
+    # True if the html differs from what is already published. Either way the new
+    # input/output hashes are held as pending until save() is called after publishing
+    def needs_upload(self, figure_path, df, html_text):
+        output = html_hash(html_text)
+        entry = self.entries.get(figure_path)
+        self.pending[figure_path] = {"input" : self.input_key(df), "output" : output}
+        return entry is None or entry["output"] != output
+
+    # Call once the publish succeeded
+    def save(self):
+        self.entries.update(self.pending)
+        self.pending = {}
+        file_io.write_json(self.path, self.entries)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Per-site polling schedules for main.py's watch mode.
+
+Each AquaTroll logs on its own interval, and its readings reach HydroVu some time after they
+are taken. SiteSchedule learns both from the timestamps each poll brings back:
+ - cadence: the median step between a site's newest readings
+ - lag: how long after its timestamp a reading was first seen; readings found by a late poll
+   only nudge it upwards, so polling late doesn't teach the schedule to poll later still
+and polls again when the next reading should be on HydroVu: last_seen + cadence + lag.
+
+A poll that finds nothing new backs off: min_interval, then twice that, and so on up to
+max_interval. A site that has gone quiet (pulled for maintenance, flat battery) then costs one
+call every max_interval instead of one every few minutes; its first new reading resets it.
+Failed polls back off the same way. Schedules are saved to a json file so a restarted watch
+keeps what it learned.
+"""
+
+import json
+import os
+
+import numpy as np
+
+import file_io
+
+DEFAULT_CADENCE = 15 * 60 # seconds; until a site has returned two readings in a row
+MIN_INTERVAL = 60
+MAX_INTERVAL = 6 * 60 * 60
+CADENCE_STEPS = 48 # newest steps between readings the cadence is the median of
+LAG_SMOOTHING = 0.2
+
+
+class SiteSchedule:
+    def __init__(self, cadence=DEFAULT_CADENCE, lag=0.0, last_seen=None, next_poll=0.0, quiet_polls=0):
+        self.cadence = cadence
+        self.lag = lag
+        self.last_seen = last_seen # newest reading timestamp (epoch seconds)
+        self.next_poll = next_poll # when the site is due (epoch seconds)
+        self.quiet_polls = quiet_polls # polls in a row that found nothing new
+
+    # Starts a new schedule from a site's stored readings: the cadence and last_seen, without
+    # counting them as new (the site is still polled straight away)
+    def seed(self, timestamps):
+        stamps = np.unique(np.asarray(timestamps, dtype=np.int64))
+        if stamps.size > 1:
+            self.cadence = float(np.median(np.diff(stamps)[-CADENCE_STEPS:]))
+        if stamps.size:
+            self.last_seen = int(stamps[-1])
+
+    def due(self, now):
+        return now >= self.next_poll
+
+    def _back_off(self, now, min_interval, max_interval):
+        self.quiet_polls += 1
+        self.next_poll = now + min(max_interval, min_interval * 2 ** (self.quiet_polls - 1))
+
+    # Updates the schedule with the reading timestamps one poll returned (any parameter, any order,
+    # already-seen ones included); returns how many of them are newer than last_seen (all of them
+    # on a site's first poll)
+    def record(self, now, timestamps, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        stamps = np.unique(np.asarray(timestamps, dtype=np.int64))
+        first_poll = self.last_seen is None
+        new = stamps if first_poll else stamps[stamps > self.last_seen]
+        if new.size == 0:
+            self._back_off(now, min_interval, max_interval)
+            return 0
+
+        steps = np.diff(new if first_poll else np.concatenate(([self.last_seen], new)))
+        if steps.size:
+            self.cadence = float(np.median(steps[-CADENCE_STEPS:]))
+        self.last_seen = int(new[-1])
+        # a first poll (nothing seeded) finds whatever was stored last, however old, which says nothing about the lag
+        if not first_poll:
+            seen_after = min(max(0.0, now - self.last_seen), max_interval)
+            if seen_after < self.lag:
+                self.lag = seen_after
+            else:
+                self.lag += LAG_SMOOTHING * (seen_after - self.lag)
+        self.quiet_polls = 0
+        self.next_poll = max(now + min_interval, self.last_seen + self.cadence + self.lag)
+        return int(new.size)
+
+    def failed(self, now, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        self._back_off(now, min_interval, max_interval)
+
+    def as_dict(self):
+        return {"cadence" : self.cadence, "lag" : self.lag, "last_seen" : self.last_seen,
+                "next_poll" : self.next_poll, "quiet_polls" : self.quiet_polls}
+
+
+# location -> SiteSchedule, from the json file (empty if there is none yet)
+def load_schedules(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {loc : SiteSchedule(**entry) for loc, entry in json.load(f).items()}
+
+
+def save_schedules(path, schedules):
+    if not path:
+        return
+    file_io.write_json(path, {loc : schedule.as_dict() for loc, schedule in schedules.items()})
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative QC rule engine for the location csvs.
+
+A location's csvs are read once into a single long table (timestamp, value, param_name)
+and every rule in the rule list is evaluated on it with vectorized NumPy/pandas operations.
+Each rule gets one bit in an integer flag, so a reading can fail several rules at once.
+
+Rules are plain dicts. Supported types:
+    range    - value outside [min, max] for a parameter
+    rate     - change between consecutive readings faster than max_per_hour
+    flatline - the same value repeated min_repeats or more times in a row (stuck sensor)
+    mask     - cross-parameter: wherever the source parameter is outside [min, max],
+               every parameter in applies_to is flagged at that timestamp
+"param" / "applies_to" can name one parameter, a list of parameters, or "*" for all of them.
+An optional "locations" list limits a rule to those sites (see rules_for).
+
+DEFAULT_RULES only holds the negative depth mask the old cleaner applied. Thresholds for the
+other rule types depend on each site and sonde, so they come from main.py's QC_RULES setting
+(usually a settings file, see config.py), for example
+    {"name" : "ph_range", "type" : "range", "param" : "pH", "min" : 0, "max" : 14}
+    {"name" : "temperature_rate", "type" : "rate", "param" : "Temperature", "max_per_hour" : 5}
+    {"name" : "stuck_sensor", "type" : "flatline", "param" : "Temperature", "min_repeats" : 24,
+     "locations" : ["Millington AquaTroll"]}
+
+Flags are written next to the data in _qc_flags.csv (flagged rows only) instead of
+rewriting the csvs, and drop_flagged() removes flagged readings when loading for plots.
+
+qc_location_incremental() only cleans what was appended since the last run: _qc_state.json
+remembers, for each csv, the byte offset already cleaned, a fingerprint of the bytes before
+it (so a csv rewritten since is noticed and cleaned from the start) and its last few readings
+(the look-back the rate and flatline rules need), so each run reads just the new tail.
+qc_store() and qc_store_incremental() do the same for a location in the parquet store
+(local_store.py), remembering the last cleaned timestamp instead of a byte offset; the
+flags and state files go in the location's store folder.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import file_io
+import local_store
+
+FLAGS_FILE = "_qc_flags.csv"
+STATE_FILE = "_qc_state.json"
+FINGERPRINT_BYTES = 4096 # bytes before a csv's cleaned offset that its fingerprint covers
+
+DEFAULT_RULES = [
+    # negative depth means the sonde was out of the water, so nothing it logged at that time is usable
+    {"name" : "negative_depth", "type" : "mask", "source" : "Depth", "min" : 0, "applies_to" : "*"},
+]
+
+
+# The rules that apply to a location: those without a "locations" list, and those whose list names it
+def rules_for(rules, loc):
+    return [rule for rule in rules if loc in rule.get("locations", [loc])]
+
+
+# The parameter csvs in a location folder, leaving out sidecar files such as _qc_flags.csv
+def param_csvs(folder_path):
+    return [f for f in glob.glob(os.path.join(folder_path, "*.csv"))
+            if not os.path.basename(f).startswith("_")]
+
+
+# Reads every csv in a location folder once, keeping only timestamp and value
+# (the parameter name comes from the file name)
+def load_location(folder_path):
+    frames = []
+    for filename in param_csvs(folder_path):
+        df = pd.read_csv(filename, header=0, usecols=["timestamp", "value"])
+        df["timestamp"] = pd.to_numeric(df["timestamp"], errors="coerce") # repeated header rows become NaN
+        df["value"] = pd.to_numeric(df["value"], errors="coerce")
+        df = df.dropna(subset=["timestamp"])
+        df["param_name"] = os.path.splitext(os.path.basename(filename))[0]
+        frames.append(df)
+    return _long_table(frames)
+
+
+# Reads a location in the parquet store into the same long table; after (param -> timestamp)
+# keeps only each parameter's readings past that timestamp
+def load_store_location(root, loc, after=None):
+    frames = []
+    for param in local_store.list_params(root, loc):
+        start = (after or {}).get(param)
+        df = local_store.read_param(root, loc, param, None if start is None else start + 1,
+                                    columns=["timestamp", "value"])
+        frames.append(df.assign(param_name=param))
+    return _long_table(frames)
+
+
+def _long_table(frames):
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame({"timestamp" : pd.Series(dtype="int64"), "value" : pd.Series(dtype="float64"),
+                             "param_name" : pd.Series(dtype="object")})
+    table = pd.concat(frames, ignore_index=True)
+    table["timestamp"] = table["timestamp"].astype("int64")
+    # rate and flatline rules need each parameter in time order
+    return table.sort_values(["param_name", "timestamp"], kind="stable").reset_index(drop=True)
+
+
+def _rule_params(selector, all_params):
+    if selector == "*":
+        return list(all_params)
+    if isinstance(selector, str):
+        selector = [selector]
+    return [p for p in selector if p in all_params]
+
+
+def _outside(values, rule):
+    bad = np.zeros(len(values), dtype=bool)
+    if rule.get("min") is not None:
+        bad |= values < rule["min"]
+    if rule.get("max") is not None:
+        bad |= values > rule["max"]
+    return bad
+
+
+def _too_fast(timestamps, values, rule):
+    bad = np.zeros(len(values), dtype=bool)
+    if len(values) < 2:
+        return bad
+    seconds = np.diff(timestamps).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_hour = np.abs(np.diff(values)) / seconds * 3600
+    bad[1:] = per_hour > rule["max_per_hour"] # the reading after the jump is the suspect one
+    return bad
+
+
+def _flatlined(values, rule):
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    starts = np.r_[True, values[1:] != values[:-1]] # NaN never equals NaN, so gaps break a run
+    run_ids = np.cumsum(starts)
+    run_lengths = np.bincount(run_ids)[run_ids]
+    return run_lengths >= rule["min_repeats"]
+
+
+"""
+Evaluates every rule on a long table (sorted by param_name, then timestamp, as load_location returns it).
+Returns an int64 array of flag bits, one per row; bit i is set when rules[i] failed.
+"""
+def evaluate_rules(table, rules=DEFAULT_RULES):
+    flags = np.zeros(len(table), dtype=np.int64)
+    rows_by_param = table.groupby("param_name", sort=False).indices # one pass to find every parameter's rows
+    timestamps = table["timestamp"].to_numpy()
+    values = table["value"].to_numpy(dtype=np.float64)
+
+    for bit, rule in enumerate(rules):
+        flag = np.int64(1) << bit
+        if rule["type"] == "mask":
+            source_rows = rows_by_param.get(rule["source"])
+            if source_rows is None:
+                continue
+            bad_times = timestamps[source_rows[_outside(values[source_rows], rule)]]
+            if len(bad_times) == 0:
+                continue
+            for param in _rule_params(rule.get("applies_to", "*"), rows_by_param):
+                rows = rows_by_param[param]
+                flags[rows[np.isin(timestamps[rows], bad_times)]] |= flag
+            continue
+
+        for param in _rule_params(rule.get("param", "*"), rows_by_param):
+            rows = rows_by_param[param]
+            if rule["type"] == "range":
+                bad = _outside(values[rows], rule)
+            elif rule["type"] == "rate":
+                bad = _too_fast(timestamps[rows], values[rows], rule)
+            elif rule["type"] == "flatline":
+                bad = _flatlined(values[rows], rule)
+            else:
+                raise ValueError(f"Unknown QC rule type: {rule['type']}")
+            flags[rows[bad]] |= flag
+    return flags
+
+
+# Flagged rows only, with the names of the rules each one failed
+def flags_table(table, flags, rules=DEFAULT_RULES):
+    flagged = flags != 0
+    out = table.loc[flagged, ["timestamp", "param_name"]].reset_index(drop=True)
+    out["qc_flag"] = flags[flagged]
+    out["qc_rules"] = [";".join(rule["name"] for bit, rule in enumerate(rules) if flag >> bit & 1)
+                       for flag in out["qc_flag"]]
+    return out
+
+
+def write_flags(folder_path, flags_df):
+    with file_io.replacing(os.path.join(folder_path, FLAGS_FILE)) as tmp_path:
+        flags_df.to_csv(tmp_path, index=False)
+
+
+def read_flags(folder_path):
+    path = os.path.join(folder_path, FLAGS_FILE)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, header=0)
+
+
+# True for the rows of a long dataframe (timestamp and param_name columns) that are in flags_df
+def _flagged_rows(df, flags_df):
+    flagged = pd.MultiIndex.from_arrays([flags_df["timestamp"].astype("int64"), flags_df["param_name"].astype(str)])
+    keys = pd.MultiIndex.from_arrays([pd.to_numeric(df["timestamp"]).astype("int64"), df["param_name"].astype(str)])
+    return keys.isin(flagged)
+
+
+# Removes flagged readings from a long dataframe with timestamp and param_name columns
+def drop_flagged(df, flags_df):
+    if flags_df is None or flags_df.empty or df.empty:
+        return df
+    return df[~_flagged_rows(df, flags_df)]
+
+
+# Blanks (NaN) the values of flagged readings instead of removing them, for aggregates such as the
+# rollups that should leave the readings out but keep their timestamps
+def mask_flagged(df, flags_df):
+    if flags_df is None or flags_df.empty or df.empty:
+        return df
+    return df.assign(value=pd.to_numeric(df["value"], errors="coerce").where(~_flagged_rows(df, flags_df)))
+
+
+# Number of earlier readings per parameter the rules need to judge a new reading
+def lookback_rows(rules=DEFAULT_RULES):
+    rows = 0
+    for rule in rules:
+        if rule["type"] == "rate":
+            rows = max(rows, 1)
+        elif rule["type"] == "flatline":
+            rows = max(rows, rule["min_repeats"] - 1)
+    return rows
+
+
+# Forgets where cleaning got to, so the next incremental run checks the folder's data from the start
+def reset_state(folder_path):
+    path = os.path.join(folder_path, STATE_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def load_state(folder_path):
+    path = os.path.join(folder_path, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Saves, per parameter, where cleaning got to (positions: the fields of _csv_position, or "after", the
+# store's last timestamp) and the last readings (with their flags) for the look-back
+def _save_state(folder_path, table, flags, positions, rules):
+    keep = lookback_rows(rules)
+    state = {}
+    tails = pd.DataFrame({"timestamp" : table["timestamp"], "value" : table["value"],
+                          "param_name" : table["param_name"], "qc_flag" : flags})
+    tails = tails.groupby("param_name", sort=False).tail(keep) if keep else tails.iloc[0:0]
+    for param, position in positions.items():
+        tail = tails[tails["param_name"] == param]
+        state[param] = dict(position, tail=[[int(t), float(v), int(f)] for t, v, f in
+                                            zip(tail["timestamp"], tail["value"], tail["qc_flag"])])
+    file_io.write_json(os.path.join(folder_path, STATE_FILE), state, indent=None)
+
+
+# A hash of a csv's header and the FINGERPRINT_BYTES before offset: it changes when the csv is
+# rewritten (rebuild_csvs, replay) even if the rewrite is as long or longer, but not when rows are appended
+def _fingerprint(filename, offset):
+    with open(filename, "rb") as f:
+        header = f.readline()
+        f.seek(max(0, offset - FINGERPRINT_BYTES))
+        before = f.read(max(0, offset - f.tell()))
+    return hashlib.sha1(header + before).hexdigest()
+
+
+# Where cleaning a csv of the given size got to, as saved in the state
+def _csv_position(filename, size):
+    return {"offset" : size, "check" : _fingerprint(filename, size)}
+
+
+# Reads the rows of a csv that start at a byte offset (the header row is read separately for the column names)
+def _read_from_offset(filename, offset):
+    with open(filename, "rb") as f:
+        names = f.readline().decode("utf-8").strip().split(",")
+        f.seek(max(offset, f.tell()))
+        df = pd.read_csv(f, header=None, names=names, usecols=["timestamp", "value"])
+    df["timestamp"] = pd.to_numeric(df["timestamp"], errors="coerce")
+    df["value"] = pd.to_numeric(df["value"], errors="coerce")
+    return df.dropna(subset=["timestamp"])
+
+
+# Loads a location folder once, runs every rule, and writes _qc_flags.csv next to the csvs
+def qc_location(folder_path, rules=DEFAULT_RULES):
+    positions = {os.path.splitext(os.path.basename(f))[0] : _csv_position(f, os.path.getsize(f))
+                 for f in param_csvs(folder_path)}
+    return _qc_table(folder_path, load_location(folder_path), positions, rules)
+
+
+# qc_location for a location in the parquet store
+def qc_store(root, loc, rules=DEFAULT_RULES):
+    table = load_store_location(root, loc)
+    last = {param : {"after" : int(stamps.max())}
+            for param, stamps in table.groupby("param_name", sort=False)["timestamp"]}
+    return _qc_table(os.path.join(root, loc), table, last, rules)
+
+
+def _qc_table(folder_path, table, positions, rules):
+    flags = evaluate_rules(table, rules)
+    flags_df = flags_table(table, flags, rules)
+    write_flags(folder_path, flags_df)
+    _save_state(folder_path, table, flags, positions, rules)
+    print(f"{folder_path}: {len(flags_df)} of {len(table)} readings flagged")
+    return flags_df
+
+
+"""
+Cleans only the rows appended since the last run, plus the remembered look-back rows,
+and appends any new flags to _qc_flags.csv. A csv that is new, or that was rewritten
+since (rebuild_csvs or a replay: it got shorter, or its fingerprint changed), is read in
+full, and a rewritten csv's earlier flags are replaced. Without any saved state this falls
+back to a full qc_location run.
+"""
+def qc_location_incremental(folder_path, rules=DEFAULT_RULES):
+    state = load_state(folder_path)
+    if not state or not os.path.exists(os.path.join(folder_path, FLAGS_FILE)):
+        return qc_location(folder_path, rules)
+
+    frames = []
+    positions = {}
+    rewritten = [] # parameters whose csv was rewritten since the last run
+    for filename in param_csvs(folder_path):
+        param = os.path.splitext(os.path.basename(filename))[0]
+        size = os.path.getsize(filename)
+        entry = state.get(param)
+        if entry is not None and (entry["offset"] > size or entry.get("check") != _fingerprint(filename, entry["offset"])):
+            rewritten.append(param)
+            entry = None
+        if entry is None:
+            entry = {"offset" : 0, "tail" : []}
+        positions[param] = _csv_position(filename, size)
+        if entry["offset"] == size and not entry["tail"]:
+            continue
+
+        new_rows = _read_from_offset(filename, entry["offset"]) if entry["offset"] < size else None
+        frames.append(_increment_frame(param, entry["tail"], new_rows))
+    return _qc_increment(folder_path, frames, positions, rules, rewritten)
+
+
+# qc_location_incremental for a location in the parquet store: each parameter's readings past its
+# last cleaned timestamp are read, plus the remembered look-back rows
+def qc_store_incremental(root, loc, rules=DEFAULT_RULES):
+    folder_path = os.path.join(root, loc)
+    state = load_state(folder_path)
+    if not state or not os.path.exists(os.path.join(folder_path, FLAGS_FILE)):
+        return qc_store(root, loc, rules)
+
+    after = {param : entry["after"] for param, entry in state.items() if entry.get("after") is not None}
+    table = load_store_location(root, loc, after)
+    new_by_param = dict(tuple(table.groupby("param_name", sort=False)))
+    frames = []
+    last = {}
+    for param in local_store.list_params(root, loc):
+        entry = state.get(param, {"after" : None, "tail" : []})
+        new_rows = new_by_param.get(param)
+        last[param] = int(new_rows["timestamp"].max()) if new_rows is not None else entry.get("after")
+        if new_rows is None and not entry["tail"]:
+            continue
+        frames.append(_increment_frame(param, entry["tail"], new_rows))
+    return _qc_increment(folder_path, frames, {p : {"after" : t} for p, t in last.items() if t is not None}, rules)
+
+
+# One parameter's rows for an incremental run: the remembered look-back rows, then the new ones
+def _increment_frame(param, tail, new_rows):
+    tail = pd.DataFrame(tail, columns=["timestamp", "value", "old_flag"])
+    tail["is_new"] = False
+    if new_rows is not None:
+        new_rows = new_rows[["timestamp", "value"]].assign(old_flag=0, is_new=True)
+        return pd.concat([tail, new_rows], ignore_index=True).assign(param_name=param)
+    return tail.assign(param_name=param)
+
+
+# Runs the rules over the look-back and new rows, appends the flags that changed and saves the state
+# The earlier flags of the rewritten parameters, whose rows were all read again, are replaced
+def _qc_increment(folder_path, frames, positions, rules, rewritten=()):
+    if not frames:
+        return None
+    table = pd.concat(frames, ignore_index=True)
+    table["timestamp"] = table["timestamp"].astype("int64")
+    table["value"] = table["value"].astype("float64")
+    table = table.sort_values(["param_name", "timestamp"], kind="stable").reset_index(drop=True)
+
+    flags = evaluate_rules(table, rules)
+    # new rows that failed a rule, and look-back rows whose flags changed now that more data is in
+    emit = (flags != 0) & (table["is_new"].to_numpy(dtype=bool) | (flags != table["old_flag"].to_numpy()))
+    new_flags = flags_table(table[emit].reset_index(drop=True), flags[emit], rules)
+    if rewritten:
+        old_flags = read_flags(folder_path)
+        write_flags(folder_path, old_flags[~old_flags["param_name"].isin(rewritten)])
+    new_flags.to_csv(os.path.join(folder_path, FLAGS_FILE), mode="a", index=False, header=False)
+
+    _save_state(folder_path, table, flags, positions, rules)
+    new_count = int(table["is_new"].to_numpy(dtype=bool).sum())
+    print(f"{folder_path}: {len(new_flags)} new flags across {new_count} new readings")
+    return new_flags
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Shared request limiter for running HydroVu calls from several threads at once.
+
+One RateLimiter is shared by every thread: it spaces requests so the whole program
+stays under max_per_second, and caps how many requests can be in flight at the same time.
+Use it as a context manager around each request:
+
+    with limiter:
+        response = requests.get(...)
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, max_per_second, max_in_flight):
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    # Blocks until this thread is allowed to send its next request
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval # reserve the slot before sleeping so threads queue up in order
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __enter__(self):
+        self.in_flight.acquire()
+        try:
+            self.wait()
+        except BaseException:
+            self.in_flight.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.in_flight.release()
+        return False
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Hourly and daily rollups (count, min, mean, max) of every location's parameters.
+
+Rollups live in <location folder>/_rollups/<param>_<hour|day>.csv, one row per bucket
+(bucket = epoch seconds at the start of the UTC hour/day). They are kept up to date as
+readings are stored: update_rollups() aggregates only the newly appended rows, and since
+appended rows always come after the stored ones, only the last bucket of a rollup can
+overlap them. That bucket is read from the end of the file, merged, and rewritten in place.
+
+Long plots read a rollup instead of every raw reading. choose_resolution() picks the
+finest of raw/hour/day that stays under a row limit, so a view over many years costs
+about the same as a view over one. Readings flagged by QC are aggregated as gaps (NaN
+values, see qc_rules.mask_flagged), so their buckets are kept with a count of 0 and plot_rows
+leaves them out. Readings flagged after they were rolled up get their buckets recomputed by
+refresh_buckets().
+"""
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import file_io
+
+ROLLUP_FOLDER = "_rollups"
+RESOLUTIONS = {"hour" : 3600, "day" : 86400}
+ROLLUP_COLUMNS = ["bucket", "count", "min", "mean", "max"]
+
+
+def rollup_path(folder_path, param, resolution):
+    return os.path.join(folder_path, ROLLUP_FOLDER, f"{param}_{resolution}.csv")
+
+
+# count/min/mean/max of the readings in each bucket of the given size
+def aggregate(df, bucket_seconds):
+    values = pd.to_numeric(df["value"], errors="coerce")
+    buckets = pd.to_numeric(df["timestamp"]).astype(np.int64) // bucket_seconds * bucket_seconds
+    grouped = values.groupby(buckets.to_numpy(), sort=True)
+    rollup = pd.DataFrame({"count" : grouped.count(), "min" : grouped.min(),
+                           "mean" : grouped.mean(), "max" : grouped.max()})
+    rollup.index.name = "bucket"
+    return rollup.reset_index()[ROLLUP_COLUMNS]
+
+
+# Combines rollup rows of the same buckets (weighted mean)
+def merge_rollups(*rollups):
+    combined = pd.concat([r for r in rollups if not r.empty], ignore_index=True)
+    if combined.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    combined["weighted"] = combined["mean"].fillna(0) * combined["count"]
+    grouped = combined.groupby("bucket", sort=True)
+    merged = pd.DataFrame({"count" : grouped["count"].sum(), "min" : grouped["min"].min(),
+                           "max" : grouped["max"].max(), "weighted" : grouped["weighted"].sum()})
+    merged["mean"] = merged["weighted"] / merged["count"].where(merged["count"] > 0)
+    return merged.reset_index()[ROLLUP_COLUMNS]
+
+
+# Byte offset and contents of the last row of a csv, or (None, None) if it only has a header
+# A bucket whose readings were all missing or QC-masked has empty min/mean/max, which parse as NaN
+def _last_row(path):
+    offset, line = file_io.last_line(path)
+    if line is None or offset == 0 or line.startswith(b"bucket,"): # the only line is the header
+        return None, None
+    return offset, pd.read_csv(io.BytesIO(line), header=None, names=ROLLUP_COLUMNS,
+                               dtype={"bucket" : np.int64, "count" : np.int64, "min" : float,
+                                      "mean" : float, "max" : float})
+
+
+# Whole rollups replace the file in one step; appended rows go straight onto the end of it
+def _write(path, rollup, mode="w"):
+    if mode == "a":
+        rollup.to_csv(path, mode="a", index=False, header=False)
+        return
+    with file_io.replacing(path) as tmp_path:
+        rollup.to_csv(tmp_path, index=False)
+
+
+# Adds newly stored readings to the hourly and daily rollups of a parameter
+# A parameter stored before it had rollups gets them built from all of its readings, which
+# stored() returns (df included); without stored() they would only cover df
+def update_rollups(folder_path, param, df, stored=None):
+    if df.empty:
+        return
+    os.makedirs(os.path.join(folder_path, ROLLUP_FOLDER), exist_ok=True)
+    everything = None
+    for resolution, seconds in RESOLUTIONS.items():
+        new = aggregate(df, seconds)
+        path = rollup_path(folder_path, param, resolution)
+        if not os.path.exists(path):
+            if stored is not None and everything is None:
+                everything = stored()
+            _write(path, new if everything is None else aggregate(everything, seconds))
+            continue
+        offset, last = _last_row(path)
+        if last is None:
+            _write(path, new, mode="a")
+        elif new["bucket"].iloc[0] > last["bucket"].iloc[0]:
+            _write(path, new, mode="a") # starts a new bucket, nothing to merge
+        elif new["bucket"].iloc[0] == last["bucket"].iloc[0]:
+            # the new rows continue the last bucket: replace that row with the merged one
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+            _write(path, merge_rollups(last, new), mode="a")
+        else:
+            # older readings than the rollup already holds (not produced by update_csv): merge the whole file
+            _write(path, merge_rollups(pd.read_csv(path), new))
+
+
+# Recomputes the buckets holding the given timestamps from readings, which must cover whole days
+# around them, e.g. after QC flagged readings that were already rolled up
+def refresh_buckets(folder_path, param, timestamps, readings):
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    for resolution, seconds in RESOLUTIONS.items():
+        path = rollup_path(folder_path, param, resolution)
+        if not os.path.exists(path):
+            continue
+        buckets = np.unique(timestamps // seconds * seconds)
+        fresh = aggregate(readings, seconds)
+        rollup = pd.read_csv(path)
+        rollup = pd.concat([rollup[~rollup["bucket"].isin(buckets)], fresh[fresh["bucket"].isin(buckets)]],
+                           ignore_index=True)
+        _write(path, rollup.sort_values("bucket", kind="stable"))
+
+
+# Replaces a parameter's rollups with ones built from df (e.g. after build_csv or a QC rule change)
+def write_rollups(folder_path, param, df):
+    os.makedirs(os.path.join(folder_path, ROLLUP_FOLDER), exist_ok=True)
+    for resolution, seconds in RESOLUTIONS.items():
+        _write(rollup_path(folder_path, param, resolution), aggregate(df, seconds))
+
+
+# A parameter's rollup, limited to buckets overlapping [start, end] when given; None if there is no rollup
+def read_rollup(folder_path, param, resolution, start=None, end=None):
+    path = rollup_path(folder_path, param, resolution)
+    if not os.path.exists(path):
+        return None
+    rollup = pd.read_csv(path)
+    if start is not None:
+        rollup = rollup[rollup["bucket"] + RESOLUTIONS[resolution] > start]
+    if end is not None:
+        rollup = rollup[rollup["bucket"] <= end]
+    return rollup.reset_index(drop=True)
+
+
+# The finest resolution ("raw", "hour" or "day") that stays under max_rows for the time span
+# raw_rows is the number of readings in the span (the sum of the daily counts)
+def choose_resolution(raw_rows, span_seconds, max_rows):
+    if raw_rows <= max_rows:
+        return "raw"
+    for resolution, seconds in RESOLUTIONS.items():
+        if span_seconds / seconds <= max_rows:
+            return resolution
+    return list(RESOLUTIONS)[-1]
+
+
+# Rollup rows -> timestamp/value rows for plotting: each bucket's min and max, so spikes stay
+# visible the way they do with minmax downsampling. Empty buckets are left out
+def plot_rows(rollup, resolution):
+    rollup = rollup[rollup["count"] > 0]
+    half = RESOLUTIONS[resolution] // 2
+    timestamps = np.column_stack([rollup["bucket"].to_numpy(), rollup["bucket"].to_numpy() + half]).ravel()
+    values = np.column_stack([rollup["min"].to_numpy(), rollup["max"].to_numpy()]).ravel()
+    return pd.DataFrame({"timestamp" : timestamps, "value" : values})
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing and counters for a pipeline run, written out as a json run report.
+
+Wrap each stage of the run in report.stage(name, loc) and count what it processed with
+report.count(name, amount, loc). Stages and counters are kept in total and per location,
+so a slow site or stage on a given night shows up in the report instead of being guessed at.
+API calls, errors, retries and bytes come from the ApiClient counters (add_api_stats).
+
+profile_stage names one stage to run under cProfile; its stats are dumped next to the
+report (<report>.<stage>.prof, readable with pstats or snakeviz). cProfile only follows
+the thread that enabled it, so with parallel locations one entry of the stage is profiled
+at a time and entries made meanwhile by other threads are skipped.
+"""
+
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import file_io
+
+
+class RunReport:
+    def __init__(self, profile_stage=None):
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.profile_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.api = {}
+
+    def _add_time(self, name, loc, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(name, {"calls" : 0, "total_seconds" : 0.0, "max_seconds" : 0.0,
+                                                  "by_location" : {}})
+            entry["calls"] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            if loc is not None:
+                entry["by_location"][loc] = entry["by_location"].get(loc, 0.0) + seconds
+
+    # Adds time measured elsewhere, e.g. in a worker process
+    def add_time(self, name, seconds, loc=None):
+        self._add_time(name, loc, seconds)
+
+    # Times the block under the stage name (and the location, if given)
+    @contextmanager
+    def stage(self, name, loc=None):
+        profiling = name == self.profile_stage and self.profile_lock.acquire(blocking=False)
+        if profiling:
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_time(name, loc, time.perf_counter() - start)
+            if profiling:
+                self.profiler.disable()
+                self.profile_lock.release()
+
+    # Adds to a counter such as rows decoded or pages fetched
+    def count(self, name, amount=1, loc=None):
+        with self.lock:
+            entry = self.counters.setdefault(name, {"total" : 0, "by_location" : {}})
+            entry["total"] += int(amount)
+            if loc is not None:
+                entry["by_location"][loc] = entry["by_location"].get(loc, 0) + int(amount)
+
+    # Copies an ApiClient's per-endpoint calls, errors, retries, bytes and latency into the report
+    def add_api_stats(self, client):
+        with client.stats_lock:
+            stats = {endpoint : dict(entry) for endpoint, entry in client.stats.items()}
+        with self.lock:
+            self.api.update(stats)
+
+    def as_dict(self):
+        with self.lock:
+            return {"started" : self.started.isoformat(timespec="seconds"),
+                    "total_seconds" : round(time.perf_counter() - self.start, 3),
+                    "stages" : json.loads(json.dumps(self.stages)),
+                    "counters" : json.loads(json.dumps(self.counters)),
+                    "api" : json.loads(json.dumps(self.api)),
+                    "profiled_stage" : self.profile_stage}
+
+    # Writes the json report, plus the cProfile stats of the profiled stage
+    def write(self, path):
+        file_io.write_json(path, self.as_dict())
+        if self.profiler is not None:
+            self.profiler.dump_stats(f"{os.path.splitext(path)[0]}.{self.profile_stage}.prof")
+
+    # Slowest stages first, e.g. for printing at the end of a run
+    def summary(self):
+        lines = []
+        with self.lock:
+            for name, entry in sorted(self.stages.items(), key=lambda item: -item[1]["total_seconds"]):
+                lines.append(f"{name}: {entry['total_seconds']:.3f}s over {entry['calls']} calls")
+                slowest = sorted(entry["by_location"].items(), key=lambda item: -item[1])[:3]
+                if slowest:
+                    lines.append("    slowest: " + ", ".join(f"{loc} {seconds:.3f}s" for loc, seconds in slowest))
+            for name, entry in sorted(self.counters.items()):
+                lines.append(f"{name}: {entry['total']}")
+        return "\n".join(lines)
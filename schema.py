@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory column types for reading dataframes (timestamp, value, param_name, unit_name, locationId).
+
+Read with default types, every row of a reading frame carries its own copy of the parameter
+name, unit name and locationId, which costs more than the reading itself. compact_frame()
+gives every frame the same small types instead:
+ - param_name, unit_name, locationId: categorical (one-byte codes per row, each name stored once)
+ - timestamp: int64 epoch seconds
+ - value: float64 as stored, or float32 (PLOT_VALUE_DTYPE, main.py's default) for frames that are only plotted
+Decoded pages (page_decoder) and loaded csvs/parquet (main.dfs_from_storage) come out in
+these types, and concat_frames() joins frames without falling back to per-row objects.
+
+Values stay float64 wherever they can be written back to storage, so storing never loses
+digits. Float32 is only used for the long tables behind the plots, and exact_float64()
+restores the decimals a reading was stored with before it goes into a figure.
+"""
+
+import numpy as np
+import pandas as pd
+
+READING_COLUMNS = ["timestamp", "value", "param_name", "unit_name", "locationId"]
+LABEL_COLUMNS = ["param_name", "unit_name", "locationId"]
+TIMESTAMP_DTYPE = "int64"
+STORED_VALUE_DTYPE = "float64"
+PLOT_VALUE_DTYPE = "float32"
+
+
+# A categorical column holding the same label n times (None gives a column of missing labels)
+def label_column(label, n):
+    if label is None:
+        return pd.Categorical.from_codes(np.full(n, -1, dtype=np.int8), categories=[])
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[label])
+
+
+def empty_frame(value_dtype=STORED_VALUE_DTYPE):
+    return pd.DataFrame({"timestamp" : pd.Series(dtype=TIMESTAMP_DTYPE), "value" : pd.Series(dtype=value_dtype),
+                         **{col : pd.Series(dtype="category") for col in LABEL_COLUMNS}})
+
+
+# The frame with compact column types; columns it doesn't know are kept as they are
+def compact_frame(df, value_dtype=STORED_VALUE_DTYPE):
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if col == "timestamp":
+            series = pd.to_numeric(series).astype(TIMESTAMP_DTYPE)
+        elif col == "value":
+            series = pd.to_numeric(series, errors="coerce").astype(value_dtype)
+        elif col in LABEL_COLUMNS and not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype("category")
+        columns[col] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+# Joins reading frames into one compact frame. pd.concat turns categoricals with different
+# categories into per-row objects, so each label column is first given every frame's categories
+def concat_frames(frames, value_dtype=STORED_VALUE_DTYPE):
+    frames = [compact_frame(df, value_dtype) for df in frames]
+    if not frames:
+        return empty_frame(value_dtype)
+    for col in LABEL_COLUMNS:
+        if not all(col in df.columns for df in frames):
+            continue
+        categories = list(dict.fromkeys(label for df in frames for label in df[col].cat.categories))
+        frames = [df.assign(**{col : df[col].cat.set_categories(categories)}) for df in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+# Float32 readings -> float64 of the shortest decimal that gives the same float32, so a reading
+# stored as 12.34 is plotted as 12.34 and not 12.340000152587891. Float64 comes back unchanged
+def exact_float64(values):
+    values = np.asarray(values)
+    if values.dtype != np.float32:
+        return values.astype(np.float64, copy=False)
+    return values.astype(str).astype(np.float64)
+
+
+def memory_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+The modules live at the top of the repository, so the tests import them from there.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import fake_hydrovu
+
+
+# main.py pointed at a fake HydroVu (fake_hydrovu.py) with two days of history, keeping every file
+# it writes under tmp_path; yields (main, fake)
+@pytest.fixture
+def fake_main(tmp_path, monkeypatch):
+    import main
+    fake = fake_hydrovu.FakeHydroVu(history_days=2)
+    fake.start()
+    settings = dict(fake.endpoints(), CSV_FOLDER=str(tmp_path / "csv"), BUILD_CSV_FOLDER=str(tmp_path / "csv"),
+                    STORE_FOLDER=str(tmp_path / "store"), PAGE_CACHE_FOLDER=str(tmp_path / "page_cache"),
+                    BACKFILL_FOLDER=str(tmp_path / "backfill"), METADATA_CACHE_PATH=str(tmp_path / "metadata.json"),
+                    PLOT_MANIFEST_PATH=str(tmp_path / "plot_manifest.json"),
+                    RUN_REPORT_PATH=str(tmp_path / "run_report.json"), WATCH_STATE_PATH=str(tmp_path / "watch.json"),
+                    MAX_REQUESTS_PER_SECOND=1000, STORE_FORMAT="csv")
+    for name, value in settings.items():
+        monkeypatch.setattr(main, name, value)
+    main.init_clients()
+    yield main, fake
+    fake.stop()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the incremental cleaning in qc_rules.py.
+"""
+
+import os
+import shutil
+
+import pandas as pd
+
+import qc_rules
+
+RULES = [{"name" : "temperature_range", "type" : "range", "param" : "Temperature", "min" : -5, "max" : 40},
+         {"name" : "temperature_rate", "type" : "rate", "param" : "Temperature", "max_per_hour" : 5}]
+
+
+def write_csv(folder_path, values, start=0):
+    rows = pd.DataFrame({"timestamp" : [start + 900 * i for i in range(len(values))], "value" : values,
+                         "param_name" : "Temperature"})
+    rows.to_csv(os.path.join(folder_path, "Temperature.csv"), index=False)
+
+
+def sorted_flags(folder_path):
+    flags = qc_rules.read_flags(folder_path)
+    return flags.sort_values(["param_name", "timestamp"]).reset_index(drop=True)
+
+
+# A csv rewritten to the same size (rebuild_csvs, replay) is cleaned from the start, not from the old offset
+def test_incremental_after_rewrite_of_same_size(tmp_path):
+    folder_path = str(tmp_path / "site")
+    os.makedirs(folder_path)
+    write_csv(folder_path, ["10.0"] * 20)
+    qc_rules.qc_location(folder_path, RULES)
+    assert qc_rules.read_flags(folder_path).empty
+
+    size = os.path.getsize(os.path.join(folder_path, "Temperature.csv"))
+    write_csv(folder_path, ["10.0"] * 5 + ["99.0"] + ["10.0"] * 14) # same length, one reading out of range
+    assert os.path.getsize(os.path.join(folder_path, "Temperature.csv")) == size
+    qc_rules.qc_location_incremental(folder_path, RULES)
+
+    full_path = str(tmp_path / "full")
+    shutil.copytree(folder_path, full_path)
+    qc_rules.qc_location(full_path, RULES)
+    pd.testing.assert_frame_equal(sorted_flags(folder_path), sorted_flags(full_path))
+    assert 4500 in qc_rules.read_flags(folder_path)["timestamp"].tolist()
+
+
+# Same for a rewrite that is longer, whose old offset would land in the middle of a row
+def test_incremental_after_longer_rewrite(tmp_path):
+    folder_path = str(tmp_path / "site")
+    os.makedirs(folder_path)
+    write_csv(folder_path, ["10.0"] * 20)
+    qc_rules.qc_location(folder_path, RULES)
+    write_csv(folder_path, ["10.25"] * 3 + ["-9.5"] + ["10.25"] * 30)
+    qc_rules.qc_location_incremental(folder_path, RULES)
+    qc_rules.qc_location_incremental(folder_path, RULES) # nothing new: the flags stay as they are
+
+    full_path = str(tmp_path / "full")
+    shutil.copytree(folder_path, full_path)
+    qc_rules.qc_location(full_path, RULES)
+    pd.testing.assert_frame_equal(sorted_flags(folder_path), sorted_flags(full_path))
+
+
+# A rule with a locations list only applies to those sites
+def test_rules_for_location():
+    site_rule = dict(RULES[0], locations=["Millington AquaTroll"])
+    rules = [RULES[1], site_rule]
+    assert qc_rules.rules_for(rules, "Millington AquaTroll") == rules
+    assert qc_rules.rules_for(rules, "SE Creek AquaTroll") == [RULES[1]]
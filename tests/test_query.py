@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the time-window reads: csv_index.read_window and main.query.
+"""
+
+import pandas as pd
+import pytest
+
+import csv_index
+
+LOC = "Millington AquaTroll"
+WINDOWS = [(None, None), (0, 900 * 10), (900 * 7 + 1, 900 * 60), (900 * 95, None), (900 * 500, 900 * 600)]
+
+
+def write_csv(filename, first, count, mode="w"):
+    rows = pd.DataFrame({"timestamp" : [900 * i for i in range(first, first + count)],
+                         "value" : [i / 4 for i in range(first, first + count)]})
+    rows.to_csv(filename, mode=mode, index=False, header=(mode == "w"))
+
+
+def expected(filename, start, end):
+    df = pd.read_csv(filename)
+    keep = pd.Series(True, index=df.index)
+    if start is not None:
+        keep &= df["timestamp"] >= start
+    if end is not None:
+        keep &= df["timestamp"] <= end
+    return df[keep].reset_index(drop=True)
+
+
+# Windows read through the index match a filtered full read, before and after appends and rewrites
+def test_read_window_matches_full_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_index, "INDEX_EVERY", 7)
+    filename = str(tmp_path / "Depth.csv")
+    write_csv(filename, 0, 100)
+    for start, end in WINDOWS:
+        pd.testing.assert_frame_equal(csv_index.read_window(filename, start, end), expected(filename, start, end))
+
+    write_csv(filename, 100, 30, mode="a") # the index only extends over the new rows
+    rows_before = csv_index.load_index(filename)["rows"]
+    for start, end in WINDOWS:
+        pd.testing.assert_frame_equal(csv_index.read_window(filename, start, end), expected(filename, start, end))
+    assert csv_index.load_index(filename)["rows"] == rows_before + 30
+
+    write_csv(filename, 3, 127) # rewritten in place without dropping the index
+    for start, end in WINDOWS:
+        pd.testing.assert_frame_equal(csv_index.read_window(filename, start, end), expected(filename, start, end))
+
+
+# query() reads the same window from either store format, with the QC-flagged readings left out
+@pytest.mark.parametrize("store_format", ["csv", "parquet"])
+def test_query_window(fake_main, monkeypatch, store_format):
+    main, fake = fake_main
+    monkeypatch.setattr(main, "STORE_FORMAT", store_format)
+    main.build_csv(LOC, 3)
+    everything = main.query(LOC, ["Depth", "Temperature"])
+    start, end = fake.end_time - 86400, fake.end_time - 3600
+    window = main.query(LOC, ["Depth", "Temperature"], start, end)
+    in_window = everything[(everything["timestamp"] >= start) & (everything["timestamp"] <= end)]
+    pd.testing.assert_frame_equal(window.reset_index(drop=True), in_window.reset_index(drop=True))
+    assert 0 < len(window) < len(everything)
+    assert set(window["param_name"]) == {"Depth", "Temperature"}
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for main.replay_location, which rebuilds a location's data from the page cache.
+"""
+
+import os
+
+import pandas as pd
+
+import local_store
+import watermarks
+
+LOC = "Millington AquaTroll"
+
+
+def stored_csv(main, param="Depth"):
+    return pd.read_csv(os.path.join(main.CSV_FOLDER, LOC, f"{param}.csv"))
+
+
+# Evicting the oldest cached page would make a replay drop the readings it held, so the location is left alone
+def test_replay_after_eviction_keeps_stored_history(fake_main):
+    main, fake = fake_main
+    main.build_csv(LOC, 3)
+    before = stored_csv(main)
+    main.page_cache.max_bytes = sum(entry.stat().st_size for entry in
+                                    os.scandir(os.path.join(main.PAGE_CACHE_FOLDER, str(main.location_ids[LOC])))) - 1
+    assert main.page_cache.evict() == 1
+
+    data_pages = fake.counters["data_pages"]
+    assert main.replay_location(LOC) is False
+    pd.testing.assert_frame_equal(stored_csv(main), before)
+
+    # forced, the replay keeps only what is still cached, and the watermark follows the rewritten csv
+    assert main.replay_location(LOC, force=True) is True
+    after = stored_csv(main)
+    assert 0 < len(after) < len(before)
+    assert after["timestamp"].isin(before["timestamp"]).all()
+    folder_path = os.path.join(main.CSV_FOLDER, LOC)
+    assert watermarks.param_watermark(folder_path, "Depth") == after["timestamp"].iloc[-1]
+    assert fake.counters["data_pages"] == data_pages # never went to HydroVu
+
+
+# In the parquet store the replayed readings replace the stored ones instead of merging into them
+def test_replay_replaces_stored_readings(fake_main, monkeypatch):
+    main, fake = fake_main
+    monkeypatch.setattr(main, "STORE_FORMAT", "parquet")
+    main.build_csv(LOC, 3)
+    built = local_store.read_param(main.STORE_FOLDER, LOC, "Depth")
+
+    # readings decoded differently before, e.g. by an older decoder
+    for path in local_store.partition_files(main.STORE_FOLDER, LOC, "Depth"):
+        part = pd.read_parquet(path)
+        part.assign(value=part["value"] * 0 - 1).to_parquet(path, index=False)
+    main.rollups.write_rollups(os.path.join(main.STORE_FOLDER, LOC), "Depth",
+                               local_store.read_param(main.STORE_FOLDER, LOC, "Depth"))
+
+    assert main.replay_location(LOC) is True
+    replayed = local_store.read_param(main.STORE_FOLDER, LOC, "Depth")
+    pd.testing.assert_frame_equal(replayed, built)
+    hourly = main.rollups.read_rollup(os.path.join(main.STORE_FOLDER, LOC), "Depth", "hour")
+    assert hourly["min"].min() == built["value"].min()
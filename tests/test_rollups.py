@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the incremental rollups in rollups.py.
+"""
+
+import numpy as np
+import pandas as pd
+
+import qc_rules
+import rollups
+
+
+def readings(timestamps, values, param="Depth"):
+    return pd.DataFrame({"timestamp" : timestamps, "value" : values, "param_name" : param})
+
+
+# Appending after a bucket with no usable readings merges into it the same as a one-pass aggregate
+def test_append_after_all_missing_bucket(tmp_path):
+    first = readings([0, 900, 1800, 3600, 4500], [1.0, 2.0, 3.0, np.nan, np.nan])
+    second = readings([5400, 7200], [4.0, 5.0])
+    rollups.update_rollups(str(tmp_path), "Depth", first)
+    rollups.update_rollups(str(tmp_path), "Depth", second)
+
+    everything = pd.concat([first, second], ignore_index=True)
+    for resolution, seconds in rollups.RESOLUTIONS.items():
+        stored = rollups.read_rollup(str(tmp_path), "Depth", resolution)
+        pd.testing.assert_frame_equal(stored, rollups.aggregate(everything, seconds), check_dtype=False)
+
+
+# A site's last hour flagged by QC (see main.rollup_input) leaves an empty bucket the next update appends after
+def test_append_after_qc_masked_bucket(tmp_path):
+    first = readings([0, 900, 3600, 4500], [1.0, 1.1, -0.2, -0.3])
+    flags = pd.DataFrame({"timestamp" : [3600, 4500], "param_name" : ["Depth", "Depth"],
+                          "qc_flag" : [1, 1], "qc_rules" : ["negative_depth", "negative_depth"]})
+    rollups.update_rollups(str(tmp_path), "Depth", qc_rules.mask_flagged(first, flags))
+    rollups.update_rollups(str(tmp_path), "Depth", readings([5400, 7200], [1.2, 1.3]))
+
+    hourly = rollups.read_rollup(str(tmp_path), "Depth", "hour")
+    assert hourly["bucket"].tolist() == [0, 3600, 7200]
+    assert hourly["count"].tolist() == [2, 1, 1]
+    assert hourly["min"].tolist() == [1.0, 1.2, 1.3]
+    daily = rollups.read_rollup(str(tmp_path), "Depth", "day")
+    assert daily["count"].tolist() == [4]
+    assert daily["mean"].iloc[0] == np.mean([1.0, 1.1, 1.2, 1.3])
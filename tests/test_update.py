@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for main.update_csv against the fake HydroVu.
+"""
+
+import os
+
+import pytest
+
+LOC = "Millington AquaTroll"
+
+
+# A site with nothing stored yet is skipped instead of failing, in either store format
+@pytest.mark.parametrize("store_format", ["csv", "parquet"])
+def test_update_skips_site_without_data(fake_main, monkeypatch, store_format):
+    main, fake = fake_main
+    monkeypatch.setattr(main, "STORE_FORMAT", store_format)
+    os.makedirs(os.path.join(main.CSV_FOLDER, LOC))
+    assert main.update_csv(LOC) == {}
+    assert fake.counters["data_pages"] == 0
+    assert main.update_all_locations([LOC], concurrent=False) == {}
+
+
+# After a build, an update appends only the readings after the stored ones
+def test_update_appends_after_build(fake_main):
+    main, fake = fake_main
+    fake.end_time -= 6 * 3600
+    main.build_csv(LOC, 3)
+    built = os.path.getsize(os.path.join(main.CSV_FOLDER, LOC, "Depth.csv"))
+    fake.end_time += 6 * 3600
+    loc_dfs = main.update_csv(LOC)
+    assert loc_dfs
+    assert os.path.getsize(os.path.join(main.CSV_FOLDER, LOC, "Depth.csv")) > built
+    timestamps = main.dfs_from_storage(LOC, ["Depth"])[0]["timestamp"]
+    assert timestamps.is_monotonic_increasing and timestamps.is_unique
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for main.watch against the fake HydroVu.
+"""
+
+import os
+
+import poll_schedule
+
+FAILING = "Millington AquaTroll"
+WORKING = "SE Creek AquaTroll"
+
+
+# A site whose poll fails is backed off and polled again, and its new data is then cleaned and published
+def test_watch_retries_failed_site(fake_main, monkeypatch, tmp_path):
+    main, fake = fake_main
+    fake.end_time -= 6 * 3600
+    for loc in (FAILING, WORKING):
+        main.build_csv(loc, 3)
+    fake.end_time += 6 * 3600 # six hours of new readings for both sites
+    monkeypatch.setattr(main, "WATCH_MIN_INTERVAL", 1)
+    monkeypatch.setattr(main, "WATCH_PUBLISH_INTERVAL", 0)
+
+    update_csv = main.update_csv
+    polls = []
+    def flaky_update(loc):
+        polls.append(loc)
+        if loc == FAILING and polls.count(loc) == 1:
+            raise ConnectionError("HydroVu unreachable")
+        return update_csv(loc)
+    monkeypatch.setattr(main, "update_csv", flaky_update)
+    published = []
+    monkeypatch.setattr(main, "publish_changes",
+                        lambda changed, per_location=False, publisher=None: published.append(dict(changed)))
+
+    depth_csv = os.path.join(main.CSV_FOLDER, FAILING, "Depth.csv")
+    built = os.path.getsize(depth_csv)
+    main.watch([FAILING, WORKING], output=str(tmp_path / "out"), rounds=2)
+
+    assert polls.count(FAILING) == 2 and polls.count(WORKING) == 1
+    counters = main.run_report.as_dict()["counters"]
+    assert counters["watch poll failures"]["by_location"] == {FAILING : 1}
+    assert os.path.getsize(depth_csv) > built
+    assert [set(changed) for changed in published] == [{WORKING}, {FAILING}]
+    assert os.path.exists(os.path.join(main.CSV_FOLDER, FAILING, "_qc_flags.csv"))
+    schedule = poll_schedule.load_schedules(main.WATCH_STATE_PATH)[FAILING]
+    assert schedule.quiet_polls == 0 and schedule.last_seen == fake.end_time
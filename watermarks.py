@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Per-location watermark manifest: the last stored timestamp for each parameter.
+
+update_csv only needs the most recent timestamp of a location to know where the next
+HydroVu call should start, so instead of re-reading every parameter file the
+watermarks are kept in <location folder>/_watermarks.json and updated right after
+every append. Files without a manifest entry fall back to reading just the last line.
+"""
+
+import glob
+import json
+import os
+
+import file_io
+
+WATERMARK_FILE = "_watermarks.json"
+
+
+def load_watermarks(folder_path):
+    path = os.path.join(folder_path, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Records the newest timestamp for a parameter (never moves a watermark backwards)
+def record_watermark(folder_path, param, timestamp):
+    marks = load_watermarks(folder_path)
+    timestamp = int(timestamp)
+    if marks.get(param) is not None and marks[param] >= timestamp:
+        return marks
+    marks[param] = timestamp
+
+    # the manifest is either the old or the new version, never half-written
+    file_io.write_json(os.path.join(folder_path, WATERMARK_FILE), marks)
+    return marks
+
+
+# Forgets a parameter's watermark, for readings that are rewritten rather than appended to
+def clear_watermark(folder_path, param):
+    marks = load_watermarks(folder_path)
+    if marks.pop(param, None) is not None:
+        file_io.write_json(os.path.join(folder_path, WATERMARK_FILE), marks)
+
+
+# Reads only the end of a csv to get the timestamp (first column) of its last row
+# Returns None for empty or header-only files
+def tail_timestamp(filename, block_size=1024):
+    offset, line = file_io.last_line(filename, block_size)
+    if line is None:
+        return None
+    first_field = line.split(b",")[0].decode("utf-8", errors="ignore").strip()
+    try:
+        return int(float(first_field))
+    except ValueError: # only the header row is left
+        return None
+
+
+# Last stored timestamp for one parameter: the manifest entry, or else the last line of its csv
+def param_watermark(folder_path, param):
+    marks = load_watermarks(folder_path)
+    if marks.get(param) is not None:
+        return marks[param]
+    filename = os.path.join(folder_path, f"{param}.csv")
+    return tail_timestamp(filename) if os.path.exists(filename) else None
+
+
+# Most recent timestamp across a location folder's csvs, using the manifest wherever possible
+def most_recent_date(folder_path):
+    marks = load_watermarks(folder_path)
+    for filename in glob.glob(os.path.join(folder_path, "*.csv")):
+        if os.path.basename(filename).startswith("_"): # sidecar files such as _qc_flags.csv
+            continue
+        param = os.path.splitext(os.path.basename(filename))[0]
+        if marks.get(param) is None:
+            last_date = tail_timestamp(filename)
+            if last_date is not None:
+                marks[param] = last_date
+    if not marks:
+        return None
+    return max(marks.values())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Weather station data (data/<station>_weather_*.csv) in Python, next to the HydroVu readings.
+
+load_weather() reads the cleaned station csvs with fixed column types and an explicit
+timestamp format, and caches each parsed file as parquet next to a small json record of
+the source file's size and modification time; an unchanged csv is never parsed twice.
+Timestamps become epoch seconds (UTC), the same as HydroVu's, so the two can be joined.
+
+join_weather() attaches weather columns to water quality readings with a nearest-timestamp
+as-of join (pandas merge_asof) within a tolerance, in one vectorized pass.
+
+weather_figure() draws a weather parameter per station the way weather_plotly.R did
+(x in EST, one line per station); main.py publishes them as weather_plots/<column>.html.
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import file_io
+
+# Column name -> type for the cleaned station files; timestamp_est is derived from timestamp_utc
+WEATHER_COLUMNS = {
+    "airtemp_c" : "float64",
+    "dewpoint_c" : "float64",
+    "windchill_c" : "float64",
+    "rh_pct" : "float64",
+    "relairpressure_hpa" : "float64",
+    "windspeed_mps" : "float64",
+    "winddir_degree" : "float64",
+    "precipintensity_mmph" : "float64",
+    "preciptype" : "Int16",
+}
+
+# The parameters on the Weather Data page, with their display names (as in weather_data.html)
+WEATHER_DISPLAY_NAMES = {
+    "airtemp_c" : "Air Temperature (C)",
+    "dewpoint_c" : "Dew Point (C)",
+    "windchill_c" : "Wind Chill (C)",
+    "precipintensity_mmph" : "Precipitation Intensity (mm/h)",
+    "relairpressure_hpa" : "Relative Air Pressure (hPa)",
+    "rh_pct" : "Relative Humidity (%)",
+    "windspeed_mps" : "Wind Speed (m/s)",
+    "winddir_degree" : "Wind Direction (degrees)",
+}
+
+# Columns attached to water quality readings by default
+JOIN_COLUMNS = ["airtemp_c", "relairpressure_hpa", "precipintensity_mmph"]
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+EST_OFFSET_SECONDS = -5 * 3600
+
+
+# Station code from a file name such as ces_weather_2025-08-07-000000_2026-07-16-130000.csv -> "CES"
+def station_name(filename):
+    return os.path.basename(filename).split("_weather")[0].upper()
+
+
+def parse_weather_csv(filename):
+    header = pd.read_csv(filename, nrows=0).columns
+    dtypes = {col : dtype for col, dtype in WEATHER_COLUMNS.items() if col in header}
+    df = pd.read_csv(filename, usecols=["timestamp_utc"] + list(dtypes), dtype=dtypes)
+    stamps = pd.to_datetime(df.pop("timestamp_utc"), format=TIMESTAMP_FORMAT)
+    df.insert(0, "timestamp", stamps.to_numpy(dtype="datetime64[s]").astype(np.int64))
+    df.insert(1, "station", station_name(filename))
+    return df
+
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {"size" : stat.st_size, "mtime_ns" : stat.st_mtime_ns}
+
+
+# Parsed file from the cache if the source csv is unchanged, otherwise parsed and cached again
+def load_weather_file(filename, cache_folder=None):
+    if cache_folder is None:
+        return parse_weather_csv(filename)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    cache_path = os.path.join(cache_folder, f"{stem}.parquet")
+    stamp_path = os.path.join(cache_folder, f"{stem}.json")
+    stamp = _source_stamp(filename)
+    if os.path.exists(cache_path) and os.path.exists(stamp_path):
+        with open(stamp_path, encoding="utf-8") as f:
+            if json.load(f) == stamp:
+                return pd.read_parquet(cache_path)
+
+    df = parse_weather_csv(filename)
+    with file_io.replacing(cache_path) as tmp_path:
+        df.to_parquet(tmp_path, index=False)
+    file_io.write_json(stamp_path, stamp, indent=None)
+    return df
+
+
+# Every station file matching pattern, as one table sorted by timestamp (station is categorical)
+def load_weather(pattern, cache_folder=None):
+    frames = [load_weather_file(filename, cache_folder) for filename in sorted(glob.glob(pattern))]
+    if not frames:
+        return pd.DataFrame({"timestamp" : pd.Series(dtype="int64"), "station" : pd.Series(dtype="category")})
+    df = pd.concat(frames, ignore_index=True)
+    df["station"] = df["station"].astype("category")
+    return df.sort_values(["timestamp", "station"], kind="stable").reset_index(drop=True)
+
+
+# Nearest-timestamp join of weather onto water quality readings
+# readings: any dataframe with an epoch-second timestamp column (e.g. main.load_long_table)
+# tolerance: largest gap in seconds between a reading and the weather row joined to it;
+#            readings without weather that close get NaN
+# station: which station to use when the weather table holds several (None = the only one)
+# The readings come back in their original order, with the weather columns added
+def join_weather(readings, weather_df, columns=None, tolerance=900, station=None):
+    columns = list(columns or JOIN_COLUMNS)
+    if station is not None:
+        weather_df = weather_df[weather_df["station"] == station]
+    elif weather_df["station"].nunique() > 1:
+        raise ValueError("The weather table has several stations; pick one with station=")
+    right = weather_df[["timestamp"] + columns].rename(columns={"timestamp" : "weather_timestamp"})
+    right = right.sort_values("weather_timestamp", kind="stable")
+
+    left = readings.reset_index(drop=True)
+    order = np.argsort(left["timestamp"].to_numpy(), kind="stable")
+    left_sorted = left.iloc[order]
+    joined = pd.merge_asof(left_sorted[["timestamp"]].astype({"timestamp" : "int64"}), right,
+                           left_on="timestamp", right_on="weather_timestamp",
+                           direction="nearest", tolerance=int(tolerance))
+    joined.index = left_sorted.index
+    joined = joined.sort_index()
+    result = left.copy()
+    for col in columns:
+        result[col] = joined[col].to_numpy()
+    return result
+
+
+# weather_df columns -> a long table (timestamp, station, param, value) for plotting
+def weather_long(weather_df, columns=None):
+    columns = [col for col in (columns or WEATHER_DISPLAY_NAMES) if col in weather_df.columns]
+    long_df = weather_df.melt(id_vars=["timestamp", "station"], value_vars=columns,
+                              var_name="param", value_name="value")
+    long_df["value"] = long_df["value"].astype("float64")
+    return long_df.dropna(subset=["value"])
+
+
+# Timestamps -> EST datetimes, as weather_plotly.R plotted them (timestamp_est)
+def est_datetimes(timestamps):
+    return pd.to_datetime(np.asarray(timestamps, dtype=np.int64) + EST_OFFSET_SECONDS, unit="s")
+
+
+def weather_figure(param_df, param):
+    import plotly.express as px
+    display_name = WEATHER_DISPLAY_NAMES.get(param, param)
+    return px.line(param_df, x=est_datetimes(param_df["timestamp"]), y="value", color="station",
+                   labels={"station" : "Location", "x" : "Date/Time", "value" : display_name})